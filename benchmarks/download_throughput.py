@@ -0,0 +1,113 @@
+"""
+Compare the old 1 KiB write loop of `download()` with the current one.
+
+Serves a file from a local `http.server` process and downloads it with both
+write paths, reporting throughput and CPU time per MB of this process:
+
+    python benchmarks/download_throughput.py --size 200 --runs 3
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+from rich.console import Console
+
+from pyheadspace import transport
+from pyheadspace.__main__ import _download
+from pyheadspace.manifest import open_manifest
+from pyheadspace.scheduler import Scheduler
+
+MB = 1024 * 1024
+
+
+def legacy_download(url: str, target: str, scheduler: Scheduler):
+    """The write loop as it was before the adaptive buffer."""
+    media = transport.get_session().get(url, stream=True)
+    total_length = int(media.headers.get("content-length"))
+    transfer_id = scheduler.start_transfer("legacy", total_length)
+    with open(target + ".mp4", "wb") as file:
+        for chunk in media.iter_content(chunk_size=1024):
+            file.write(chunk)
+            file.flush()
+            scheduler.advance(transfer_id, len(chunk))
+    scheduler.finish_transfer(transfer_id)
+
+
+def current_download(url: str, target: str, scheduler: Scheduler):
+    directory, name = os.path.split(target)
+    _download(
+        url,
+        name,
+        media_id=name,
+        target=name,
+        manifest=open_manifest(directory),
+        scheduler=scheduler,
+    )
+
+
+def measure(func, url: str, directory: str, run: int, size: int):
+    scheduler = Scheduler(lambda *_: None, console=Console(file=open(os.devnull, "w")))
+    target = os.path.join(directory, f"{func.__name__}-{run}")
+    with scheduler:
+        wall, cpu = time.perf_counter(), time.process_time()
+        func(url, target, scheduler)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    os.remove(target + ".mp4")
+    return size / wall, cpu * 1000 / size
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size", type=int, default=200, help="File size in MB.")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as served, tempfile.TemporaryDirectory() as out:
+        with open(os.path.join(served, "media.mp4"), "wb") as file:
+            for _ in range(args.size):
+                file.write(os.urandom(MB))
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "http.server", str(port), "--bind", "127.0.0.1"],
+            cwd=served,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        url = f"http://127.0.0.1:{port}/media.mp4"
+        try:
+            for _ in range(50):
+                try:
+                    requests.head(url, timeout=1)
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+
+            print(f"{args.size} MB file, best of {args.runs} runs")
+            print(f"{'path':<10}{'MB/s':>10}{'CPU ms/MB':>12}")
+            for func in (legacy_download, current_download):
+                results = [
+                    measure(func, url, out, run, args.size) for run in range(args.runs)
+                ]
+                speed = max(result[0] for result in results)
+                cpu = min(result[1] for result in results)
+                label = func.__name__.split("_")[0]
+                print(f"{label:<10}{speed:>10.1f}{cpu:>12.2f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Memory needed to hold a catalogue and a download plan.
+
+Generates the responses of a mock catalogue and measures with tracemalloc
+how much memory they take as raw JSON:API dicts and as parsed models, then
+how much a plan of one download task per media item takes when every task
+gets its own queued Future and when it waits in the scheduler's backlog:
+
+    python benchmarks/memory.py --packs 300 --sessions 30
+"""
+
+import argparse
+import gc
+import json
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+from mock_headspace import MockConfig, MockHeadspace, activity_id, technique_id
+
+from pyheadspace.models import Entity, Pack, parse_entity, parse_pack
+from pyheadspace.scheduler import DownloadTask, Scheduler
+
+Responses = List[Tuple[int, dict, List[dict], List[dict]]]
+
+
+def measure(build: Callable):
+    """Memory still allocated by the result of `build`, in MB."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return current / 1024 / 1024, result
+
+
+def responses(server: MockHeadspace) -> Responses:
+    # Through JSON like real responses, so no strings are shared by accident
+    def load(body):
+        return json.loads(json.dumps(body))
+
+    config = server.config
+    return [
+        (
+            pack_id,
+            load(server.pack_response(pack_id)),
+            [
+                load(server.activity_response(activity_id(pack_id, i)))
+                for i in range(1, config.sessions + 1)
+            ],
+            [
+                load(server.technique_response(technique_id(pack_id, i)))
+                for i in range(1, config.techniques + 1)
+            ],
+        )
+        for pack_id in range(1, config.packs + 1)
+    ]
+
+
+def parse(raw: Responses) -> List[Tuple[Pack, List[Entity]]]:
+    catalogue = []
+    for pack_id, pack, activities, techniques in raw:
+        entities = [
+            parse_entity("activity", i, response)
+            for i, response in enumerate(activities)
+        ]
+        entities += [
+            parse_entity("technique", i, response)
+            for i, response in enumerate(techniques)
+        ]
+        catalogue.append((parse_pack(pack_id, pack), entities))
+    return catalogue
+
+
+def plan(catalogue) -> List[DownloadTask]:
+    return [
+        DownloadTask(
+            item.id,
+            entity.name,
+            entity.name,
+            pack.name,
+            "out",
+            entity.kind == "technique",
+        )
+        for pack, entities in catalogue
+        for entity in entities
+        for item in entity.media_items
+    ]
+
+
+def queued_futures(tasks: List[DownloadTask], release: threading.Event):
+    """Every task submitted to the pool right away, one Future each."""
+    executor = ThreadPoolExecutor(max_workers=4)
+    futures = [executor.submit(release.wait) for _ in tasks]
+    return executor, futures
+
+
+def scheduler_backlog(tasks: List[DownloadTask], release: threading.Event):
+    scheduler = Scheduler(lambda task, scheduler: release.wait(), jobs=4, quiet=True)
+    scheduler.__enter__()
+    for task in tasks:
+        scheduler.submit(task)
+    return scheduler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--packs", type=int, default=300)
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--techniques", type=int, default=3)
+    args = parser.parse_args()
+
+    config = MockConfig(
+        packs=args.packs, sessions=args.sessions, techniques=args.techniques
+    )
+    with MockHeadspace(config) as server:
+        raw_mb, raw = measure(lambda: responses(server))
+    parsed_mb, catalogue = measure(lambda: parse(raw))
+    del raw
+    tasks = plan(catalogue)
+    print(f"{args.packs} packs, {len(tasks)} media items")
+    print(f"  {raw_mb:8.1f} MB  catalogue as response dicts")
+    print(f"  {parsed_mb:8.1f} MB  catalogue as parsed models")
+    tasks_mb, tasks = measure(lambda: plan(catalogue))
+    print(f"  {tasks_mb:8.1f} MB  plan of download tasks")
+
+    for name, queue in (
+        ("one queued Future per task", queued_futures),
+        ("scheduler backlog", scheduler_backlog),
+    ):
+        release = threading.Event()
+        queued_mb, queued = measure(lambda: queue(tasks, release))
+        print(f"  {queued_mb:8.1f} MB  {name}")
+        release.set()
+        if isinstance(queued, Scheduler):
+            queued.__exit__(None, None, None)
+        else:
+            queued[0].shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Local stand-in for the headspace content API and media CDN.
+
+Serves a generated catalogue of packs, sessions, techniques and everyday
+meditations with configurable latency, bandwidth and error rate. Point the
+client at it with `HEADSPACE_API_URL`:
+
+    python benchmarks/mock_headspace.py --port 8700 --latency 0.05
+    HEADSPACE_API_URL=http://127.0.0.1:8700 headspace pack --all
+"""
+
+import argparse
+import base64
+import datetime
+import functools
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple, Tuple
+from urllib.parse import parse_qs, urlparse
+
+BLOCK = 64 * 1024
+
+
+class MockConfig(NamedTuple):
+    packs: int = 5
+    sessions: int = 4
+    techniques: int = 1
+    # Sessions every pack shares with pack 1, like a session found in several packs
+    shared: int = 0
+    # Distinct everyday sessions that the dates cycle through, 0 for one per date
+    everyday: int = 0
+    # Authors every session is narrated by, besides the default narration
+    authors: int = 0
+    durations: Tuple[int, ...] = (5, 10, 15, 20)
+    # Size of a session in bytes, technique videos are `video_factor` times larger
+    media_size: int = 1024 * 1024
+    video_factor: int = 4
+    # Seconds added to every API response
+    latency: float = 0.0
+    # Bytes per second for each media stream, 0 is unlimited
+    bandwidth: int = 0
+    # Share of API and media requests that fail with 503
+    error_rate: float = 0.0
+    # Share of media responses with a flipped byte, their Content-MD5 is kept
+    corrupt_rate: float = 0.0
+    seed: int = 0
+
+
+def activity_id(pack_id: int, index: int) -> int:
+    return pack_id * 1000 + index
+
+
+def technique_id(pack_id: int, index: int) -> int:
+    return pack_id * 1000 + 500 + index
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server: "MockHeadspace"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/_stats":
+            return self._json(dict(self.server.stats))
+
+        route = self.server.route(url.path)
+        self.server.count(route)
+        if route != "media":
+            time.sleep(self.server.config.latency)
+        if self.server.fail():
+            return self._json({"errors": "unavailable"}, status=503)
+
+        if route == "media":
+            return self._media(url.path.rsplit("/", 1)[-1])
+        handler = getattr(self.server, f"{route}_response", None)
+        if handler is None:
+            return self._json({"errors": "not found"}, status=404)
+        match = re.search(r"/(\d+)(?:/|$)|/media-items/([^/]+)/", url.path)
+        ids = [group for group in match.groups() if group] if match else []
+        return self._json(handler(*ids, **query))
+
+    def _json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/vnd.api+json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _media(self, media_id: str):
+        size = self.server.media_size(media_id)
+        start = 0
+        range_ = re.match(r"bytes=(\d+)-", self.headers.get("range", ""))
+        # A Range with a stale If-Range gets the whole file
+        if_range = self.headers.get("if-range", f'"{media_id}"')
+        if range_ and int(range_.group(1)) < size and if_range == f'"{media_id}"':
+            start = int(range_.group(1))
+            self.send_response(206)
+            self.send_header("content-range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        video = media_id.startswith("t")
+        self.send_header("content-type", "video/mp4" if video else "audio/mpeg")
+        self.send_header("content-length", str(size - start))
+        self.send_header("etag", f'"{media_id}"')
+        if not start:
+            self.send_header("content-md5", self.server.media_md5(media_id))
+        self.end_headers()
+
+        block = self.server.media_block(media_id)
+        if self.server.corrupt():
+            block = bytes([block[0] ^ 0xFF]) + block[1:]
+        bandwidth = self.server.config.bandwidth
+        started = time.monotonic()
+        sent = 0
+        offset = start
+        try:
+            while offset < size:
+                position = offset % BLOCK
+                data = block[position : position + min(BLOCK, size - offset)]
+                self.wfile.write(data)
+                offset += len(data)
+                sent += len(data)
+                if bandwidth:
+                    delay = sent / bandwidth - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.server.count("media_bytes", sent)
+
+
+class MockHeadspace(ThreadingHTTPServer):
+    """
+    Mock server, use as a context manager to run it on a background thread.
+
+    Every request is counted by route, `stats` holds the counts and the
+    number of media bytes sent, they are also served at `/_stats`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, config: MockConfig = MockConfig(), port: int = 0):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.config = config
+        self.stats: Counter = Counter()
+        self._random = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def count(self, route: str, amount: int = 1):
+        with self._lock:
+            self.stats[route] += amount
+
+    def fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.config.error_rate
+
+    def corrupt(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.config.corrupt_rate
+
+    def api_calls(self) -> int:
+        return sum(
+            v for k, v in self.stats.items() if k not in ("media", "media_bytes")
+        )
+
+    @staticmethod
+    def route(path: str) -> str:
+        for pattern, route in (
+            (r"/content/group-collections$", "collection"),
+            (r"/content/activity-groups/\d+$", "pack"),
+            (r"/content/activities/\d+$", "activity"),
+            (r"/content/techniques/\d+$", "technique"),
+            (r"/content/media-items/[^/]+/make-signed-url$", "sign"),
+            (r"/content/view-models/everyday-headspace-banner$", "everyday"),
+            (r"/content-info/skeleton$", "skeleton"),
+            (r"/media/[^/]+$", "media"),
+        ):
+            if re.search(pattern, path):
+                return route
+        return "unknown"
+
+    def media_size(self, media_id: str) -> int:
+        if media_id.startswith("t"):
+            return self.config.media_size * self.config.video_factor
+        return self.config.media_size
+
+    @staticmethod
+    def media_block(media_id: str) -> bytes:
+        seed = hashlib.sha256(media_id.encode()).digest()
+        return seed * (BLOCK // len(seed))
+
+    @functools.lru_cache(maxsize=None)
+    def media_md5(self, media_id: str) -> str:
+        md5 = hashlib.md5()
+        block = self.media_block(media_id)
+        size = self.media_size(media_id)
+        for offset in range(0, size, BLOCK):
+            md5.update(block[: min(BLOCK, size - offset)])
+        return base64.b64encode(md5.digest()).decode()
+
+    def collection_response(self, **query):
+        return {
+            "included": [
+                {"relationships": {"activityGroup": {"data": {"id": str(pack_id)}}}}
+                for pack_id in range(1, self.config.packs + 1)
+            ]
+        }
+
+    def skeleton_response(self, contentId, **query):
+        return {"entityId": int(contentId)}
+
+    def pack_response(self, pack_id, **query):
+        pack_id = int(pack_id)
+        activities = [
+            activity_id(1 if i <= self.config.shared else pack_id, i)
+            for i in range(1, self.config.sessions + 1)
+        ]
+        included = [
+            {
+                "type": "orderedActivities",
+                "relationships": {"activity": {"data": {"id": str(activity)}}},
+            }
+            for activity in activities
+        ]
+        included += [
+            {
+                "type": "orderedTechniques",
+                "relationships": {
+                    "technique": {"data": {"id": str(technique_id(pack_id, i))}}
+                },
+            }
+            for i in range(1, self.config.techniques + 1)
+        ]
+        return {
+            "data": {
+                "attributes": {
+                    "name": f"Pack {pack_id}",
+                    "description": f"Mock pack {pack_id}",
+                }
+            },
+            "included": included,
+        }
+
+    def _session(self, name: str, key: str):
+        return {
+            "data": {"attributes": {"name": name}},
+            "included": [
+                {
+                    "type": "mediaItems",
+                    "id": f"a{key}-{duration}",
+                    "attributes": {"durationInMs": duration * 60 * 1000},
+                }
+                for duration in self.config.durations
+            ],
+        }
+
+    def activity_response(self, entity_id, authorId=None, **query):
+        entity_id = int(entity_id)
+        pack_id, index = divmod(entity_id, 1000)
+        key = str(entity_id)
+        if authorId is not None and 1 <= int(authorId) <= self.config.authors:
+            key += f"n{authorId}"
+        response = self._session(f"Session {index} of Level 1", key)
+        response["included"] += [
+            {"type": "authors", "id": str(author), "attributes": {}}
+            for author in range(1, self.config.authors + 1)
+        ]
+        return response
+
+    def technique_response(self, entity_id, **query):
+        return {
+            "data": {"attributes": {"name": f"Technique {entity_id}"}},
+            "included": [
+                {
+                    "type": "mediaItems",
+                    "id": f"t{entity_id}",
+                    "attributes": {"mimeType": "video/mp4"},
+                }
+            ],
+        }
+
+    def everyday_response(self, date=None, **query):
+        if self.config.everyday:
+            day = datetime.date.fromisoformat(date).toordinal() % self.config.everyday
+            return self._session(f"Everyday {day}", f"e{day}")
+        return self._session(f"Everyday {date}", date)
+
+    def sign_response(self, media_id, **query):
+        expires = int(time.time()) + 3600
+        return {"url": f"{self.url}/media/{media_id}?Expires={expires}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8700)
+    for field, default in MockConfig._field_defaults.items():
+        if field == "durations":
+            continue
+        parser.add_argument(
+            "--" + field.replace("_", "-"), type=type(default), default=default
+        )
+    args = vars(parser.parse_args())
+    port = args.pop("port")
+    with MockHeadspace(MockConfig(**args), port) as server:
+        print(f"Serving mock headspace at {server.url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Measure how long the command line takes to start.
+
+Reports the import time of `pyheadspace.__main__` from `python -X importtime`,
+the slowest modules it imports and the wall time of commands that do not
+touch the network, next to a bare interpreter:
+
+    python benchmarks/startup.py --runs 10
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+COMMANDS = (["--help"], ["help"], ["file"])
+# Modules that should only be imported by commands that need them
+HEAVY = ("jwt", "requests", "urllib3", "rich", "asyncio", "httpx")
+IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def importtime() -> Dict[str, int]:
+    """
+    Cumulative import time in microseconds of `pyheadspace.__main__` and of
+    each module it imports directly, leaving out what the interpreter loads
+    at startup anyway.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import pyheadspace.__main__"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Children are reported before their parent, collect them per top level import
+    children: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME.match(line)
+        if not match:
+            continue
+        depth = len(match.group(3)) // 2
+        name, cumulative = match.group(4), int(match.group(2))
+        if depth == 1:
+            children[name] = cumulative
+        elif depth == 0:
+            if name == "pyheadspace.__main__":
+                return {name: cumulative, **children}
+            children = {}
+    raise RuntimeError("pyheadspace.__main__ missing from the import times")
+
+
+def wall_time(args: List[str], runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(args, capture_output=True, check=True)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    samples = [importtime() for _ in range(args.runs)]
+    best = min(samples, key=lambda times: times["pyheadspace.__main__"])
+    print(f"import pyheadspace.__main__: {best['pyheadspace.__main__'] / 1000:.1f} ms")
+    print("slowest direct imports (cumulative):")
+    ranked = sorted(
+        ((us, name) for name, us in best.items() if name != "pyheadspace.__main__"),
+        reverse=True,
+    )
+    for us, name in ranked[: args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    modules = subprocess.run(
+        [sys.executable, "-c", "import sys, pyheadspace.__main__; print(*sys.modules)"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    loaded = [name for name in HEAVY if name in modules]
+    print(f"heavy modules imported at startup: {', '.join(loaded) or 'none'}")
+
+    print("\nwall time, best of", args.runs)
+    baseline = wall_time([sys.executable, "-c", "pass"], args.runs)
+    print(f"  {baseline * 1000:8.1f} ms  python -c pass")
+    for command in COMMANDS:
+        seconds = wall_time([sys.executable, "-m", "pyheadspace", *command], args.runs)
+        print(f"  {seconds * 1000:8.1f} ms  headspace {' '.join(command)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Offline benchmarks of the headspace commands against the mock server.
+
+Each scenario runs the real command line in a fresh process with an empty
+data directory and reports wall time, files, downloaded bytes, end to end
+throughput, disk use, API calls per file and the peak memory of that process:
+
+    python benchmarks/suite.py --packs 20 --latency 0.05 --bandwidth 2M
+    python benchmarks/suite.py --scenario pack --jobs 4 -- --async --concurrency 16
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from mock_headspace import MockConfig, MockHeadspace
+
+from pyheadspace.ratelimit import parse_rate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MANIFEST_NAME = ".headspace-manifest.jsonl"
+BLOBS_NAME = ".headspace-blobs"
+
+
+def scenarios(days: int):
+    first = date(2021, 1, 1)
+    last = first + timedelta(days=days - 1)
+    return {
+        "pack": ["pack", "--id", "1"],
+        "pack --all": ["pack", "--all"],
+        "download": ["download", "https://my.headspace.com/player/1?startIndex=1"],
+        "everyday": ["everyday", "--from", str(first), "--to", str(last)],
+    }
+
+
+def run(command, server: MockHeadspace, global_args, command_args):
+    with tempfile.TemporaryDirectory() as data, tempfile.TemporaryDirectory() as out:
+        env = dict(
+            os.environ,
+            HEADSPACE_API_URL=server.url,
+            XDG_DATA_HOME=data,
+            PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.getenv("PYTHONPATH")])),
+        )
+        args = [sys.executable, "-m", "pyheadspace", *global_args]
+        args += [*command, "--out", out, *command_args]
+        server.stats.clear()
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            args, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - started
+        # os.waitstatus_to_exitcode needs Python 3.9
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+        errors = process.stderr.read().decode()
+        process.stderr.close()
+
+        files = 0
+        # Hardlinked copies of a blob only take up disk space once
+        inodes = {}
+        for directory, _, names in os.walk(out):
+            for name in names:
+                if name == MANIFEST_NAME:
+                    continue
+                stat = os.stat(os.path.join(directory, name))
+                inodes[stat.st_dev, stat.st_ino] = stat.st_size
+                if BLOBS_NAME not in directory:
+                    files += 1
+    return {
+        "status": process.returncode,
+        "errors": errors,
+        "wall": wall,
+        "files": files,
+        "mb": server.stats["media_bytes"] / 1024 / 1024,
+        "disk_mb": sum(inodes.values()) / 1024 / 1024,
+        "api_calls": server.api_calls(),
+        # ru_maxrss is in KiB on Linux
+        "peak_mb": usage.ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        usage="%(prog)s [options] [-- global headspace options]",
+    )
+    parser.add_argument("--scenario", action="append", choices=scenarios(1).keys())
+    parser.add_argument("--packs", type=int, default=5)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--techniques", type=int, default=1)
+    parser.add_argument("--shared", type=int, default=0, help="Sessions in every pack.")
+    parser.add_argument("--days", type=int, default=7, help="Dates for everyday.")
+    parser.add_argument(
+        "--everyday", type=int, default=0, help="Distinct everyday sessions."
+    )
+    parser.add_argument("--authors", type=int, default=0, help="Narrators per session.")
+    parser.add_argument("--media-size", default="1M", help="Size of a session.")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", default="0", help="Per stream, e.g. 2M.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--duration", "-d", default="10")
+    parser.add_argument("--jobs", "-j", type=int, default=1)
+    parser.add_argument("global_args", nargs="*")
+    args = parser.parse_args()
+
+    config = MockConfig(
+        packs=args.packs,
+        sessions=args.sessions,
+        techniques=args.techniques,
+        shared=args.shared,
+        everyday=args.everyday,
+        authors=args.authors,
+        media_size=parse_rate(args.media_size),
+        latency=args.latency,
+        bandwidth=parse_rate(args.bandwidth),
+        error_rate=args.error_rate,
+    )
+    command_args = ["--duration", args.duration, "--jobs", str(args.jobs)]
+    selected = args.scenario or list(scenarios(args.days))
+
+    print(
+        f"{config}\nheadspace {' '.join(args.global_args)} ... {' '.join(command_args)}"
+    )
+    header = ("scenario", "wall s", "files", "MB", "MB/s", "disk MB", "API/file")
+    header += ("peak MB",)
+    print(f"{header[0]:<12}" + "".join(f"{column:>10}" for column in header[1:]))
+    with MockHeadspace(config) as server:
+        for name in selected:
+            result = run(
+                scenarios(args.days)[name], server, args.global_args, command_args
+            )
+            if result["status"] != 0:
+                print(f"{name:<12}failed with status {result['status']}")
+                print(result["errors"][-2000:])
+                continue
+            files = max(result["files"], 1)
+            print(
+                f"{name:<12}{result['wall']:>10.2f}{result['files']:>10}"
+                f"{result['mb']:>10.1f}{result['mb'] / result['wall']:>10.1f}"
+                f"{result['disk_mb']:>10.1f}"
+                f"{result['api_calls'] / files:>10.2f}{result['peak_mb']:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,228 @@
+import functools
+import hashlib
+import json
 import logging
 import os
 import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta
-from typing import List, Optional, Union
+from functools import lru_cache
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import jwt
 from appdirs import user_data_dir
 import click
-import requests
-from rich.console import Console
-from rich.progress import track
 from urllib.parse import urlparse, parse_qs
-from rich.traceback import install
 
-from pyheadspace.auth import authenticate, prompt
+from pyheadspace import transport
+from pyheadspace.aio import DEFAULT_CONCURRENCY, AsyncBackend
+from pyheadspace.blobs import link_file, open_blobs
+from pyheadspace.cache import ResponseCache, cache_key
+from pyheadspace.index import CatalogueIndex, response_digest
+from pyheadspace.inflight import InFlight
+from pyheadspace.jobs import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_WORKERS, JobQueue
+from pyheadspace.integrity import expected_md5
+from pyheadspace.journal import (
+    DONE,
+    FAILED,
+    ITEM_STATES,
+    Journal,
+    JournalItem,
+    JournalRun,
+)
+from pyheadspace.manifest import (
+    Manifest,
+    ManifestEntry,
+    file_sha256,
+    hash_file,
+    open_manifest,
+)
+from pyheadspace.metrics import metrics
+from pyheadspace.models import Entity, Pack, parse_entity, parse_pack
+from pyheadspace.partial import PartialFile, find_partial
+from pyheadspace.ratelimit import BandwidthLimiter, parse_rate, parse_window
+from pyheadspace.scheduler import (
+    DEFAULT_API_JOBS,
+    DEFAULT_JOBS,
+    DEFAULT_PER_HOST,
+    DownloadTask,
+    Scheduler,
+)
+from pyheadspace.signing import SignedUrlManager
+from pyheadspace.stream import (
+    CHECKPOINT_INTERVAL,
+    PROGRESS_INTERVAL,
+    AdaptiveBuffer,
+    Throttle,
+    iter_into,
+    preallocate,
+)
+from pyheadspace.tokens import TokenManager
+from pyheadspace.transcode import FORMATS, Transcoder, find_ffmpeg
+
+if TYPE_CHECKING:
+    import httpx
+    import requests
+
+# jwt, requests and rich are slow to import. They are only imported by the
+# code that needs them so `headspace help` and friends start quickly.
+
 
-# For better tracebacks
-install()
+def _rich_excepthook(*exc_info):
+    # For better tracebacks
+    from rich.traceback import install
+
+    install()
+    sys.excepthook(*exc_info)
+
+
+sys.excepthook = _rich_excepthook
 
 BASEDIR = user_data_dir("pyheadspace")
-if not os.path.exists(BASEDIR):
-    os.makedirs(BASEDIR)
 BEARER = os.path.abspath(os.path.join(BASEDIR, "bearer_id.txt"))
-
-AUDIO_URL = "https://api.prod.headspace.com/content/activities/{}"
-PACK_URL = "https://api.prod.headspace.com/content/activity-groups/{}"
-SIGN_URL = "https://api.prod.headspace.com/content/media-items/{}/make-signed-url"
-TECHNIQUE_URL = "https://api.prod.headspace.com/content/techniques/{}"
-EVERYDAY_URL = (
-    "https://api.prod.headspace.com/content/view-models/everyday-headspace-banner"
+# `headspace submit` reads the token of `headspace serve` from here
+JOB_TOKEN = os.path.abspath(os.path.join(BASEDIR, "job_token.txt"))
+
+# Point the client at another server, e.g. the mock API in `benchmarks/`
+API_URL = os.getenv("HEADSPACE_API_URL", "https://api.prod.headspace.com")
+AUDIO_URL = API_URL + "/content/activities/{}"
+PACK_URL = API_URL + "/content/activity-groups/{}"
+SIGN_URL = API_URL + "/content/media-items/{}/make-signed-url"
+TECHNIQUE_URL = API_URL + "/content/techniques/{}"
+EVERYDAY_URL = API_URL + "/content/view-models/everyday-headspace-banner"
+GROUP_COLLECTION = API_URL + "/content/group-collections"
+SKELETON_URL = (
+    API_URL + "/content-aggregation/v2/content/view-models/content-info/skeleton"
 )
-GROUP_COLLECTION = "https://api.prod.headspace.com/content/group-collections"
+# Label of each endpoint in the `--profile` report
+ENDPOINTS = {
+    AUDIO_URL: "activity",
+    PACK_URL: "pack",
+    SIGN_URL: "sign",
+    TECHNIQUE_URL: "technique",
+    EVERYDAY_URL: "everyday",
+    GROUP_COLLECTION: "collection",
+    SKELETON_URL: "skeleton",
+}
 DESIRED_LANGUAGE = os.getenv("HEADSPACE_LANG", "en-US")
 
-if not os.path.exists(BEARER):
-    with open(BEARER, "w") as file:
-        file.write("")
+# How long responses of the content API are served from the cache, in seconds
+CONTENT_TTL = 7 * 24 * 60 * 60
+COLLECTION_TTL = 24 * 60 * 60
 
-with open(BEARER, "r") as file:
-    BEARER_ID = file.read().strip()
 
-if BEARER_ID:
-    try:
-        USER_ID = jwt.decode(
-            BEARER_ID.split(" ")[-1], options={"verify_signature": False}
-        )["https://api.prod.headspace.com/hsId"]
-    except Exception as e:
-        USER_ID = ""
-else:
-    USER_ID = ""
-
-headers = {
-    "authority": "api.prod.headspace.com",
-    "accept": "application/vnd.api+json",
-    "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.72 Safari/537.36",
-    "authorization": BEARER_ID,
-    "hs-languagepreference": DESIRED_LANGUAGE,
-    "sec-gpc": "1",
-    "origin": "https://my.headspace.com",
-    "sec-fetch-site": "same-site",
-    "sec-fetch-mode": "cors",
-    "referer": "https://my.headspace.com/",
-    "accept-language": "en-US,en;q=0.9",
-}
+def login_again() -> Optional[str]:
+    """
+    Fresh bearer token for `tokens`. Uses HEADSPACE_EMAIL and
+    HEADSPACE_PASSWORD if they are set and asks for them otherwise, unless
+    nobody is there to answer.
+    """
+    from pyheadspace.auth import authenticate, prompt
+
+    email = os.getenv("HEADSPACE_EMAIL")
+    password = os.getenv("HEADSPACE_PASSWORD")
+    if not (email and password):
+        if not sys.stdin.isatty():
+            return None
+        console.print("[yellow]Your headspace login expired, log in again.[/yellow]")
+        email, password = prompt()
+    return authenticate(email, password) or None
+
+
+tokens = TokenManager(BEARER, login_again)
+
+
+def get_user_id() -> str:
+    return tokens.claims().get("https://api.prod.headspace.com/hsId", "")
+
+
+@lru_cache(maxsize=None)
+def api_headers() -> Dict[str, str]:
+    return {
+        "authority": "api.prod.headspace.com",
+        "accept": "application/vnd.api+json",
+        "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.72 Safari/537.36",
+        "hs-languagepreference": DESIRED_LANGUAGE,
+        "sec-gpc": "1",
+        "origin": "https://my.headspace.com",
+        "sec-fetch-site": "same-site",
+        "sec-fetch-mode": "cors",
+        "referer": "https://my.headspace.com/",
+        "accept-language": "en-US,en;q=0.9",
+    }
+
+
+class LazyConsole:
+    """
+    Stands in for rich's global console and only imports rich when used.
+
+    The progress display of the scheduler uses the same global console, so
+    messages printed during downloads still appear above the progress bars.
+    """
+
+    def __getattr__(self, name: str):
+        from rich import get_console
 
-console = Console()
+        return getattr(get_console(), name)
+
+
+console = LazyConsole()
 logger = logging.getLogger("pyHeadspace")
 
 
-session = requests.Session()
-session.headers.update(headers)
+response_cache = ResponseCache(os.path.join(BASEDIR, "cache.sqlite3"))
+catalogue_index = CatalogueIndex(
+    os.path.join(BASEDIR, f"index-{DESIRED_LANGUAGE}.sqlite3")
+)
+
+signed_urls = SignedUrlManager(
+    lambda media_id: request_url(SIGN_URL, id=media_id)["url"],
+    response_cache,
+    sign_async=lambda media_id: sign_async(media_id),
+)
+
+# Shared by every transfer so `--limit-rate` caps the total bandwidth
+bandwidth = BandwidthLimiter()
+# Reserve the full size of each file before writing it, see `--preallocate`
+preallocate_files = False
+# Concurrent tasks for the same media item wait for one download and copy it
+media_transfers = InFlight()
+# Progress bars are turned off by `headspace serve`, which runs jobs side by side
+show_progress = True
+journal = Journal(os.path.join(BASEDIR, "journal.sqlite3"))
+# Event loop that sends every request with `--async`
+async_backend: Optional[AsyncBackend] = None
+# Set by `headspace resume`, the scheduler carries on with this run
+resumed_run: Optional[JournalRun] = None
+
+ENTITY_URLS = {"activity": AUDIO_URL, "technique": TECHNIQUE_URL}
+
+
+# `--duration all` and `--author all` ask for every variant there is
+ALL = "all"
+
+
+def _all_option(ctx, param, value):
+    if ALL in value:
+        return ALL
+    try:
+        return sorted({int(v) for v in value})
+    except ValueError:
+        raise click.BadParameter(f"Expected a number or '{ALL}'.")
 
 
 URL_GROUP_CMD = [
@@ -81,12 +234,44 @@ COMMON_CMD = [
     click.option(
         "-d",
         "--duration",
-        help="Duration or list of duration",
-        type=int,
-        default=[15],
+        help="Duration or list of duration, `all` for every duration.",
+        default=["15"],
         multiple=True,
+        callback=_all_option,
     ),
     click.option("--out", default="", help="Download directory"),
+    click.option(
+        "-j",
+        "--jobs",
+        type=int,
+        default=DEFAULT_JOBS,
+        help="Number of files to download concurrently.",
+    ),
+    click.option(
+        "--per-host",
+        type=int,
+        default=DEFAULT_PER_HOST,
+        help="Maximum concurrent downloads from the same host.",
+    ),
+    click.option(
+        "--api-jobs",
+        type=int,
+        default=DEFAULT_API_JOBS,
+        help="Number of metadata lookups to run concurrently.",
+    ),
+    click.option(
+        "--audio-only",
+        is_flag=True,
+        default=False,
+        help="Keep only the audio of technique videos, as m4a. Needs ffmpeg.",
+    ),
+    click.option(
+        "--format",
+        "format_",
+        type=click.Choice(sorted(FORMATS)),
+        default=None,
+        help="Convert every file to this audio format. Needs ffmpeg.",
+    ),
 ]
 
 
@@ -105,9 +290,14 @@ def check_bearer_id(bearer_id):
     return True
 
 
-def get_group_ids():
+def get_group_ids(use_index: bool = True):
+    if use_index:
+        pack_ids = catalogue_index.pack_ids()
+        if pack_ids:
+            return pack_ids
     params = {"category": "PACK_GROUP", "limit": "-1"}
-    response = request_url(GROUP_COLLECTION, params=params)
+    ttl = COLLECTION_TTL if use_index else None
+    response = request_url(GROUP_COLLECTION, params=params, ttl=ttl)
     data = response["included"]
     pack_ids = []
     for item in data:
@@ -119,39 +309,162 @@ def get_group_ids():
     return sorted(pack_ids)
 
 
+class ApiCall:
+    """
+    One request to the content API, shared by `request_url` and
+    `request_url_async`. Those send it, this keeps the cache, the metrics
+    and the error handling.
+    """
+
+    def __init__(self, url: str, *, id=None, params=None, ttl: Optional[int] = None):
+        self.params = params or {}
+        self.endpoint = ENDPOINTS.get(url, "other")
+        self.url = url.format(id)
+        self.ttl = ttl
+        self.key = cache_key(self.url, self.params, DESIRED_LANGUAGE)
+        self.cached = response_cache.get(self.key) if ttl else None
+        self.request_headers = {}
+        if self.cached is not None and not self.cached.fresh and self.cached.etag:
+            self.request_headers["if-none-match"] = self.cached.etag
+
+    def fresh(self) -> Optional[dict]:
+        """The cached response, if it is used without asking headspace."""
+        if self.cached is None or not self.cached.fresh:
+            return None
+        logger.info("Using cached response for {}".format(self.url))
+        metrics.inc("cache_hits_total", endpoint=self.endpoint)
+        return json.loads(self.cached.body)
+
+    def headers(self, token: str) -> dict:
+        return {**api_headers(), "authorization": token, **self.request_headers}
+
+    def result(self, response) -> dict:
+        if self.cached is not None and response.status_code == 304:
+            metrics.inc("cache_revalidated_total", endpoint=self.endpoint)
+            response_cache.refresh(self.key, ttl=self.ttl)
+            return json.loads(self.cached.body)
+        try:
+            response_js: dict = response.json()
+        except Exception as e:
+            logger.critical(f"status code {response.status_code}")
+            logger.critical(f"error: {e}")
+            console.print(f"status code {response.status_code}")
+            raise click.Abort()
+        if response.status_code >= 400:
+            if "errors" in response_js.keys():
+                errors = response_js["errors"]
+                logger.error(errors)
+                if response.status_code == 401:
+                    console.print(
+                        "\n[red]Unautorized : Unable to login to headspace account[/red]"
+                    )
+                    console.print("Run [green]headspace login[/green] first.")
+                else:
+                    console.print(errors)
+            else:
+                console.print(response_js)
+                logger.error(response_js)
+            raise click.UsageError(f"HTTP error: status-code = {response.status_code}")
+        if self.ttl:
+            response_cache.set(
+                self.key,
+                response.text,
+                ttl=self.ttl,
+                etag=response.headers.get("etag"),
+            )
+        return response_js
+
+
 def request_url(
-    url: str, *, id: Union[str, int] = None, mute: bool = False, params=None
+    url: str,
+    *,
+    id: Union[str, int] = None,
+    mute: bool = False,
+    params=None,
+    ttl: Optional[int] = None,
 ):
-    if params is None:
-        params = {}
-    url = url.format(id)
+    if async_backend is not None:
+        # Every request of the run is sent from the event loop
+        return async_backend.call(
+            request_url_async(url, id=id, mute=mute, params=params, ttl=ttl)
+        )
+    call = ApiCall(url, id=id, params=params, ttl=ttl)
+    cached = call.fresh()
+    if cached is not None:
+        return cached
+
     if not mute:
-        logger.info("Sending GET request to {}".format(url))
+        logger.info("Sending GET request to {}".format(call.url))
 
-    response = session.get(url, params=params)
-    try:
-        response_js: dict = response.json()
-    except Exception as e:
-        logger.critical(f"status code {response.status_code}")
-        logger.critical(f"error: {e}")
-        console.print(f"status code {response.status_code}")
-        raise click.Abort()
-    if not response.ok:
-        if "errors" in response_js.keys():
-            errors = response_js["errors"]
-            logger.error(errors)
-            if response.status_code == 401:
-                console.print(
-                    "\n[red]Unautorized : Unable to login to headspace account[/red]"
-                )
-                console.print("Run [green]headspace login[/green] first.")
-            else:
-                console.print(errors)
-        else:
-            console.print(response_js)
-            logger.error(response_js)
-        raise click.UsageError(f"HTTP error: status-code = {response.status_code}")
-    return response_js
+    def send(token: str) -> "requests.Response":
+        with metrics.timer("api_request_seconds", endpoint=call.endpoint):
+            response = transport.get_session().get(
+                call.url, params=call.params, headers=call.headers(token)
+            )
+        record_response(response, call.endpoint)
+        return response
+
+    token = tokens.token()
+    response = send(token)
+    if response.status_code == 401:
+        # Log in again once for all workers and repeat the request
+        fresh = tokens.refresh(token)
+        if fresh is not None:
+            metrics.inc("auth_retries_total")
+            response.close()
+            response = send(fresh)
+    return call.result(response)
+
+
+async def request_url_async(
+    url: str,
+    *,
+    id: Union[str, int] = None,
+    mute: bool = False,
+    params=None,
+    ttl: Optional[int] = None,
+):
+    """`request_url` for the event loop of `--async`."""
+    backend = async_backend
+    call = ApiCall(url, id=id, params=params, ttl=ttl)
+    cached = call.fresh()
+    if cached is not None:
+        return cached
+
+    if not mute:
+        logger.info("Sending GET request to {}".format(call.url))
+
+    async def send(token: str) -> "httpx.Response":
+        with metrics.timer("api_request_seconds", endpoint=call.endpoint):
+            response = await backend.get(
+                call.url,
+                params=call.params,
+                headers=call.headers(token),
+                endpoint=call.endpoint,
+            )
+        record_response(response, call.endpoint)
+        return response
+
+    # Logging in may ask in the terminal, keep the other transfers going
+    token = await backend.run_blocking(tokens.token)
+    response = await send(token)
+    if response.status_code == 401:
+        fresh = await backend.run_blocking(tokens.refresh, token)
+        if fresh is not None:
+            metrics.inc("auth_retries_total")
+            response = await send(fresh)
+    return call.result(response)
+
+
+def record_response(response: "requests.Response", endpoint: str):
+    metrics.inc(
+        "http_requests_total", endpoint=endpoint, status=str(response.status_code)
+    )
+    # urllib3 keeps the failed attempts that were retried before this response,
+    # the async backend counts its retries itself
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    if retries is not None and retries.history:
+        metrics.inc("http_retries_total", len(retries.history), endpoint=endpoint)
 
 
 def round_off(time: Union[int, float]):
@@ -179,77 +492,153 @@ def round_off(time: Union[int, float]):
 def get_pack_attributes(
     *,
     pack_id: Union[str, int],
-    duration: List[int],
+    duration: Union[str, List[int]],
     out: str,
     no_techniques: bool,
     no_meditation: bool,
-    all_: bool = False,
-    author: Optional[int] = None,
+    authors: Union[str, List[int]] = (0,),
+    scheduler: Scheduler,
+    pack: Optional[Pack] = None,
 ):
-    response = request_url(PACK_URL, id=pack_id)
-    attributes: dict = response["data"]["attributes"]
-    _pack_name: str = attributes["name"]
+    if pack is None:
+        pack = get_pack(pack_id)
+    _pack_name: str = pack.name
     # Because it's only used for filenames, and | is mostly not allowed in filenames
     _pack_name = _pack_name.replace("|", "-")
 
-    if all_:
-        exists = os.path.exists(os.path.join(out, _pack_name))
-        if exists:
-            console.print(f"{_pack_name} already exists [red]skipping... [/red]")
-            return
     # Logging
     logger.info(f"Downloading pack, name: {_pack_name}")
 
     # Printing
     console.print("Pack metadata: ")
-    console.print(f'[green]Name: [/green] {attributes["name"]}')
-    console.print(f'[green]Description: [/green] {attributes["description"]}')
+    console.print(f"[green]Name: [/green] {pack.name}")
+    console.print(f"[green]Description: [/green] {pack.description}")
 
-    data = response["included"]
-    for item in data:
-        if item["type"] == "orderedActivities":
+    # Technique videos are not narrated, they are fetched once
+    technique_author = authors[0] if authors != ALL and len(authors) == 1 else 0
+    for item in pack.items:
+        if item.type == "orderedActivities":
             if not no_meditation:
-                id = item["relationships"]["activity"]["data"]["id"]
-                download_pack_session(id, duration, _pack_name, out=out, author=author)
-        elif item["type"] == "orderedTechniques":
+                options = dict(out=out, authors=authors, scheduler=scheduler)
+                id = item.entity_id
+                if authors == ALL:
+                    # Its authors are only known once the activity is looked up
+                    scheduler.resolve(
+                        f"authors of activity {id}",
+                        queue_pack_session,
+                        id,
+                        duration,
+                        _pack_name,
+                        **options,
+                    )
+                else:
+                    queue_pack_session(id, duration, _pack_name, **options)
+        elif item.type == "orderedTechniques":
             if not no_techniques:
-                id = item["relationships"]["technique"]["data"]["id"]
-                download_pack_techniques(
-                    id, pack_name=_pack_name, out=out, author=author
+                id = item.entity_id
+                scheduler.resolve(
+                    f"technique {id}",
+                    download_pack_techniques,
+                    id,
+                    pack_name=_pack_name,
+                    out=out,
+                    author=technique_author,
+                    scheduler=scheduler,
                 )
 
 
-def get_signed_url(response: dict, duration: List[int]) -> dict:
-    data = response["included"]
-    signed_links = {}
+def queue_pack_session(
+    id: Union[int, str],
+    duration: Union[str, List[int]],
+    pack_name: str,
+    *,
+    out: str,
+    authors: Union[str, List[int]],
+    scheduler: Scheduler,
+):
+    """
+    Look the activity up once for each of `authors`, or for every author it
+    is narrated by with `all`. The lookups run concurrently, the sessions of
+    several authors get the author ID in their filename.
+    """
+    if authors == ALL:
+        authors = list(get_entity("activity", id).authors) or [0]
+    several = len(authors) > 1
+    # Unknown author IDs get the default narration, it is only queued once
+    queued = set()
+    lock = threading.Lock()
+    for author in authors:
+        scheduler.resolve(
+            f"activity {id}" + (f" by author {author}" if several else ""),
+            download_pack_session,
+            id,
+            duration,
+            pack_name,
+            out=out,
+            filename_suffix=f" (author {author})" if several else None,
+            author=author,
+            scheduler=scheduler,
+            queued=queued,
+            lock=lock,
+        )
+
+
+def get_pack(pack_id: Union[str, int]) -> Pack:
+    pack = catalogue_index.get_pack(pack_id)
+    if pack is None:
+        response = request_url(PACK_URL, id=pack_id, ttl=CONTENT_TTL)
+        pack = parse_pack(pack_id, response)
+    return pack
+
+
+def get_entity(
+    kind: str, entity_id: Union[str, int], author: Optional[int] = None
+) -> Entity:
+    entity = catalogue_index.get_entity(kind, entity_id, author or 0)
+    if entity is None:
+        params = dict(authorId=author) if author else dict()
+        response = request_url(
+            ENTITY_URLS[kind], id=entity_id, params=params, ttl=CONTENT_TTL
+        )
+        entity = parse_entity(kind, entity_id, response, author or 0)
+    return entity
+
+
+def get_everyday(day: date) -> Entity:
+    key = day.strftime("%Y-%m-%d")
+    entity = catalogue_index.get_entity("everyday", key)
+    if entity is None:
+        params = {"date": key, "userId": get_user_id()}
+        response = request_url(EVERYDAY_URL, params=params)
+        entity = parse_entity("everyday", key, response)
+        # The session picked for a day never changes, remember it
+        if entity.media_items:
+            catalogue_index.put_entity(entity, response_digest(response))
+    return entity
+
+
+def get_media_items(entity: Entity, duration: Union[str, List[int]]) -> Dict[str, str]:
+    media_items = {}
     av_duration = []
-    for item in data:
-        try:
-            name = response["data"]["attributes"]["name"]
-        except KeyError:
-            name = response["data"]["attributes"]["titleText"]
-        if item["type"] != "mediaItems":
-            continue
-        try:
-            duration_in_min = round_off(int(item["attributes"]["durationInMs"]))
-        except KeyError:
+    every = duration == ALL
+    for item in entity.media_items:
+        name = entity.name
+        if item.duration_ms is None:
             continue
+        duration_in_min = round_off(item.duration_ms)
         av_duration.append(duration_in_min)
-        if duration_in_min not in duration:
+        if not every and duration_in_min not in duration:
             continue
 
-        sign_id = item["id"]
-        # Getting signed URL
-        direct_url = request_url(SIGN_URL, id=sign_id)["url"]
-        if len(duration) > 1:
+        if every or len(duration) > 1:
             name += f"({duration_in_min} minutes)"
 
-        signed_links[name] = direct_url
-    if len(signed_links) == 0:
+        media_items[name] = item.id
+    if len(media_items) == 0:
         msg = (
-            f"Cannot download {name}. This could be"
+            f"Cannot download {entity.name}. This could be"
             " because this session might not be available in "
-            f"{', '.join(str(d) for d in duration)} min duration."
+            f"{ALL if every else ', '.join(str(d) for d in duration)} min duration."
         )
         console.print(f"[yellow]{msg}[yellow]")
         console.print(
@@ -259,25 +648,53 @@ def get_signed_url(response: dict, duration: List[int]) -> dict:
             "\n[red]([bold]Ctrl+C[/bold] to terminate)[/red]"
         )
         logger.warning(msg)
-    return signed_links
+    return media_items
+
+
+def get_signed_url(media_id: str) -> str:
+    with metrics.timer("sign_wait_seconds"):
+        return signed_urls.get(media_id)
+
+
+async def get_signed_url_async(media_id: str) -> str:
+    with metrics.timer("sign_wait_seconds"):
+        return await signed_urls.get_async(media_id)
+
+
+async def sign_async(media_id: str) -> str:
+    return (await request_url_async(SIGN_URL, id=media_id))["url"]
 
 
 def download_pack_session(
     id: Union[int, str],
-    duration: List[int],
+    duration: Union[str, List[int]],
     pack_name: Optional[str],
     out: str,
     filename_suffix=None,
     author: Optional[int] = None,
+    scheduler: Optional[Scheduler] = None,
+    queued: Optional[set] = None,
+    lock: Optional[threading.Lock] = None,
 ):
-    params = dict(authorId=author) if author else dict()
-    response = request_url(AUDIO_URL, id=id, params=params)
-
-    signed_url = get_signed_url(response, duration=duration)
-    for name, direct_url in signed_url.items():
+    entity = get_entity("activity", id, author)
+
+    media_items = get_media_items(entity, duration=duration)
+    for name, media_id in media_items.items():
+        if queued is not None:
+            with lock:
+                if media_id in queued:
+                    continue
+                queued.add(media_id)
         if filename_suffix:
             name += filename_suffix
-        download(direct_url, name, filename=name, pack_name=pack_name, out=out)
+        download(
+            media_id,
+            name,
+            filename=name,
+            pack_name=pack_name,
+            out=out,
+            scheduler=scheduler,
+        )
 
 
 def download_pack_techniques(
@@ -287,102 +704,751 @@ def download_pack_techniques(
     out: str,
     filename_suffix=None,
     author: Optional[int] = None,
+    scheduler: Optional[Scheduler] = None,
 ):
-    params = dict(authorId=author) if author else dict()
-    response = request_url(TECHNIQUE_URL, id=technique_id, params=params)
-    name = response["data"]["attributes"]["name"]
+    entity = get_entity("technique", technique_id, author)
+    name = entity.name
     if filename_suffix:
         name += filename_suffix
-    for item in response["included"]:
-        if not item["type"] == "mediaItems":
-            continue
-        if item["attributes"]["mimeType"] == "video/mp4":
-            sign_id = item["id"]
+    for item in entity.media_items:
+        if item.mime_type == "video/mp4":
+            media_id = item.id
             break
-    direct_url = request_url(SIGN_URL, id=sign_id)["url"]
+    else:
+        console.print(f"[yellow]No video found for technique {name}[/yellow]")
+        logger.warning(f"No video found for technique {technique_id}")
+        return
     download(
-        direct_url, name, filename=name, pack_name=pack_name, out=out, is_technique=True
+        media_id,
+        name,
+        filename=name,
+        pack_name=pack_name,
+        out=out,
+        is_technique=True,
+        scheduler=scheduler,
     )
 
 
 def download(
-    direct_url: str,
+    media_id: str,
     name: str,
     *,
     filename: str,
     pack_name: Optional[str] = None,
     out: str,
     is_technique: bool = False,
+    direct_url: Optional[str] = None,
+    scheduler: Optional[Scheduler] = None,
 ):
-    console.print(f"[green]Downloading {name}[/green]")
-    logger.info(f"Sending GET request to {direct_url}")
-    media = requests.get(direct_url, stream=True)
+    task = DownloadTask(
+        media_id, name, filename, pack_name, out, is_technique, direct_url
+    )
+    if scheduler is None:
+        with Scheduler(download_task) as scheduler:
+            scheduler.submit(task)
+    else:
+        scheduler.submit(task)
 
-    if not media.ok:
-        media_json = media.json()
-        console.print(media_json)
-        logger.error(media_json)
-        raise click.UsageError(f"HTTP error: status-code = {media.status_code}")
 
-    media_type = media.headers.get("content-type").split("/")[-1]
-    filename += f".{media_type}"
-    total_length = int(media.headers.get("content-length"))
-    chunk_size = 1024
+def create_scheduler(
+    jobs: int,
+    per_host: int,
+    api_jobs: int,
+    *,
+    journaled: bool = True,
+    audio_only: bool = False,
+    format_: Optional[str] = None,
+) -> Scheduler:
+    transcoder = None
+    if audio_only or format_:
+        ffmpeg = find_ffmpeg()
+        if ffmpeg is None:
+            raise click.UsageError(
+                "--audio-only and --format need ffmpeg. Install it or set "
+                "HEADSPACE_FFMPEG to its location."
+            )
+        transcoder = Transcoder(
+            task_target, format_=format_, audio_only=audio_only, ffmpeg=ffmpeg
+        )
+    context = click.get_current_context(silent=True)
+    # Every worker of both stages may hold a connection at the same time
+    transport.configure(pool_size=jobs + api_jobs)
+    run = resumed_run
+    if run is None and context is not None and journaled:
+        params = dict(context.params)
+        # `headspace resume` may run in another directory
+        for name in ("out", "exclude", "include", "file"):
+            if params.get(name) and params[name] != "-":
+                params[name] = os.path.abspath(params[name])
+        run = journal.start(context.info_name, params)
+    return Scheduler(
+        download_task if async_backend is None else download_task_async,
+        jobs=jobs,
+        per_host=per_host,
+        api_jobs=api_jobs,
+        backend=async_backend,
+        quiet=not show_progress,
+        journal=run,
+        transcoder=transcoder,
+    )
+
 
+def target_dir(
+    filename: str, *, pack_name: Optional[str], out: str, is_technique: bool
+) -> str:
     if not os.path.exists(out) and os.path.isdir(out):
         raise click.BadOptionUsage("--out", f"'{out}' path not valid")
 
     if pack_name:
-        dir_path = os.path.join(out, pack_name)
-        pattern = r"Session \d+ of (Level \d+)"
-        level = re.findall(pattern, filename)
-        if level:
-            dir_path = os.path.join(dir_path, level[0])
-
-        if is_technique:
-            dir_path = os.path.join(dir_path, "Techniques")
+        dir_path = media_dir(
+            filename, pack_name=pack_name, out=out, is_technique=is_technique
+        )
         try:
             os.makedirs(dir_path)
         except FileExistsError:
             pass
-        filepath = os.path.join(dir_path, filename)
-    else:
-        if not os.path.exists(out) and out != "":
-            raise click.UsageError(message=f"'{out}' path does not exists.")
-        filepath = os.path.join(out, filename)
+        return dir_path
+    if not os.path.exists(out) and out != "":
+        raise click.UsageError(message=f"'{out}' path does not exists.")
+    return out
+
+
+def media_dir(
+    filename: str, *, pack_name: Optional[str], out: str, is_technique: bool
+) -> str:
+    """Directory that `target_dir` puts the file in, without creating it."""
+    if not pack_name:
+        return out
+    dir_path = os.path.join(out, pack_name)
+    pattern = r"Session \d+ of (Level \d+)"
+    level = re.findall(pattern, filename)
+    if level:
+        dir_path = os.path.join(dir_path, level[0])
+
+    if is_technique:
+        dir_path = os.path.join(dir_path, "Techniques")
+    return dir_path
+
+
+def task_target(task: DownloadTask) -> Tuple[Manifest, str]:
+    # Checks the output directory and creates the directory of the file
+    target_dir(
+        task.filename,
+        pack_name=task.pack_name,
+        out=task.out,
+        is_technique=task.is_technique,
+    )
+    return planned_target(task)
+
+
+def planned_target(task: DownloadTask) -> Tuple[Manifest, str]:
+    """Manifest and target of `task`, without touching the file system."""
+    dir_path = media_dir(
+        task.filename,
+        pack_name=task.pack_name,
+        out=task.out,
+        is_technique=task.is_technique,
+    )
+    manifest = open_manifest(task.out)
+    target = os.path.join(dir_path, task.filename)
+    return manifest, os.path.relpath(target, manifest.directory)
+
+
+def sign_ahead(scheduler: Scheduler):
+    # Sign the URLs of the tasks that start next while this one downloads
+    for task in scheduler.upcoming(scheduler.jobs):
+        if task.direct_url or signed_urls.cached(task.media_id):
+            continue
+        try:
+            manifest, target = planned_target(task)
+            if manifest.completed(target, task.media_id):
+                continue
+            if open_blobs(manifest.directory).get(task.media_id):
+                continue
+        except Exception as e:
+            # The task itself reports it once it runs
+            logger.warning(f"Unable to check {task.name} ahead of time: {e}")
+            continue
+        scheduler.resolve(
+            f"signed URL of {task.name}", signed_urls.prefetch, task.media_id
+        )
+
+
+def download_task(task: DownloadTask, scheduler: Scheduler):
+    media_id, name, filename, pack_name, out, is_technique, direct_url = task
+    manifest, target = task_target(task)
+    if _skip_completed(task, manifest, target):
+        return
 
-    if os.path.exists(filepath):
-        console.print(f"'{filename}' already exists [red]skipping...[/red]")
+    owner, transfer = media_transfers.claim(media_id)
+    while not owner:
+        console.print(f"Waiting for another download of {name}")
+        try:
+            shared = transfer.result()
+        except Exception:
+            # Reported by the task that owned the transfer, try it ourselves
+            shared = None
+        if manifest.completed(target, media_id):
+            return
+        if shared is not None:
+            _link_download(*shared, target=target, manifest=manifest)
+            return
+        owner, transfer = media_transfers.claim(media_id)
+
+    blobs = open_blobs(manifest.directory)
+    try:
+        # Shared with another pack or an earlier run, link it without a request
+        shared = blobs.get(media_id)
+        if shared is not None:
+            _link_download(*shared, target=target, manifest=manifest)
+            media_transfers.done(media_id, shared)
+            return
+
+        console.print(f"[green]Downloading {name}[/green]")
+        sign_ahead(scheduler)
+        if direct_url is None:
+            direct_url = get_signed_url(media_id)
+        on_checkpoint = _journal_signed(task, scheduler)
+        with scheduler.host_slot(direct_url):
+            shared = _download(
+                direct_url,
+                name,
+                media_id=media_id,
+                target=target,
+                manifest=manifest,
+                scheduler=scheduler,
+                on_checkpoint=on_checkpoint,
+            )
+        if shared is not None:
+            # Waiters link the blob, the file in this pack may be converted
+            shared = blobs.add(*shared)
+    except BaseException as e:
+        media_transfers.done(media_id, error=e)
+        raise
+    media_transfers.done(media_id, shared)
+
+
+async def download_task_async(task: DownloadTask, scheduler: Scheduler):
+    """`download_task` for the event loop of `--async`."""
+    import asyncio
+
+    media_id, name, filename, pack_name, out, is_technique, direct_url = task
+    manifest, target = task_target(task)
+    if _skip_completed(task, manifest, target):
         return
 
-    failed_tries = 0
+    owner, transfer = media_transfers.claim(media_id)
+    while not owner:
+        console.print(f"Waiting for another download of {name}")
+        try:
+            shared = await asyncio.wrap_future(transfer)
+        except Exception:
+            shared = None
+        if manifest.completed(target, media_id):
+            return
+        if shared is not None:
+            _link_download(*shared, target=target, manifest=manifest)
+            return
+        owner, transfer = media_transfers.claim(media_id)
+
+    blobs = open_blobs(manifest.directory)
+    try:
+        shared = blobs.get(media_id)
+        if shared is not None:
+            _link_download(*shared, target=target, manifest=manifest)
+            media_transfers.done(media_id, shared)
+            return
+
+        console.print(f"[green]Downloading {name}[/green]")
+        sign_ahead(scheduler)
+        if direct_url is None:
+            direct_url = await get_signed_url_async(media_id)
+        on_checkpoint = _journal_signed(task, scheduler)
+        async with scheduler.host_slot_async(direct_url):
+            shared = await _download_async(
+                direct_url,
+                name,
+                media_id=media_id,
+                target=target,
+                manifest=manifest,
+                scheduler=scheduler,
+                on_checkpoint=on_checkpoint,
+            )
+        if shared is not None:
+            shared = blobs.add(*shared)
+    except BaseException as e:
+        media_transfers.done(media_id, error=e)
+        raise
+    media_transfers.done(media_id, shared)
+
+
+def _skip_completed(task: DownloadTask, manifest: Manifest, target: str) -> bool:
+    # Decide from the manifest before anything is requested
+    entry = manifest.completed(target, task.media_id)
+    if not entry:
+        return False
+    console.print(f"'{task.filename}' already downloaded [red]skipping...[/red]")
+    blobs = open_blobs(manifest.directory)
+    if blobs.get(task.media_id) is None:
+        # Downloaded before the blob store existed, share it from now on
+        blobs.add(os.path.join(manifest.directory, entry.path), entry)
+    return True
+
+
+def _journal_signed(
+    task: DownloadTask, scheduler: Scheduler
+) -> Optional[Callable[[str, int], None]]:
+    if scheduler.journal is None:
+        return None
+    scheduler.journal.signed(task)
+    return functools.partial(scheduler.journal.downloading, task)
+
+
+def _link_download(
+    source: str, entry: ManifestEntry, *, target: str, manifest: Manifest
+):
+    path = target + os.path.splitext(source)[1]
+    filepath = os.path.join(manifest.directory, path)
+    console.print(f"'{os.path.basename(filepath)}' already downloaded, linking it")
+    link_file(source, filepath)
+    manifest.add(entry._replace(target=target, path=path))
+
+
+def _media_headers(offset: int, if_range: Optional[str]) -> dict:
+    # Media is saved as it is sent, ask for it uncompressed
+    request_headers = {"accept-encoding": "identity"}
+    if offset:
+        request_headers["range"] = f"bytes={offset}-"
+        if if_range:
+            # The whole file is sent instead if it changed since then
+            request_headers["if-range"] = if_range
+    return request_headers
+
+
+def _media_failed(media):
+    try:
+        media_json = media.json()
+    except ValueError:
+        media_json = media.text
+    console.print(media_json)
+    logger.error(media_json)
+    raise click.UsageError(f"HTTP error: status-code = {media.status_code}")
+
+
+def _request_media(
+    direct_url: str,
+    media_id: Optional[str],
+    offset: int = 0,
+    if_range: Optional[str] = None,
+):
+    request_headers = _media_headers(offset, if_range)
+    logger.info(f"Sending GET request to {direct_url}")
+    media = transport.get_session().get(
+        direct_url, stream=True, headers=request_headers
+    )
+    record_response(media, "media")
+
+    if media.status_code in (401, 403) and media_id:
+        # Signed URLs expire, get a fresh one and try again
+        logger.info(f"Signed URL for {media_id} expired, signing it again")
+        metrics.inc("signed_url_expired_total")
+        media.close()
+        signed_urls.invalidate(media_id)
+        direct_url = get_signed_url(media_id)
+        media = transport.get_session().get(
+            direct_url, stream=True, headers=request_headers
+        )
+        record_response(media, "media")
+    # Time until the response headers arrived
+    metrics.observe("media_ttfb_seconds", media.elapsed.total_seconds())
+    # Keep the body as it is sent, Content-Length and Range count those bytes
+    media.raw.decode_content = False
+
+    if not media.ok:
+        _media_failed(media)
+    return media, direct_url
+
+
+async def _request_media_async(
+    direct_url: str,
+    media_id: Optional[str],
+    offset: int = 0,
+    if_range: Optional[str] = None,
+):
+    """`_request_media` for the event loop of `--async`."""
+    backend = async_backend
+    request_headers = _media_headers(offset, if_range)
+    logger.info(f"Sending GET request to {direct_url}")
+    started = time.perf_counter()
+    media = await backend.get(
+        direct_url, headers=request_headers, stream=True, endpoint="media"
+    )
+    record_response(media, "media")
+
+    if media.status_code in (401, 403) and media_id:
+        logger.info(f"Signed URL for {media_id} expired, signing it again")
+        metrics.inc("signed_url_expired_total")
+        await media.aclose()
+        signed_urls.invalidate(media_id)
+        direct_url = await get_signed_url_async(media_id)
+        started = time.perf_counter()
+        media = await backend.get(
+            direct_url, headers=request_headers, stream=True, endpoint="media"
+        )
+        record_response(media, "media")
+    # httpx only knows the elapsed time once the body was read
+    metrics.observe("media_ttfb_seconds", time.perf_counter() - started)
+
+    if media.status_code >= 400:
+        await media.aread()
+        await media.aclose()
+        _media_failed(media)
+    return media, direct_url
+
+
+class MediaDownload:
+    """
+    One download into `target`, shared by `_download` and `_download_async`.
+
+    Those send the requests and read the body, this keeps the partial file,
+    the checksums, the progress bar and the manifest entry. Until `start`
+    `length` and `validator` describe the partial download of an earlier run,
+    afterwards the bytes on disk and the validator of the response.
+    """
+
     max_tries = 5
-    while failed_tries <= max_tries:
-        downloaded_length = 0
-        with open(filepath, "wb") as file:
-            for chunk in track(
-                media.iter_content(chunk_size=chunk_size),
-                description=f"[red]Downloading...[/red]",
-                total=total_length // chunk_size,
-            ):
-                downloaded_length += len(chunk)
-                file.write(chunk)
-                file.flush()
 
-        if downloaded_length != total_length:
-            failed_tries += 1
+    def __init__(
+        self,
+        name: str,
+        *,
+        media_id: str,
+        target: str,
+        manifest: Manifest,
+        scheduler: Scheduler,
+        on_checkpoint: Optional[Callable[[str, int], None]] = None,
+    ):
+        self.name = name
+        self.media_id = media_id
+        self.target = target
+        self.manifest = manifest
+        self.scheduler = scheduler
+        self.on_checkpoint = on_checkpoint
+        # Continue a partial download of an earlier run with the first request
+        self.found = find_partial(os.path.join(manifest.directory, target))
+        self.length, self.validator = (
+            self.found.recorded() if self.found is not None else (0, None)
+        )
+        if self.validator is None:
+            # Without a validator the rest could belong to another version
+            self.length = 0
+        self.skipped = False
+        self.result: Optional[Tuple[str, ManifestEntry]] = None
+        self.failed_tries = 0
+        self.written = 0
+
+    @property
+    def incomplete(self) -> bool:
+        return self.length < self.total_length
+
+    def start(self, status: int, headers) -> bool:
+        """
+        Take the headers of the first response, False if its body is not
+        used. That is either because the file is in the way, then `skipped`
+        is set and `result` holds what was found there, or because the server
+        did not send the requested bytes and the download starts over.
+        """
+        ranged = status == 206
+        self.content_type = headers.get("content-type")
+        media_type = self.content_type.split("/")[-1]
+        self.path = f"{self.target}.{media_type}"
+        self.filepath = os.path.join(self.manifest.directory, self.path)
+        self.filename = os.path.basename(self.filepath)
+        if ranged:
+            self.total_length = int(headers["content-range"].rsplit("/", 1)[-1])
+        else:
+            self.total_length = int(headers.get("content-length"))
+
+        if os.path.exists(self.filepath):
+            console.print(f"'{self.filename}' already exists [red]skipping...[/red]")
+            self.skipped = True
+            if os.path.getsize(self.filepath) == self.total_length:
+                entry = ManifestEntry(
+                    self.target,
+                    self.media_id,
+                    self.path,
+                    self.total_length,
+                    self.content_type,
+                    file_sha256(self.filepath),
+                )
+                self.manifest.add(entry)
+                self.result = self.filepath, entry
+            return False
+
+        self.partial = PartialFile(self.filepath)
+        if self.found is not None and self.found.path != self.filepath:
+            # Left with another content type, it cannot be continued
+            self.found.discard()
+        offset = self.length
+        self.validator = headers.get("etag") or headers.get("last-modified")
+        # Checked at the end when the CDN tells us the MD5 of the file
+        self.md5_expected = expected_md5(headers, ranged=ranged)
+        use_body = True
+        self.length = 0
+        if ranged:
+            self.length = self.partial.resume_offset(self.total_length, self.validator)
+            if self.length != offset:
+                # Not the bytes that were asked for, start over
+                use_body = False
+                self.length = 0
+        self.preallocated = preallocate_files or self.partial.preallocated
+        self.partial.begin(
+            self.total_length,
+            self.validator,
+            preallocated=self.preallocated,
+            offset=self.length,
+        )
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self.filepath, self.length)
+        self._reset_checksums()
+        if self.length:
             console.print(
-                f"[red]Download failed. Retrying {failed_tries} out of {max_tries}...[/red]",
+                f"Resuming '{self.filename}' from {self.length} of "
+                f"{self.total_length} bytes"
             )
+            hash_file(
+                self.partial.part_path,
+                filter(None, (self.sha256, self.md5)),
+                length=self.length,
+            )
+
+        self.started = time.perf_counter()
+        self.transfer_id = self.scheduler.start_transfer(
+            f"[red]{self.name}[/red]", self.total_length
+        )
+        self.scheduler.advance(self.transfer_id, self.length)
+        self.progress = Throttle(
+            lambda length: self.scheduler.advance(self.transfer_id, length),
+            PROGRESS_INTERVAL,
+        )
+        return use_body
+
+    def _reset_checksums(self):
+        self.sha256 = hashlib.sha256()
+        self.md5 = hashlib.md5() if self.md5_expected else None
+
+    def reconnected(self, status: int):
+        if self.length and status != 206:
+            # Server ignored the Range header and sent the whole file
+            self.scheduler.advance(self.transfer_id, -self.length)
+            self.length = 0
+            self._reset_checksums()
+
+    @contextmanager
+    def writing(self) -> Iterator[Callable[[bytes], None]]:
+        """Open the partial file, yields the function that writes a chunk."""
+        with open(self.partial.part_path, "r+b" if self.length else "wb") as file:
+            if self.length:
+                file.seek(self.length)
+            elif self.preallocated:
+                preallocate(file, self.total_length)
+
+            def save_offset(_):
+                file.flush()
+                self.partial.checkpoint(self.length)
+                if self.on_checkpoint is not None:
+                    self.on_checkpoint(self.filepath, self.length)
+
+            checkpoint = Throttle(save_offset, CHECKPOINT_INTERVAL)
+
+            def write(chunk: bytes):
+                self.length += len(chunk)
+                self.written += len(chunk)
+                file.write(chunk)
+                self.sha256.update(chunk)
+                if self.md5 is not None:
+                    self.md5.update(chunk)
+                self.progress.add(len(chunk))
+                checkpoint.add(len(chunk))
+
+            yield write
+        self.progress.flush()
+        self.partial.checkpoint(self.length)
+
+    def lost(self, error: Exception):
+        logger.warning(f"Connection lost while downloading {self.filename}: {error}")
+
+    def retry(self) -> bool:
+        """Whether to ask for the rest after the body ended early."""
+        if self.scheduler.cancelled.is_set():
+            return False
+        self.failed_tries += 1
+        metrics.inc("download_resumes_total")
+        if self.failed_tries > self.max_tries:
+            return False
+        console.print(
+            f"[red]Download interrupted. Resuming {self.failed_tries} out of {self.max_tries}...[/red]",
+        )
+        return True
+
+    def finish(self) -> Tuple[str, ManifestEntry]:
+        self.scheduler.finish_transfer(self.transfer_id)
+        metrics.observe("download_seconds", time.perf_counter() - self.started)
+        metrics.inc("bytes_written_total", self.written)
+
+        if self.length != self.total_length:
+            logger.error(f"Failed to download {self.filename}")
+            raise click.ClickException(
+                f"Failed to download {self.filename}, the partial download is "
+                "kept and will be resumed on the next run."
+            )
+        if self.md5 is not None and self.md5.hexdigest() != self.md5_expected:
+            self.partial.discard()
+            metrics.inc("checksum_mismatch_total")
+            logger.error(f"MD5 of {self.filename} does not match {self.md5_expected}")
+            raise click.ClickException(
+                f"'{self.filename}' arrived corrupted, it will be downloaded again "
+                "on the next run."
+            )
+        self.partial.commit()
+        entry = ManifestEntry(
+            self.target,
+            self.media_id,
+            self.path,
+            self.total_length,
+            self.content_type,
+            self.sha256.hexdigest(),
+        )
+        self.manifest.add(entry)
+        return self.filepath, entry
+
+
+def _download(
+    direct_url: str,
+    name: str,
+    *,
+    media_id: str,
+    target: str,
+    manifest: Manifest,
+    scheduler: Scheduler,
+    on_checkpoint: Optional[Callable[[str, int], None]] = None,
+) -> Optional[Tuple[str, ManifestEntry]]:
+    """
+    Download into `target` and return the finished file and its manifest
+    entry, or None if a different file is in the way. `on_checkpoint` is called
+    with the file and the bytes on disk whenever the partial download is saved.
+    """
+    download = MediaDownload(
+        name,
+        media_id=media_id,
+        target=target,
+        manifest=manifest,
+        scheduler=scheduler,
+        on_checkpoint=on_checkpoint,
+    )
+    media, direct_url = _request_media(
+        direct_url, media_id, offset=download.length, if_range=download.validator
+    )
+    if not download.start(media.status_code, media.headers):
+        media.close()
+        if download.skipped:
+            return download.result
+        media = None
+
+    from requests import RequestException
+    from urllib3.exceptions import HTTPError
+
+    buffer = AdaptiveBuffer()
+    while download.incomplete:
+        if media is None:
+            media, direct_url = _request_media(
+                direct_url,
+                media_id,
+                offset=download.length,
+                if_range=download.validator,
+            )
+            download.reconnected(media.status_code)
+        with download.writing() as write:
+            try:
+                for chunk in iter_into(media.raw, buffer):
+                    write(chunk)
+                    bandwidth.consume(len(chunk))
+                    if scheduler.cancelled.is_set():
+                        # Stopped with the run, the partial download is kept
+                        break
+            except (RequestException, HTTPError) as e:
+                download.lost(e)
+        if download.incomplete:
             media.close()
-            media = requests.get(direct_url, stream=True)
-        else:
-            break
+            media = None
+            if not download.retry():
+                break
+    if media is not None:
+        media.close()
+    return download.finish()
 
-    if failed_tries > max_tries:
-        console.print(f"[red]Failed to download {filename}[/red]\n")
-        logger.error(f"Failed to download {filename}")
-        os.remove(filepath)
+
+async def _download_async(
+    direct_url: str,
+    name: str,
+    *,
+    media_id: str,
+    target: str,
+    manifest: Manifest,
+    scheduler: Scheduler,
+    on_checkpoint: Optional[Callable[[str, int], None]] = None,
+) -> Optional[Tuple[str, ManifestEntry]]:
+    """`_download` for the event loop of `--async`."""
+    import httpx
+
+    download = MediaDownload(
+        name,
+        media_id=media_id,
+        target=target,
+        manifest=manifest,
+        scheduler=scheduler,
+        on_checkpoint=on_checkpoint,
+    )
+    media, direct_url = await _request_media_async(
+        direct_url, media_id, offset=download.length, if_range=download.validator
+    )
+    if not download.start(media.status_code, media.headers):
+        await media.aclose()
+        if download.skipped:
+            return download.result
+        media = None
+
+    while download.incomplete:
+        if media is None:
+            media, direct_url = await _request_media_async(
+                direct_url,
+                media_id,
+                offset=download.length,
+                if_range=download.validator,
+            )
+            download.reconnected(media.status_code)
+        with download.writing() as write:
+            try:
+                # The body as it is sent, Content-Length and Range count those bytes
+                async for chunk in media.aiter_raw():
+                    write(chunk)
+                    await bandwidth.consume_async(len(chunk))
+                    if scheduler.cancelled.is_set():
+                        break
+            except httpx.TransportError as e:
+                download.lost(e)
+        if download.incomplete:
+            await media.aclose()
+            media = None
+            if not download.retry():
+                break
+    if media is not None:
+        await media.aclose()
+    return download.finish()
+
+
+PACK_PATTERN = r"my.headspace.com/modes/(?:meditate|focus)/content/([0-9]+)"
+PLAYER_PATTERN = r"my.headspace.com/player/([0-9]+)"
 
 
 def find_id(pattern: str, url: str):
@@ -395,12 +1461,116 @@ def find_id(pattern: str, url: str):
     return id
 
 
+def _rate_option(ctx, param, value):
+    try:
+        return parse_rate(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _window_option(ctx, param, value):
+    try:
+        return [parse_window(window) for window in value]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 @click.group()
 @click.version_option()
 @click.option(
     "--verbose", "-v", is_flag=True, help="Enable verbose mode.", default=False
 )
-def cli(verbose):
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Always fetch metadata from headspace instead of the local cache.",
+    default=False,
+)
+@click.option(
+    "--no-index",
+    is_flag=True,
+    help="Ignore the local index built by `headspace sync-index`.",
+    default=False,
+)
+@click.option(
+    "--timeout",
+    type=float,
+    default=transport.DEFAULT_TIMEOUT,
+    help="Seconds to wait for headspace or the CDN before giving up on a request.",
+)
+@click.option(
+    "--retries",
+    type=int,
+    default=transport.DEFAULT_RETRIES,
+    help="How often to retry requests that failed with 429 or 5xx.",
+)
+@click.option(
+    "--async",
+    "async_",
+    is_flag=True,
+    default=False,
+    help="Send every request from one asyncio event loop, needs httpx.",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=DEFAULT_CONCURRENCY,
+    help="Use with `--async`. Maximum lookups and downloads in flight at once, "
+    "in any mix.",
+)
+@click.option(
+    "--limit-rate",
+    default="0",
+    callback=_rate_option,
+    help="Cap the total download speed across all files, e.g. 500K or 5M.",
+)
+@click.option(
+    "--rate-window",
+    multiple=True,
+    callback=_window_option,
+    help="Use a different cap between two times of day, e.g. 22:00-07:00=0 for "
+    "full speed at night. Can be given multiple times.",
+)
+@click.option(
+    "--preallocate",
+    is_flag=True,
+    default=False,
+    help="Reserve disk space for each file before downloading it.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    default=False,
+    help="Print request latencies, retries, cache hits and throughput at exit.",
+)
+@click.option(
+    "--profile-out",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Also write the measurements to this file.",
+)
+@click.option(
+    "--profile-format",
+    type=click.Choice(["jsonl", "prometheus"]),
+    default="jsonl",
+    help="Format of `--profile-out`, JSON lines or Prometheus text.",
+)
+@click.pass_context
+def cli(
+    ctx,
+    verbose,
+    no_cache,
+    no_index,
+    timeout,
+    retries,
+    async_,
+    concurrency,
+    limit_rate,
+    rate_window,
+    preallocate,
+    profile,
+    profile_out,
+    profile_format,
+):
     """
     Download headspace packs or individual meditation and techniques.
     """
@@ -410,6 +1580,64 @@ def cli(verbose):
     logging.getLogger("urllib3").setLevel(logging.WARNING)
     if verbose:
         console.print("[bold]Verbose mode enabled[/bold]")
+    if no_cache:
+        response_cache.enabled = False
+    if no_index:
+        catalogue_index.enabled = False
+    transport.configure(timeout=timeout, retries=retries)
+    bandwidth.rate = limit_rate
+    bandwidth.windows = rate_window
+    global preallocate_files
+    preallocate_files = preallocate
+    if async_:
+        start_async_backend(ctx, concurrency, timeout=timeout, retries=retries)
+    if profile or profile_out:
+        metrics.enabled = True
+        ctx.call_on_close(
+            lambda: report_metrics(
+                show=profile, out=profile_out, out_format=profile_format
+            )
+        )
+
+
+def start_async_backend(ctx, concurrency: int, *, timeout: float, retries: int):
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        raise click.UsageError(
+            "--async needs httpx. Install it with `pip install httpx`."
+        )
+    global async_backend
+    async_backend = AsyncBackend(concurrency, timeout=timeout, retries=retries)
+    async_backend.start()
+    ctx.call_on_close(stop_async_backend)
+
+
+def stop_async_backend():
+    global async_backend
+    backend, async_backend = async_backend, None
+    if backend is not None:
+        backend.stop()
+
+
+def report_metrics(*, show: bool, out: Optional[str], out_format: str):
+    if show:
+        from rich.table import Table
+
+        table = Table(title="Profile")
+        table.add_column("Metric", overflow="fold")
+        table.add_column("Labels", overflow="fold")
+        for column in ("Count", "Mean ms", "p95 ms", "Max ms"):
+            table.add_column(column, justify="right")
+        for row in metrics.summary():
+            table.add_row(*row)
+        console.print(table)
+    if out:
+        with open(out, "w") as file:
+            if out_format == "prometheus":
+                file.write(metrics.prometheus())
+            else:
+                file.write(metrics.json_lines())
 
 
 @cli.command("help")
@@ -431,11 +1659,80 @@ def help_(ctx, command):
     click.echo(cmd.get_help(ctx))
 
 
-def get_legacy_id(new_id):
+# Legacy entity IDs of content IDs looked up by this process
+legacy_ids: Dict[int, int] = {}
+legacy_lock = threading.Lock()
+
+
+def fetch_legacy_id(new_id: int) -> int:
     logger.info("Getting entity ID")
-    url = "https://api.prod.headspace.com/content-aggregation/v2/content/view-models/content-info/skeleton"
-    response = request_url(url, params={"contentId": new_id, "userId": USER_ID})
-    return response["entityId"]
+    response = request_url(
+        SKELETON_URL,
+        params={"contentId": new_id, "userId": get_user_id()},
+        ttl=CONTENT_TTL,
+    )
+    return int(response["entityId"])
+
+
+def get_legacy_ids(new_ids, scheduler: Optional[Scheduler] = None) -> Dict[int, int]:
+    """
+    Legacy entity IDs of web app content IDs. IDs that were looked up before
+    come from memory or the local index, the rest are requested and
+    remembered. With a `scheduler` they are requested as its lookups, at the
+    same time and within its limits, otherwise one after another.
+    """
+    wanted = {int(new_id) for new_id in new_ids}
+    with legacy_lock:
+        found = {
+            new_id: legacy_ids[new_id] for new_id in wanted if new_id in legacy_ids
+        }
+    found.update(catalogue_index.get_legacy_ids(wanted - found.keys()))
+    missing = sorted(wanted - found.keys())
+    if missing:
+        fetched: Dict[int, int] = {}
+        if scheduler is None:
+            for new_id in missing:
+                fetched[new_id] = fetch_legacy_id(new_id)
+        else:
+            errors: List[Exception] = []
+
+            def fetch(new_id: int):
+                try:
+                    fetched[new_id] = fetch_legacy_id(new_id)
+                except Exception as e:
+                    # Raised here instead of failing the run at its end
+                    errors.append(e)
+
+            wait(
+                [
+                    scheduler.resolve(f"content ID {new_id}", fetch, new_id)
+                    for new_id in missing
+                ]
+            )
+            if errors:
+                raise errors[0]
+        catalogue_index.put_legacy_ids(fetched)
+        found.update(fetched)
+    with legacy_lock:
+        legacy_ids.update(found)
+    return found
+
+
+def read_links(path: str, option: str, pattern: str) -> List[int]:
+    """Content IDs of the links in a text file, one link per line."""
+    try:
+        with open(path, "r") as file:
+            links = file.readlines()
+    except FileNotFoundError:
+        raise click.BadOptionUsage(option, f"{option.capitalize()} file not found.")
+    ids = []
+    for link in links:
+        content_id = re.findall(pattern, link)
+        if content_id:
+            ids.append(int(content_id[0]))
+        elif link.strip():
+            console.print(f"[yellow]Unable to parse: {link.strip()}[/yellow]")
+    return ids
 
 
 @cli.command("pack")
@@ -459,85 +1756,90 @@ def get_legacy_id(new_id):
     "-e",
     default="",
     help=(
-        "Use with `--all` flag. Location of text file for"
+        "Use with `--all` or `--include`. Location of text file for"
         " links of packs to exclude downloading. Every link should be on separate line."
     ),
 )
+@click.option(
+    "--include",
+    default="",
+    help=(
+        "Location of text file for links of packs to download."
+        " Every link should be on separate line."
+    ),
+)
 @click.option(
     "--author",
     "-a",
-    type=int,
-    default=0,
+    default=["0"],
+    multiple=True,
+    callback=_all_option,
     help=(
         "Use to choose the author/narrator that you'd like to download the files of."
-        "NOTE: If the author ID is not found, the default will download."
+        " Repeat it for several authors or use `all` for every author."
+        " NOTE: If the author ID is not found, the default will download."
     ),
 )
 @shared_cmd(COMMON_CMD)
 @shared_cmd(URL_GROUP_CMD)
 def pack(
     id: int,
-    duration: Union[list, tuple],
+    duration: Union[str, List[int]],
     out: str,
     no_techniques: bool,
     no_meditation: bool,
     url: str,
     all_: bool,
     exclude: str,
-    author: int,
+    include: str,
+    author: Union[str, List[int]],
+    jobs: int,
+    per_host: int,
+    api_jobs: int,
+    audio_only: bool,
+    format_: Optional[str],
 ):
     """
     Download headspace packs with techniques videos.
     """
 
-    duration = list(set(duration))
-    pattern = r"my.headspace.com/modes/(?:meditate|focus)/content/([0-9]+)"
-
+    # Bad arguments are reported before a run is started
+    excluded_ids = read_links(exclude, "exclude", PACK_PATTERN) if exclude else []
+    content_ids = []
     if not all_:
-        if url == "" and id <= 0:
-            raise click.BadParameter("Please provide ID or URL.")
+        content_ids = read_links(include, "include", PACK_PATTERN) if include else []
         if url:
-            id = find_id(pattern, url)
-            id = get_legacy_id(id)
+            content_ids.append(find_id(PACK_PATTERN, url))
+        elif id > 0:
+            content_ids.append(id)
+        if not content_ids:
+            raise click.BadParameter("Please provide ID, URL or --include.")
+
+    with create_scheduler(
+        jobs, per_host, api_jobs, audio_only=audio_only, format_=format_
+    ) as scheduler:
+        # Every link is resolved before the first download starts
+        excluded = set(get_legacy_ids(excluded_ids, scheduler).values())
+        if all_:
+            console.print("[red]Downloading all packs[/red]")
+            logger.info("Downloading all packs")
+            pack_ids = get_group_ids()
         else:
-            id = get_legacy_id(id)
-        get_pack_attributes(
-            pack_id=id,
-            duration=duration,
-            out=out,
-            no_meditation=no_meditation,
-            no_techniques=no_techniques,
-            author=author,
-        )
-    else:
-        excluded = []
-        if exclude:
-            try:
-                with open(exclude, "r") as file:
-                    links = file.readlines()
-            except FileNotFoundError:
-                raise click.BadOptionUsage("exclude", "Exclude file not found.")
-            for link in links:
-                exclude_id = re.findall(pattern, link)
-                if exclude_id:
-                    excluded.append(int(get_legacy_id(int(exclude_id[0]))))
-                else:
-                    console.print(f"[yellow]Unable to parse: {link}[/yellow]")
-
-        console.print("[red]Downloading all packs[/red]")
-        logger.info("Downloading all packs")
+            resolved = get_legacy_ids(content_ids, scheduler)
+            pack_ids = list(dict.fromkeys(resolved[i] for i in content_ids))
 
-        group_ids = get_group_ids()
-
-        for pack_id in group_ids:
+        for pack_id in pack_ids:
             if pack_id not in excluded:
-                get_pack_attributes(
+                scheduler.resolve(
+                    f"pack {pack_id}",
+                    get_pack_attributes,
                     pack_id=pack_id,
                     duration=duration,
                     out=out,
                     no_meditation=no_meditation,
                     no_techniques=no_techniques,
-                    all_=True,
+                    authors=author,
+                    scheduler=scheduler,
                 )
             else:
                 logger.info(f"Skipping ID: {pack_id} as it is excluded")
@@ -546,48 +1848,477 @@ def pack(
 @cli.command("download")
 @shared_cmd(COMMON_CMD)
 @click.argument("url", type=str)
-def download_single(url: str, out: str, duration: Union[list, tuple]):
+def download_single(
+    url: str,
+    out: str,
+    duration: Union[str, List[int]],
+    jobs: int,
+    per_host: int,
+    api_jobs: int,
+    audio_only: bool,
+    format_: Optional[str],
+):
     """
     Download single headspace session.
     """
 
-    pattern = r"my.headspace.com/player/([0-9]+)"
     try:
-        pack_id = find_id(pattern, url)
+        pack_id = find_id(PLAYER_PATTERN, url)
     except click.UsageError:
         raise click.UsageError("Unable to parse URL.")
 
+    index = start_index(url)
+    if index is None:
+        raise click.Abort("Unable to parse startIndex.")
+
+    pack = get_pack(pack_id)
+    with create_scheduler(
+        jobs, per_host, api_jobs, audio_only=audio_only, format_=format_
+    ) as scheduler:
+        queue_pack_item(pack, index, duration, out=out, scheduler=scheduler)
+
+
+def start_index(url: str) -> Optional[int]:
+    """Position of the session in its pack, None if it cannot be parsed."""
     try:
-        index = int(parse_qs(urlparse(url).query)["startIndex"][0])
+        return int(parse_qs(urlparse(url).query)["startIndex"][0])
     except KeyError:
-        index = 0
+        return 0
     except ValueError:
-        raise click.Abort("Unable to parse startIndex.")
+        return None
 
-    response = request_url(PACK_URL, id=pack_id)
-    attributes: dict = response["data"]["attributes"]
-    pack_name: str = attributes["name"]
 
-    data = response["included"]
-    data = data[index]
-    if data["type"] == "orderedActivities":
-        id = data["relationships"]["activity"]["data"]["id"]
+def queue_pack_item(
+    pack: Pack,
+    index: int,
+    duration: Union[str, List[int]],
+    *,
+    out: str,
+    scheduler: Scheduler,
+):
+    data = pack.items[index]
+    if data.type == "orderedActivities":
         download_pack_session(
-            id, duration, None, out=out, filename_suffix=" - {}".format(pack_name)
+            data.entity_id,
+            duration,
+            None,
+            out=out,
+            filename_suffix=" - {}".format(pack.name),
+            scheduler=scheduler,
         )
-    elif data["type"] == "orderedTechniques":
-        id = data["relationships"]["technique"]["data"]["id"]
+    elif data.type == "orderedTechniques":
         download_pack_techniques(
-            id, pack_name=None, out=out, filename_suffix=" - {}".format(pack_name)
+            data.entity_id,
+            pack_name=None,
+            out=out,
+            filename_suffix=" - {}".format(pack.name),
+            scheduler=scheduler,
         )
 
 
+class BatchEntry(NamedTuple):
+    # "pack" for a whole pack, "player" for a single session of one
+    kind: str
+    # Content ID of a pack, or the pack ID of a player link
+    id: int
+    index: Optional[int] = None
+
+
+def parse_batch_line(line: str) -> Optional[BatchEntry]:
+    """
+    Entry of a line of `headspace batch`, None for blank lines and comments.
+    Bare IDs are pack IDs, like `pack --id`.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if re.search(PLAYER_PATTERN, line):
+        index = start_index(line)
+        if index is None:
+            raise click.UsageError(f"Unable to parse startIndex: {line}")
+        return BatchEntry("player", find_id(PLAYER_PATTERN, line), index)
+    if re.search(PACK_PATTERN, line):
+        return BatchEntry("pack", find_id(PACK_PATTERN, line))
+    if line.isdigit():
+        return BatchEntry("pack", int(line))
+    raise click.UsageError(f"Unable to parse: {line}")
+
+
+class SharedPacks:
+    """
+    Fetches every pack of a batch once, however many of its lines point into
+    it and however many of them are resolved at the same time.
+    """
+
+    def __init__(self):
+        self._packs: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, pack_id: int) -> Pack:
+        with self._lock:
+            future = self._packs.get(pack_id)
+            owner = future is None
+            if owner:
+                future = self._packs[pack_id] = Future()
+        if owner:
+            try:
+                future.set_result(get_pack(pack_id))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def queue_batch_entry(
+    entry: BatchEntry,
+    duration: Union[str, List[int]],
+    *,
+    out: str,
+    packs: SharedPacks,
+    scheduler: Scheduler,
+):
+    if entry.kind == "player":
+        pack = packs.get(entry.id)
+        queue_pack_item(pack, entry.index, duration, out=out, scheduler=scheduler)
+    else:
+        # Already one of the scheduler's lookups
+        pack_id = get_legacy_ids([entry.id])[entry.id]
+        get_pack_attributes(
+            pack_id=pack_id,
+            pack=packs.get(pack_id),
+            duration=duration,
+            out=out,
+            no_meditation=False,
+            no_techniques=False,
+            scheduler=scheduler,
+        )
+
+
+@cli.command("batch")
+@shared_cmd(COMMON_CMD)
+@click.argument(
+    "file", type=click.Path(exists=True, dir_okay=False, allow_dash=True), default="-"
+)
+def batch(
+    file: str,
+    out: str,
+    duration: Union[str, List[int]],
+    jobs: int,
+    per_host: int,
+    api_jobs: int,
+    audio_only: bool,
+    format_: Optional[str],
+):
+    """
+    Download every pack and session linked in FILE, one per line.
+
+    Lines are pack links, player links of single sessions or pack IDs. They
+    are read from standard input if FILE is not given, and looked up as they
+    arrive.
+    """
+    seen = set()
+    packs = SharedPacks()
+    with create_scheduler(
+        jobs, per_host, api_jobs, audio_only=audio_only, format_=format_
+    ) as scheduler:
+        with click.open_file(file, "r") as lines:
+            for line in lines:
+                try:
+                    entry = parse_batch_line(line)
+                except click.UsageError as e:
+                    console.print(f"[yellow]{e.format_message()}[/yellow]")
+                    continue
+                if entry is None or entry in seen:
+                    continue
+                seen.add(entry)
+                scheduler.resolve(
+                    line.strip(),
+                    queue_batch_entry,
+                    entry,
+                    duration,
+                    out=out,
+                    packs=packs,
+                    scheduler=scheduler,
+                )
+
+
+def sync_pack(pack_id: int, *, full: bool, stats: Counter, lock: threading.Lock):
+    response = request_url(PACK_URL, id=pack_id)
+    digest = response_digest(response)
+    previous = catalogue_index.pack_digest(pack_id)
+    if previous == digest and not full:
+        with lock:
+            stats["unchanged"] += 1
+        return
+
+    pack = parse_pack(pack_id, response)
+    for item in pack.items:
+        if item.type == "orderedActivities":
+            kind = "activity"
+        elif item.type == "orderedTechniques":
+            kind = "technique"
+        else:
+            continue
+        if not full and catalogue_index.get_entity(kind, item.entity_id):
+            continue
+        entity_response = request_url(ENTITY_URLS[kind], id=item.entity_id)
+        entity = parse_entity(kind, item.entity_id, entity_response)
+        catalogue_index.put_entity(entity, response_digest(entity_response))
+        with lock:
+            stats[kind] += 1
+
+    # Only stored once all of its entities are, so an interrupted sync retries it
+    catalogue_index.put_pack(pack, digest)
+    with lock:
+        stats["new" if previous is None else "changed"] += 1
+
+
+@cli.command("sync-index")
+@click.option(
+    "--full",
+    is_flag=True,
+    default=False,
+    help="Fetch every activity and technique again, not only new ones.",
+)
+@click.option(
+    "--api-jobs",
+    type=int,
+    default=DEFAULT_API_JOBS,
+    help="Number of metadata lookups to run concurrently.",
+)
+def sync_index(full: bool, api_jobs: int):
+    """
+    Build or update the local index of all packs.
+    """
+    if not catalogue_index.enabled:
+        raise click.UsageError("`sync-index` cannot be used with --no-index.")
+    group_ids = get_group_ids(use_index=False)
+    removed = set(catalogue_index.pack_ids()) - set(group_ids)
+    if removed:
+        catalogue_index.remove_packs(sorted(removed))
+
+    stats = Counter()
+    lock = threading.Lock()
+    # Only looks things up, there is nothing to resume
+    with create_scheduler(
+        DEFAULT_JOBS, DEFAULT_PER_HOST, api_jobs, journaled=False
+    ) as scheduler:
+        for pack_id in group_ids:
+            scheduler.resolve(
+                f"pack {pack_id}",
+                sync_pack,
+                pack_id,
+                full=full,
+                stats=stats,
+                lock=lock,
+            )
+
+    console.print(
+        f"[green]Index updated:[/green] {stats['new']} new, "
+        f"{stats['changed']} changed, {stats['unchanged']} unchanged and "
+        f"{len(removed)} removed packs. Fetched {stats['activity']} activities "
+        f"and {stats['technique']} techniques."
+    )
+
+
+@cli.command("verify")
+@click.option("--out", default="", help="Download directory to check.")
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    help="Number of files to check at the same time.",
+)
+@click.option(
+    "--repair",
+    is_flag=True,
+    default=False,
+    help="Delete damaged files, the next run downloads them again.",
+)
+def verify_downloads(out: str, jobs: int, repair: bool):
+    """
+    Check downloaded files against the checksums taken while downloading.
+    """
+    from pyheadspace.integrity import OK, verify
+
+    manifest = open_manifest(out)
+    if not os.path.exists(manifest.path):
+        raise click.UsageError(f"No downloads are recorded in '{manifest.directory}'.")
+    manifests = [manifest, open_blobs(out).manifest]
+    stats = Counter()
+    damaged = []
+    for result in verify(manifests, jobs):
+        stats[result.status] += 1
+        if result.status != OK:
+            damaged.append(result)
+            console.print(f"[red]{result.status}[/red] {result.path}")
+    console.print(
+        f"{stats['ok']} ok, {stats['corrupt']} corrupt and {stats['missing']} "
+        "missing files."
+    )
+    if not damaged:
+        return
+    if not repair:
+        raise click.ClickException(
+            "Some files are damaged, use --repair to download them again."
+        )
+    for result in damaged:
+        try:
+            os.remove(result.path)
+        except FileNotFoundError:
+            pass
+    for manifest in manifests:
+        targets = [r.entry.target for r in damaged if r.manifest is manifest]
+        if targets:
+            manifest.remove(targets)
+    console.print(f"Removed {len(damaged)} damaged files.")
+
+
+@cli.command("resume")
+@click.option(
+    "--run",
+    "run_id",
+    type=int,
+    default=None,
+    help="Run to resume, the last unfinished one by default.",
+)
+@click.pass_context
+def resume(ctx, run_id: Optional[int]):
+    """
+    Carry on with an interrupted `pack`, `download`, `everyday` or `batch` run.
+    """
+    global resumed_run
+
+    run = journal.get(run_id) if run_id else journal.last_unfinished()
+    if run is None:
+        console.print("Nothing to resume.")
+        return
+    command = cli.commands.get(run.command)
+    if command is None:
+        raise click.ClickException(f"Run {run.id} of '{run.command}' cannot resume.")
+    if not run.planned and reads_stdin(command, run.params):
+        # Running it again would read this shell's standard input instead
+        raise click.ClickException(
+            f"Run {run.id} stopped before it read all of its standard input. "
+            f"Pipe the same links into `headspace {run.command}` again."
+        )
+    counts = journal.counts(run.id)
+    resumed_run = journal.resume(run)
+    try:
+        if run.planned:
+            # Everything it needs is in the journal, nothing is looked up again
+            tasks = [
+                item.task() for item in journal.items(run.id) if item.state != DONE
+            ]
+            console.print(
+                f"Resuming run {run.id}: {len(tasks)} of {sum(counts.values())} "
+                "files left."
+            )
+            params = run.params
+            with create_scheduler(
+                params.get("jobs", DEFAULT_JOBS),
+                params.get("per_host", DEFAULT_PER_HOST),
+                params.get("api_jobs", DEFAULT_API_JOBS),
+                audio_only=params.get("audio_only", False),
+                format_=params.get("format_"),
+            ) as scheduler:
+                for task in tasks:
+                    scheduler.submit(task)
+        else:
+            console.print(
+                f"Run {run.id} stopped while it was still looking things up, "
+                f"running '{run.command}' again. {counts[DONE]} finished files "
+                "are skipped."
+            )
+            ctx.invoke(command, **run.params)
+    finally:
+        resumed_run = None
+
+
+def item_location(item: JournalItem) -> str:
+    """File of a journal item, as far as it is known."""
+    if item.path:
+        return item.path
+    target = os.path.join(
+        media_dir(
+            item.filename,
+            pack_name=item.pack_name,
+            out=item.out,
+            is_technique=item.is_technique,
+        ),
+        item.filename,
+    )
+    manifest = open_manifest(item.out)
+    # Skipped and linked files are only recorded in the manifest
+    entry = manifest.get(os.path.relpath(target, manifest.directory))
+    return os.path.join(manifest.directory, entry.path) if entry else target
+
+
+@cli.command("report")
+@click.option(
+    "--run",
+    "run_id",
+    type=int,
+    default=None,
+    help="Run to report on, the last one by default.",
+)
+@click.option(
+    "--state",
+    "states",
+    type=click.Choice(ITEM_STATES),
+    multiple=True,
+    help="List the files in this state, failed ones by default.",
+)
+@click.option("--json", "as_json", is_flag=True, help="Print the files as JSON lines.")
+def report(run_id: Optional[int], states: Tuple[str, ...], as_json: bool):
+    """
+    Show recent runs and the files that failed in them.
+    """
+    runs = journal.runs()
+    run = journal.get(run_id) if run_id else (runs[0] if runs else None)
+    if run is None:
+        raise click.ClickException("No runs are recorded.")
+    items = journal.items(run.id, states or (FAILED,))
+    if as_json:
+        for item in items:
+            click.echo(json.dumps(item._asdict()))
+        return
+
+    from rich.table import Table
+
+    table = Table(title="Runs")
+    for column in ("Run", "Started", "Command", "State", "Files"):
+        table.add_column(column)
+    for listed in runs if run_id is None else [run]:
+        counts = journal.counts(listed.id)
+        table.add_row(
+            str(listed.id),
+            datetime.fromtimestamp(listed.created_at).strftime("%Y-%m-%d %H:%M"),
+            listed.command,
+            listed.state if listed.planned else f"{listed.state}, planning",
+            ", ".join(
+                f"{counts[state]} {state}" for state in ITEM_STATES if counts[state]
+            ),
+        )
+    console.print(table)
+    for item in items:
+        location = item_location(item)
+        console.print(f"[red]{item.state}[/red] {location}: {item.error or ''}")
+    if run.state != DONE:
+        console.print(f"Use `headspace resume --run {run.id}` to carry on with it.")
+
+
 @cli.command("file")
 def display_file_location():
     """
     Display `bearer_id.txt` file location.
     """
-    console.print(f'bearer_id.txt file is located at "{BEARER}"')
+    # The setup guide asks to paste the token into this file
+    os.makedirs(BASEDIR, exist_ok=True)
+    if not os.path.exists(BEARER):
+        with open(BEARER, "w") as file:
+            file.write("")
+    click.echo(f'bearer_id.txt file is located at "{BEARER}"')
 
 
 def write_bearer(bearer_id):
@@ -604,6 +2335,7 @@ def write_bearer(bearer_id):
         )
         raise click.UsageError("Bearer ID not complete")
 
+    os.makedirs(BASEDIR, exist_ok=True)
     with open(BEARER, "w") as file:
         file.write(bearer_id)
 
@@ -623,31 +2355,261 @@ def write_bearer(bearer_id):
     help="Download till a specific date. DATE-FORMAT=>yyyy-mm-dd",
 )
 @shared_cmd(COMMON_CMD)
-def everyday(_from: str, to: str, duration: Union[list, tuple], out: str):
+def everyday(
+    _from: str,
+    to: str,
+    duration: Union[str, List[int]],
+    out: str,
+    jobs: int,
+    per_host: int,
+    api_jobs: int,
+    audio_only: bool,
+    format_: Optional[str],
+):
     """
     Download everyday headspace.
     """
-    userid = USER_ID
     date_format = "%Y-%m-%d"
     _from = datetime.strptime(_from, date_format).date()
     to = datetime.strptime(to, date_format).date()
 
-    while _from <= to:
-        params = {
-            "date": _from.strftime(date_format),
-            "userId": userid,
-        }
-        response = request_url(EVERYDAY_URL, params=params)
+    stats = Counter()
+    seen = set()
+    lock = threading.Lock()
+    with create_scheduler(
+        jobs, per_host, api_jobs, audio_only=audio_only, format_=format_
+    ) as scheduler:
+        # Bounds the dates being looked up, a long range is not queued up front
+        in_flight = threading.BoundedSemaphore(2 * api_jobs)
+        while _from <= to:
+            options = dict(
+                duration=duration,
+                out=out,
+                scheduler=scheduler,
+                stats=stats,
+                seen=seen,
+                lock=lock,
+            )
+            # Dates in the index were looked up before, they need no request
+            entity = catalogue_index.get_entity("everyday", str(_from))
+            if entity is not None:
+                queue_everyday(entity, **options)
+            else:
+                in_flight.acquire()
+                future = scheduler.resolve(
+                    f"everyday {_from}", download_everyday, _from, **options
+                )
+                future.add_done_callback(lambda _: in_flight.release())
+            _from += timedelta(days=1)
+
+    if stats["downloaded"] or stats["duplicate"]:
+        console.print(
+            f"Skipped {stats['downloaded']} already downloaded and "
+            f"{stats['duplicate']} repeated everyday sessions."
+        )
+
 
-        signed_url = get_signed_url(response, duration=duration)
+def download_everyday(day: date, **options):
+    queue_everyday(get_everyday(day), **options)
 
-        for name, direct_url in signed_url.items():
-            download(direct_url, name, filename=name, out=out)
-        _from += timedelta(days=1)
+
+def queue_everyday(
+    entity: Entity,
+    *,
+    duration: Union[str, List[int]],
+    out: str,
+    scheduler: Scheduler,
+    stats: Counter,
+    seen: set,
+    lock: threading.Lock,
+):
+    media_items = get_media_items(entity, duration=duration)
+    for name, media_id in media_items.items():
+        with lock:
+            # Several dates often share the same session
+            if media_id in seen:
+                stats["duplicate"] += 1
+                continue
+            seen.add(media_id)
+        task = DownloadTask(media_id, name, name, None, out)
+        manifest, target = task_target(task)
+        if manifest.completed(target, media_id):
+            with lock:
+                stats["downloaded"] += 1
+            continue
+        scheduler.submit(task)
+
+
+# Commands `headspace serve` runs as jobs
+JOB_COMMANDS = ("pack", "download", "everyday", "sync-index", "batch")
+# Options of those commands that take a path, see `job_args`
+PATH_OPTIONS = ("--out", "--exclude", "--include")
+
+
+def reads_stdin(command: click.Command, params: dict) -> bool:
+    """Whether an argument of `command` is `-`, i.e. standard input."""
+    return any(
+        isinstance(param, click.Argument) and params.get(param.name) == "-"
+        for param in command.params
+    )
+
+
+def job_args(args: List[str]) -> List[str]:
+    """
+    Make the paths of a job absolute before it is submitted, the daemon
+    does not run in the directory `submit` was called from.
+    """
+    command = cli.commands.get(args[0])
+    if command is None:
+        return args
+    result = [args[0]]
+    has_out = False
+    # Options followed by their value, to tell those apart from arguments
+    valued = {
+        opt
+        for param in command.params
+        if isinstance(param, click.Option) and not param.is_flag
+        for opt in param.opts
+    }
+    arguments = iter(p for p in command.params if isinstance(p, click.Argument))
+    rest = iter(args[1:])
+    for arg in rest:
+        option, equals, value = arg.partition("=")
+        if option in PATH_OPTIONS:
+            has_out |= option == "--out"
+            if equals:
+                result.append(f"{option}={os.path.abspath(value)}")
+            else:
+                result += [arg, os.path.abspath(next(rest, ""))]
+        elif arg in valued:
+            result += [arg, next(rest, "")]
+        elif arg.startswith("-") and arg != "-":
+            result.append(arg)
+        else:
+            # An argument, like the file of `batch`
+            argument = next(arguments, None)
+            if isinstance(getattr(argument, "type", None), click.Path) and arg != "-":
+                arg = os.path.abspath(arg)
+            result.append(arg)
+    if not has_out and any("--out" in param.opts for param in command.params):
+        result += ["--out", os.getcwd()]
+    return result
+
+
+def validate_job(root: click.Context, args: List[str]) -> Optional[str]:
+    if not args or args[0] not in JOB_COMMANDS:
+        return f"A job must be one of: {', '.join(JOB_COMMANDS)}."
+    command = cli.commands[args[0]]
+    try:
+        ctx = command.make_context(args[0], args[1:], parent=root)
+    except click.ClickException as e:
+        return e.format_message()
+    except click.exceptions.Exit:
+        return "A job cannot show the help."
+    if reads_stdin(command, ctx.params):
+        return "A job cannot read standard input, pass a file."
+    return None
+
+
+def run_job(root: click.Context, args: List[str]):
+    # The daemon's context is the parent, so its global options apply
+    command = cli.commands[args[0]]
+    with command.make_context(args[0], args[1:], parent=root) as ctx:
+        command.invoke(ctx)
+
+
+@cli.command("serve")
+@click.option("--host", default=DEFAULT_HOST, help="Address to accept jobs on.")
+@click.option("--port", type=int, default=DEFAULT_PORT, help="Port to accept jobs on.")
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=DEFAULT_WORKERS,
+    help="Number of jobs to run at the same time.",
+)
+@click.pass_context
+def serve(ctx, host: str, port: int, workers: int):
+    """
+    Keep running and download the jobs sent with `headspace submit`.
+    """
+    from pyheadspace.daemon import JobServer, create_token
+
+    global show_progress
+    show_progress = False
+    root = ctx.find_root()
+    queue = JobQueue(os.path.join(BASEDIR, "jobs.sqlite3"))
+    try:
+        server = JobServer(
+            queue,
+            lambda args: run_job(root, args),
+            validate=lambda args: validate_job(root, args),
+            host=host,
+            port=port,
+            workers=workers,
+            token=create_token(JOB_TOKEN),
+        )
+    except OSError as e:
+        raise click.ClickException(f"Cannot accept jobs on {host}:{port}: {e}")
+    server.start_workers()
+    console.print(f"[green]Accepting jobs at {server.url}[/green]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        queue.close()
+
+
+@cli.command(
+    "submit",
+    context_settings={"ignore_unknown_options": True, "allow_interspersed_args": False},
+)
+@click.option("--host", default=DEFAULT_HOST, help="Address of `headspace serve`.")
+@click.option(
+    "--port", type=int, default=DEFAULT_PORT, help="Port of `headspace serve`."
+)
+@click.argument("args", nargs=-1, type=click.UNPROCESSED, required=True)
+def submit(host: str, port: int, args: Tuple[str, ...]):
+    """
+    Queue a job on `headspace serve`, e.g. `headspace submit pack --all`.
+    """
+    from urllib.error import HTTPError, URLError
+    from urllib.request import Request, urlopen
+
+    from pyheadspace.daemon import read_token
+
+    headers = {"content-type": "application/json"}
+    token = read_token(JOB_TOKEN)
+    if token is not None:
+        headers["authorization"] = f"Bearer {token}"
+    request = Request(
+        f"http://{host}:{port}/jobs",
+        data=json.dumps({"args": job_args(list(args))}).encode(),
+        headers=headers,
+    )
+    try:
+        with urlopen(request) as response:
+            job = json.load(response)
+    except HTTPError as e:
+        try:
+            message = json.load(e)["error"]
+        except (KeyError, ValueError):
+            message = str(e)
+        if e.code == 401:
+            message += f", `headspace serve` writes it to {JOB_TOKEN}"
+        raise click.ClickException(message)
+    except URLError:
+        raise click.ClickException(
+            f"Nothing is accepting jobs at {host}:{port}, start `headspace serve`."
+        )
+    click.echo(f"Job {job['id']} {job['state']}: {' '.join(job['args'])}")
 
 
 @cli.command("login")
 def login():
+    from pyheadspace.auth import authenticate, prompt
+
     email, password = prompt()
     bearer_token = authenticate(email, password)
     if not bearer_token:
@@ -656,7 +2618,5 @@ def login():
     console.print("[green]:heavy_check_mark:[/green] Logged in successfully!")
 
 
-session.close()
-
 if __name__ == "__main__":
     cli()
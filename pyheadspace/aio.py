@@ -0,0 +1,166 @@
+import threading
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, TypeVar
+
+from pyheadspace import transport
+from pyheadspace.metrics import metrics
+
+if TYPE_CHECKING:
+    import asyncio
+
+    import httpx
+
+DEFAULT_CONCURRENCY = 16
+
+T = TypeVar("T")
+
+
+class AsyncBackend:
+    """
+    Sends the requests of a run from one asyncio event loop with an
+    `httpx.AsyncClient`.
+
+    Downloads run as coroutines on the loop, so a long date range or pack
+    list does not cost one thread per file. Metadata lookups keep their
+    `--api-jobs` threads and hand their requests to the loop with `call`.
+    A single semaphore caps how many lookups and downloads are in flight at
+    once, in any mix.
+
+    The loop runs on a thread of its own between `start` and `stop`.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        *,
+        timeout: float = transport.DEFAULT_TIMEOUT,
+        retries: int = transport.DEFAULT_RETRIES,
+    ):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.loop: Optional["asyncio.AbstractEventLoop"] = None
+        self.client: Optional["httpx.AsyncClient"] = None
+        self._semaphore: Optional["asyncio.Semaphore"] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        # Only imported when the backend is used, both are slow to import
+        import asyncio
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name="pyheadspace-loop", daemon=True
+        )
+        self._thread.start()
+        self.run(self._open()).result()
+
+    async def _open(self):
+        import asyncio
+
+        import httpx
+
+        # Must be created inside the loop on Python < 3.10
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        pool_size = max(self.concurrency, transport.DEFAULT_POOL_SIZE)
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=pool_size, max_keepalive_connections=pool_size
+            ),
+            follow_redirects=True,
+        )
+
+    def stop(self):
+        if self.loop is None:
+            return
+        self.run(self._close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self.loop = None
+
+    async def _close(self):
+        import asyncio
+
+        # Transfers still running when the run was stopped
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.client.aclose()
+
+    def run(self, coro: Awaitable[T]) -> "Future[T]":
+        """Schedule `coro` on the event loop from any thread."""
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, coro: Awaitable[T]) -> T:
+        """Run `coro` on the event loop and wait for its result."""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("call() would block the event loop, await it")
+        return self.run(coro).result()
+
+    async def run_blocking(self, func: Callable[..., T], *args) -> T:
+        """Await `func` on a thread, for the few calls that block, e.g. a login."""
+        return await self.loop.run_in_executor(None, func, *args)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one of the `concurrency` places of lookups and downloads."""
+        async with self._semaphore:
+            yield
+
+    async def get(
+        self,
+        url: str,
+        *,
+        params: Optional[dict] = None,
+        headers: Optional[dict] = None,
+        stream: bool = False,
+        endpoint: str = "other",
+    ) -> "httpx.Response":
+        """
+        GET `url` with the client of the loop. Like the blocking transport,
+        responses with a status in RETRY_STATUSES and connection errors are
+        tried again `retries` times with exponential backoff, honouring
+        Retry-After. With `stream` the body is left to be read by the caller.
+        """
+        import asyncio
+
+        import httpx
+
+        request = self.client.build_request("GET", url, params=params, headers=headers)
+        attempt = 0
+        while True:
+            delay = None
+            try:
+                response = await self.client.send(request, stream=stream)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+            else:
+                if (
+                    response.status_code not in transport.RETRY_STATUSES
+                    or attempt >= self.retries
+                ):
+                    return response
+                delay = retry_after(response.headers.get("retry-after"))
+                await response.aclose()
+            attempt += 1
+            metrics.inc("http_retries_total", endpoint=endpoint)
+            if delay is None:
+                delay = transport.DEFAULT_BACKOFF * 2 ** (attempt - 1)
+            await asyncio.sleep(delay)
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds of a Retry-After header, None if it is missing or a date."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
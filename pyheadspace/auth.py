@@ -1,14 +1,14 @@
 import json
 import re
 
-import requests
 from rich.console import Console
 
+from pyheadspace.transport import session
+
 LOGIN_URL = "https://www.headspace.com/login"
 AUTH_URL = "https://auth.headspace.com/co/authenticate"
 BEARER_TOKEN_URL = "https://auth.headspace.com/authorize"
 
-session = requests.Session()
 console = Console()
 
 headers = {
@@ -21,11 +21,9 @@ headers = {
     "TE": "Trailers",
 }
 
-session.headers.update(headers)
-
 
 def get_client_id():
-    response = session.get(LOGIN_URL)
+    response = session.get(LOGIN_URL, headers=headers)
     client_id = re.findall(r'"clientId":"(.+?)",', response.text)[0]
     return client_id
 
@@ -49,7 +47,7 @@ def get_bearer_token(client_id, login_ticket):
         "login_ticket": login_ticket,
         "prompt": "none",
     }
-    response = session.get(BEARER_TOKEN_URL, params=params)
+    response = session.get(BEARER_TOKEN_URL, params=params, headers=headers)
     html = response.text
     bearer_token = re.findall(r'"access_token":"(.+?)"', html)[0]
     return bearer_token
@@ -0,0 +1,87 @@
+import os
+import shutil
+import threading
+from contextlib import suppress
+from typing import Dict, Optional, Tuple
+
+from pyheadspace.manifest import Manifest, ManifestEntry, open_manifest
+
+BLOBS_NAME = ".headspace-blobs"
+# ioctl that makes a copy-on-write clone of a file on btrfs and XFS
+FICLONE = 0x40049409
+COPY_BUFFER = 1024 * 1024
+
+
+class BlobStore:
+    """
+    One copy of every downloaded media item, named by its media item ID.
+
+    A blob is hardlinked into each pack, level and Techniques directory
+    that needs it, so a session that several packs share is downloaded and
+    stored once. Blobs have their own manifest with the size and SHA-256 of
+    the download, a blob is only reused while its size still matches.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = os.path.join(directory, BLOBS_NAME)
+        self.manifest: Manifest = open_manifest(self.directory)
+
+    def get(self, media_id: str) -> Optional[Tuple[str, ManifestEntry]]:
+        entry = self.manifest.completed(media_id, media_id)
+        if entry is None:
+            return None
+        return os.path.join(self.directory, entry.path), entry
+
+    def add(self, filepath: str, entry: ManifestEntry) -> Tuple[str, ManifestEntry]:
+        """
+        Keep the finished download at `filepath` as the blob of its media item
+        and return the blob like `get` does.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = entry.media_id + os.path.splitext(filepath)[1]
+        blob = os.path.join(self.directory, path)
+        link_file(filepath, blob)
+        entry = entry._replace(target=entry.media_id, path=path)
+        self.manifest.add(entry)
+        return blob, entry
+
+
+def link_file(source: str, destination: str):
+    """
+    Hardlink `source` to `destination`, replacing what is there. Where
+    hardlinks are not possible it is cloned or, as a last resort, copied.
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    temporary = destination + ".link"
+    with suppress(FileNotFoundError):
+        os.remove(temporary)
+    try:
+        os.link(source, temporary)
+    except OSError:
+        _clone(source, temporary)
+    os.replace(temporary, destination)
+
+
+def _clone(source: str, destination: str):
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            import fcntl
+
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except (ImportError, OSError):
+            pass
+        shutil.copyfileobj(src, dst, COPY_BUFFER)
+
+
+_stores: Dict[str, BlobStore] = {}
+_stores_lock = threading.Lock()
+
+
+def open_blobs(directory: str) -> BlobStore:
+    directory = os.path.abspath(directory)
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = BlobStore(directory)
+        return _stores[directory]
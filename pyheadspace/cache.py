@@ -0,0 +1,120 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Optional
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body TEXT NOT NULL,
+    etag TEXT,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+)
+"""
+
+
+class CacheEntry(NamedTuple):
+    body: str
+    etag: Optional[str]
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at > time.time()
+
+
+def cache_key(url: str, params: Optional[dict], language: str) -> str:
+    return json.dumps([url, sorted((params or {}).items()), language], default=str)
+
+
+class ResponseCache:
+    """
+    Persistent cache for JSON responses of the content API.
+
+    Entries live in a SQLite database and are evicted least recently used
+    first once the stored bodies grow past `max_size` bytes. Expired entries
+    are kept around so they can be revalidated with their ETag.
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.enabled = True
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(SCHEMA)
+        return self._connection
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT body, etag, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            connection.commit()
+        return CacheEntry(*row)
+
+    def set(self, key: str, body: str, *, ttl: int, etag: Optional[str] = None):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, body, etag, now + ttl, now, len(body)),
+            )
+            self._evict(connection)
+            connection.commit()
+
+    def refresh(self, key: str, *, ttl: int):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "UPDATE responses SET expires_at = ?, accessed_at = ? WHERE key = ?",
+                (now + ttl, now, key),
+            )
+            connection.commit()
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+
+    def _evict(self, connection: sqlite3.Connection):
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_size:
+            return
+        rows = connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
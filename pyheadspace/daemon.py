@@ -0,0 +1,183 @@
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+from pyheadspace.jobs import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_WORKERS, JobQueue
+
+logger = logging.getLogger("pyHeadspace")
+
+
+def read_token(path: str) -> Optional[str]:
+    """Token that `headspace serve` accepts jobs with, None if it has none yet."""
+    try:
+        with open(path, "r") as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def create_token(path: str) -> str:
+    """
+    Token stored at `path`, readable only by this user. It is created on
+    first use and kept, so `headspace submit` works across restarts.
+    """
+    token = read_token(path)
+    if token is None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        token = secrets.token_urlsafe(32)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as file:
+            file.write(token)
+    os.chmod(path, 0o600)
+    return token
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the daemon:
+
+        POST /jobs      {"args": ["pack", "--id", "5"]}, queues a job
+        GET  /jobs      lists all jobs
+        GET  /jobs/<id> a single job
+
+    With a token every request needs an `Authorization: Bearer <token>`
+    header.
+    """
+
+    server: "JobServer"
+
+    def log_message(self, format, *args):
+        logger.info(format % args)
+
+    def _authorized(self) -> bool:
+        if self.server.token is None:
+            return True
+        sent = self.headers.get("authorization", "")
+        return hmac.compare_digest(
+            sent.encode(), f"Bearer {self.server.token}".encode()
+        )
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._json({"error": "Missing or wrong token"}, status=401)
+        if self.path.rstrip("/") == "/jobs":
+            return self._json([job._asdict() for job in self.server.queue.list()])
+        match = re.fullmatch(r"/jobs/(\d+)", self.path)
+        job = self.server.queue.get(int(match.group(1))) if match else None
+        if job is None:
+            return self._json({"error": "Not found"}, status=404)
+        return self._json(job._asdict())
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._json({"error": "Missing or wrong token"}, status=401)
+        if self.path.rstrip("/") != "/jobs":
+            return self._json({"error": "Not found"}, status=404)
+        try:
+            length = int(self.headers.get("content-length", 0))
+            args = json.loads(self.rfile.read(length))["args"]
+            if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+                raise TypeError
+        except (KeyError, TypeError, ValueError):
+            return self._json({"error": 'Expected {"args": [...]}'}, status=400)
+        error = self.server.validate(args)
+        if error:
+            return self._json({"error": error}, status=400)
+        job, created = self.server.queue.submit(args)
+        self._json(job._asdict(), status=201 if created else 200)
+
+    def _json(self, body, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class JobServer(ThreadingHTTPServer):
+    """
+    Accepts jobs on a local HTTP port and runs up to `workers` of them at a
+    time with `run_job`, in this process.
+
+    Running every job in the same process is the point of the daemon: the
+    connection pools, the open caches, signed URLs and the decoded token
+    stay warm from one job to the next.
+
+    Jobs write files as the user running the daemon, so only clients that
+    send `token` are accepted. Without one it only listens on loopback.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        run_job: Callable[[List[str]], None],
+        *,
+        validate: Callable[[List[str]], Optional[str]] = lambda args: None,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        workers: int = DEFAULT_WORKERS,
+        token: Optional[str] = None,
+    ):
+        super().__init__((host, port), JobHandler)
+        if (
+            token is None
+            and not ipaddress.ip_address(self.server_address[0]).is_loopback
+        ):
+            self.server_close()
+            raise ValueError("jobs from other hosts need a token")
+        self.token = token
+        self.queue = queue
+        self.run_job = run_job
+        self.validate = validate
+        self.workers = workers
+        self._stopped = threading.Event()
+        self._job_threads: List[threading.Thread] = []
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start_workers(self):
+        recovered = self.queue.recover()
+        if recovered:
+            logger.info(f"Queued {recovered} interrupted job(s) again")
+        for number in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"pyheadspace-job-{number}", daemon=True
+            )
+            thread.start()
+            self._job_threads.append(thread)
+
+    def stop(self):
+        """Stop the workers once `serve_forever` has returned."""
+        self._stopped.set()
+        self.server_close()
+
+    def _work(self):
+        while not self._stopped.is_set():
+            job = self.queue.next(timeout=0.5)
+            if job is None:
+                continue
+            logger.info(f"Starting job {job.id}: {' '.join(job.args)}")
+            try:
+                self.run_job(job.args)
+            except BaseException as e:
+                if self._stopped.is_set():
+                    # Leave it running, `recover` queues it on the next start
+                    return
+                job = self.queue.finish(job, str(e) or type(e).__name__)
+                logger.error(f"Job {job.id} failed: {job.error}")
+            else:
+                self.queue.finish(job)
+                logger.info(f"Finished job {job.id}")
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+from pyheadspace.models import Entity, MediaItem, Pack, PackItem
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pack_items (
+    pack_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    entity_id TEXT,
+    PRIMARY KEY (pack_id, position)
+);
+CREATE TABLE IF NOT EXISTS entities (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    author_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (kind, id, author_id)
+);
+CREATE TABLE IF NOT EXISTS media_items (
+    kind TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    author_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    duration_ms INTEGER,
+    mime_type TEXT,
+    PRIMARY KEY (kind, entity_id, author_id, position)
+);
+CREATE TABLE IF NOT EXISTS entity_authors (
+    kind TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    author_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (kind, entity_id, author_id, position)
+);
+CREATE TABLE IF NOT EXISTS legacy_ids (
+    content_id INTEGER PRIMARY KEY,
+    entity_id INTEGER NOT NULL
+);
+"""
+
+# Below SQLite's limit on the number of parameters of one statement
+BATCH_SIZE = 500
+
+
+def response_digest(response: dict) -> str:
+    return hashlib.sha1(json.dumps(response, sort_keys=True).encode()).hexdigest()
+
+
+class CatalogueIndex:
+    """
+    Local index of packs, activities, techniques and their media items.
+
+    The index is filled by `headspace sync-index`. Commands look entities up
+    here first and only fall back to the API for entries that are missing.
+    It also remembers the legacy entity ID of every content ID of the web
+    app that was looked up, those never change.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.enabled = True
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def pack_ids(self) -> List[int]:
+        if not self.enabled:
+            return []
+        with self._lock:
+            rows = self._connect().execute("SELECT id FROM packs ORDER BY id")
+            return [pack_id for (pack_id,) in rows.fetchall()]
+
+    def pack_digest(self, pack_id: Union[str, int]) -> Optional[str]:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute("SELECT digest FROM packs WHERE id = ?", (int(pack_id),))
+                .fetchone()
+            )
+        return row[0] if row else None
+
+    def get_pack(self, pack_id: Union[str, int]) -> Optional[Pack]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT name, description FROM packs WHERE id = ?", (int(pack_id),)
+            ).fetchone()
+            if row is None:
+                return None
+            items = connection.execute(
+                "SELECT type, entity_id FROM pack_items"
+                " WHERE pack_id = ? ORDER BY position",
+                (int(pack_id),),
+            ).fetchall()
+        return Pack(int(pack_id), row[0], row[1], tuple(PackItem(*i) for i in items))
+
+    def put_pack(self, pack: Pack, digest: str):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO packs VALUES (?, ?, ?, ?, ?)",
+                (pack.id, pack.name, pack.description, digest, time.time()),
+            )
+            connection.execute("DELETE FROM pack_items WHERE pack_id = ?", (pack.id,))
+            connection.executemany(
+                "INSERT INTO pack_items VALUES (?, ?, ?, ?)",
+                [
+                    (pack.id, position, item.type, item.entity_id)
+                    for position, item in enumerate(pack.items)
+                ],
+            )
+            connection.commit()
+
+    def remove_packs(self, pack_ids: List[int]):
+        with self._lock:
+            connection = self._connect()
+            for pack_id in pack_ids:
+                connection.execute("DELETE FROM packs WHERE id = ?", (pack_id,))
+                connection.execute(
+                    "DELETE FROM pack_items WHERE pack_id = ?", (pack_id,)
+                )
+            connection.commit()
+
+    def get_entity(
+        self, kind: str, entity_id: Union[str, int], author_id: int = 0
+    ) -> Optional[Entity]:
+        if not self.enabled:
+            return None
+        key = (kind, str(entity_id), author_id)
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT name FROM entities WHERE kind = ? AND id = ? AND author_id = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            media_items = connection.execute(
+                "SELECT id, duration_ms, mime_type FROM media_items"
+                " WHERE kind = ? AND entity_id = ? AND author_id = ?"
+                " ORDER BY position",
+                key,
+            ).fetchall()
+            authors = connection.execute(
+                "SELECT id FROM entity_authors"
+                " WHERE kind = ? AND entity_id = ? AND author_id = ?"
+                " ORDER BY position",
+                key,
+            ).fetchall()
+        return Entity(
+            kind,
+            str(entity_id),
+            row[0],
+            tuple(MediaItem(*item) for item in media_items),
+            author_id,
+            tuple(author for (author,) in authors),
+        )
+
+    def put_entity(self, entity: Entity, digest: str):
+        if not self.enabled:
+            return
+        key = (entity.kind, entity.id, entity.author_id)
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?)",
+                key + (entity.name, digest, time.time()),
+            )
+            connection.execute(
+                "DELETE FROM media_items"
+                " WHERE kind = ? AND entity_id = ? AND author_id = ?",
+                key,
+            )
+            connection.executemany(
+                "INSERT INTO media_items VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    key + (position, item.id, item.duration_ms, item.mime_type)
+                    for position, item in enumerate(entity.media_items)
+                ],
+            )
+            connection.execute(
+                "DELETE FROM entity_authors"
+                " WHERE kind = ? AND entity_id = ? AND author_id = ?",
+                key,
+            )
+            connection.executemany(
+                "INSERT INTO entity_authors VALUES (?, ?, ?, ?, ?)",
+                [
+                    key + (position, author)
+                    for position, author in enumerate(entity.authors)
+                ],
+            )
+            connection.commit()
+
+    def get_legacy_ids(self, content_ids: Iterable[int]) -> Dict[int, int]:
+        """Known legacy entity IDs of the given content IDs of the web app."""
+        if not self.enabled:
+            return {}
+        content_ids = [int(content_id) for content_id in content_ids]
+        found = {}
+        with self._lock:
+            connection = self._connect()
+            for start in range(0, len(content_ids), BATCH_SIZE):
+                batch = content_ids[start : start + BATCH_SIZE]
+                rows = connection.execute(
+                    "SELECT content_id, entity_id FROM legacy_ids"
+                    f" WHERE content_id IN ({', '.join('?' * len(batch))})",
+                    batch,
+                )
+                found.update(rows.fetchall())
+        return found
+
+    def put_legacy_ids(self, legacy_ids: Dict[int, int]):
+        if not self.enabled:
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO legacy_ids VALUES (?, ?)",
+                legacy_ids.items(),
+            )
+            connection.commit()
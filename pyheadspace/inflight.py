@@ -0,0 +1,38 @@
+import threading
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+
+class InFlight:
+    """
+    Lets concurrent transfers of the same media item share one download.
+
+    The first caller of `claim` owns the transfer and reports the finished
+    file through `done`. Everyone else gets the owner's future and can wait
+    for that file instead of downloading it again.
+    """
+
+    def __init__(self):
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def claim(self, media_id: str) -> Tuple[bool, Future]:
+        with self._lock:
+            future = self._pending.get(media_id)
+            if future is not None:
+                return False, future
+            future = self._pending[media_id] = Future()
+            return True, future
+
+    def done(
+        self,
+        media_id: str,
+        path: Optional[str] = None,
+        error: Optional[BaseException] = None,
+    ):
+        with self._lock:
+            future = self._pending.pop(media_id)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(path)
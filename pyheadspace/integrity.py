@@ -0,0 +1,110 @@
+import base64
+import binascii
+import hashlib
+import mmap
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Mapping, NamedTuple, Optional, Tuple
+
+from pyheadspace.manifest import Manifest, ManifestEntry
+
+# hashlib releases the GIL while hashing, files are fed to it in slices this
+# large so several threads can hash at once
+HASH_SLICE = 8 * 1024 * 1024
+
+OK = "ok"
+CORRUPT = "corrupt"
+MISSING = "missing"
+
+
+def expected_md5(headers: Mapping[str, str], ranged: bool = False) -> Optional[str]:
+    """
+    MD5 of the body as announced by the CDN, in hex, or None if it sent none
+    that can be trusted.
+
+    Content-MD5 and the md5 of x-goog-hash are used as they are, except that
+    Content-MD5 only covers the part that was sent for a `ranged` response
+    and is ignored then. An ETag is only the MD5 of the content for objects
+    that were not uploaded in parts, those are 32 hex digits without a dash.
+    Bodies are written as they are sent, still encoded if the CDN compressed
+    them, which is what these hashes cover.
+    """
+    content_md5 = None if ranged else headers.get("content-md5")
+    for value in [content_md5] + re.findall(
+        r"md5=([^,\s]+)", headers.get("x-goog-hash", "")
+    ):
+        if value:
+            try:
+                digest = base64.b64decode(value, validate=True)
+            except (binascii.Error, ValueError):
+                continue
+            if len(digest) == 16:
+                return digest.hex()
+    etag = headers.get("etag", "")
+    match = re.fullmatch(r'(?:W/)?"?([0-9a-fA-F]{32})"?', etag)
+    if match and not etag.startswith("W/"):
+        return match.group(1).lower()
+    return None
+
+
+def mmap_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return sha256.hexdigest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                for start in range(0, len(view), HASH_SLICE):
+                    sha256.update(view[start : start + HASH_SLICE])
+            finally:
+                view.release()
+    return sha256.hexdigest()
+
+
+class Verification(NamedTuple):
+    manifest: Manifest
+    entry: ManifestEntry
+    status: str
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.manifest.directory, self.entry.path)
+
+
+def verify(manifests: List[Manifest], jobs: int) -> Iterator[Verification]:
+    """
+    Hash every file recorded in `manifests` again on `jobs` threads and
+    compare it with the recorded SHA-256. Hardlinked copies of a file are
+    only read once.
+    """
+    entries: Dict[Tuple[int, int], List[Tuple[Manifest, ManifestEntry]]] = {}
+    for manifest in manifests:
+        for entry in manifest.entries():
+            try:
+                stat = os.stat(os.path.join(manifest.directory, entry.path))
+            except OSError:
+                yield Verification(manifest, entry, MISSING)
+                continue
+            if stat.st_size != entry.size:
+                yield Verification(manifest, entry, CORRUPT)
+                continue
+            entries.setdefault((stat.st_dev, stat.st_ino), []).append((manifest, entry))
+
+    def check(links: List[Tuple[Manifest, ManifestEntry]]) -> List[Verification]:
+        manifest, entry = links[0]
+        try:
+            digest = mmap_sha256(os.path.join(manifest.directory, entry.path))
+        except OSError:
+            digest = None
+        return [
+            Verification(manifest, entry, OK if digest == entry.sha256 else CORRUPT)
+            for manifest, entry in links
+        ]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for results in executor.map(check, entries.values()):
+            yield from results
@@ -0,0 +1,150 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8437
+DEFAULT_WORKERS = 2
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    args TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class Job(NamedTuple):
+    id: int
+    # Command line of the job, e.g. ["pack", "--id", "5", "--out", "/music"]
+    args: List[str]
+    state: str
+    error: Optional[str]
+    created_at: float
+    updated_at: float
+
+
+class JobQueue:
+    """
+    Download jobs of `headspace serve`, kept in SQLite so queued work
+    survives a restart.
+
+    Jobs that were still running when the daemon stopped are queued again by
+    `recover`. Their files pick up from the partial downloads and the
+    manifest, so nothing finished is downloaded twice.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(SCHEMA)
+        return self._connection
+
+    def _select(
+        self, where: str = "", params: Sequence = (), limit: int = -1
+    ) -> List[Job]:
+        rows = self._connect().execute(
+            "SELECT id, args, state, error, created_at, updated_at FROM jobs "
+            f"{where} ORDER BY id LIMIT ?",
+            (*params, limit),
+        )
+        return [Job(row[0], json.loads(row[1]), *row[2:]) for row in rows]
+
+    def submit(self, args: List[str]) -> Tuple[Job, bool]:
+        """
+        Queue a job, unless the same command line is already queued or
+        running. Returns the job and whether it was created.
+        """
+        encoded = json.dumps(list(args))
+        with self._lock:
+            existing = self._select(
+                "WHERE args = ? AND state IN (?, ?)", (encoded, QUEUED, RUNNING)
+            )
+            if existing:
+                return existing[0], False
+            now = time.time()
+            with self._connect() as connection:
+                cursor = connection.execute(
+                    "INSERT INTO jobs (args, state, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (encoded, QUEUED, now, now),
+                )
+            self._queued.notify()
+            return Job(cursor.lastrowid, list(args), QUEUED, None, now, now), True
+
+    def next(self, timeout: Optional[float] = None) -> Optional[Job]:
+        """Wait for the oldest queued job and mark it as running."""
+        with self._lock:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                queued = self._select("WHERE state = ?", (QUEUED,), limit=1)
+                if queued:
+                    job = queued[0]._replace(state=RUNNING, updated_at=time.time())
+                    self._update(job)
+                    return job
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._queued.wait(remaining)
+
+    def finish(self, job: Job, error: Optional[str] = None) -> Job:
+        job = job._replace(
+            state=FAILED if error is not None else DONE,
+            error=error,
+            updated_at=time.time(),
+        )
+        with self._lock:
+            self._update(job)
+        return job
+
+    def _update(self, job: Job):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                (job.state, job.error, job.updated_at, job.id),
+            )
+
+    def recover(self) -> int:
+        """Queue the jobs interrupted by a stop of the daemon again."""
+        with self._lock:
+            with self._connect() as connection:
+                count = connection.execute(
+                    "UPDATE jobs SET state = ?, updated_at = ? WHERE state = ?",
+                    (QUEUED, time.time(), RUNNING),
+                ).rowcount
+            self._queued.notify_all()
+        return count
+
+    def get(self, job_id: int) -> Optional[Job]:
+        with self._lock:
+            jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def list(self) -> List[Job]:
+        with self._lock:
+            return self._select()
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,276 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from pyheadspace.scheduler import DownloadTask
+
+# States of a run
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# States of a planned media item, besides DONE and FAILED
+PLANNED = "planned"
+SIGNED = "signed"
+DOWNLOADING = "downloading"
+ITEM_STATES = (PLANNED, SIGNED, DOWNLOADING, DONE, FAILED)
+
+# Runs that are kept for `headspace report` and `headspace resume`
+KEEP_RUNS = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    planned INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    run_id INTEGER NOT NULL,
+    media_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    pack_name TEXT NOT NULL,
+    out TEXT NOT NULL,
+    is_technique INTEGER NOT NULL,
+    direct_url TEXT,
+    state TEXT NOT NULL,
+    downloaded INTEGER NOT NULL,
+    path TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (run_id, media_id, out, pack_name, filename)
+);
+"""
+
+
+class Run(NamedTuple):
+    id: int
+    # Command and its parameters, enough to invoke it again
+    command: str
+    params: dict
+    state: str
+    # Whether every lookup of the run finished, so `items` is its whole plan
+    planned: bool
+    created_at: float
+    updated_at: float
+
+
+class JournalItem(NamedTuple):
+    run_id: int
+    media_id: str
+    name: str
+    filename: str
+    pack_name: Optional[str]
+    out: str
+    is_technique: bool
+    direct_url: Optional[str]
+    state: str
+    # Bytes on disk when it was last seen downloading, and the file they are in
+    downloaded: int
+    path: Optional[str]
+    error: Optional[str]
+    updated_at: float
+
+    def task(self) -> DownloadTask:
+        return DownloadTask(
+            self.media_id,
+            self.name,
+            self.filename,
+            self.pack_name,
+            self.out,
+            self.is_technique,
+            self.direct_url,
+        )
+
+
+def _key(task: DownloadTask) -> tuple:
+    return (
+        task.media_id,
+        os.path.abspath(task.out),
+        task.pack_name or "",
+        task.filename,
+    )
+
+
+class Journal:
+    """
+    Write-ahead record of download runs, kept in SQLite.
+
+    Every media item is written down when it is planned and again whenever
+    it is signed, makes progress or ends, before the next step depends on
+    it. After a crash `headspace resume` takes the unfinished items of a run
+    from here instead of looking the whole catalogue up again, and
+    `headspace report` lists what failed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            # Progress is written once a second per download, keep that cheap
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _execute(self, sql: str, params: Sequence = ()) -> sqlite3.Cursor:
+        with self._lock:
+            with self._connect() as connection:
+                return connection.execute(sql, params)
+
+    def start(self, command: str, params: dict) -> "JournalRun":
+        now = time.time()
+        cursor = self._execute(
+            "INSERT INTO runs (command, params, state, planned, created_at,"
+            " updated_at) VALUES (?, ?, ?, 0, ?, ?)",
+            (command, json.dumps(params), RUNNING, now, now),
+        )
+        self.prune()
+        return JournalRun(self, cursor.lastrowid)
+
+    def resume(self, run: Run) -> "JournalRun":
+        self._set_run(run.id, state=RUNNING)
+        return JournalRun(self, run.id)
+
+    def _set_run(self, run_id: int, **columns):
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        self._execute(
+            f"UPDATE runs SET {assignments}, updated_at = ? WHERE id = ?",
+            (*columns.values(), time.time(), run_id),
+        )
+
+    def _runs(self, where: str = "", params: Sequence = ()) -> List[Run]:
+        rows = self._execute(
+            "SELECT id, command, params, state, planned, created_at, updated_at"
+            f" FROM runs {where} ORDER BY id DESC",
+            params,
+        ).fetchall()
+        return [
+            Run(row[0], row[1], json.loads(row[2]), row[3], bool(row[4]), *row[5:])
+            for row in rows
+        ]
+
+    def runs(self) -> List[Run]:
+        """All runs, newest first."""
+        return self._runs()
+
+    def get(self, run_id: int) -> Optional[Run]:
+        runs = self._runs("WHERE id = ?", (run_id,))
+        return runs[0] if runs else None
+
+    def last_unfinished(self) -> Optional[Run]:
+        runs = self._runs("WHERE state != ?", (DONE,))
+        return runs[0] if runs else None
+
+    def items(self, run_id: int, states: Sequence[str] = ()) -> List[JournalItem]:
+        where = "WHERE run_id = ?"
+        if states:
+            where += f" AND state IN ({', '.join('?' * len(states))})"
+        rows = self._execute(
+            "SELECT run_id, media_id, name, filename, pack_name, out, is_technique,"
+            " direct_url, state, downloaded, path, error, updated_at"
+            f" FROM items {where} ORDER BY rowid",
+            (run_id, *states),
+        ).fetchall()
+        return [
+            JournalItem(*row[:4], row[4] or None, row[5], bool(row[6]), *row[7:])
+            for row in rows
+        ]
+
+    def counts(self, run_id: int) -> Dict[str, int]:
+        rows = self._execute(
+            "SELECT state, COUNT(*) FROM items WHERE run_id = ? GROUP BY state",
+            (run_id,),
+        )
+        return Counter(dict(rows.fetchall()))
+
+    def prune(self, keep: int = KEEP_RUNS):
+        """Forget all but the last `keep` runs, finished or not."""
+        old = [run.id for run in self._runs()[keep:]]
+        for run_id in old:
+            self._execute("DELETE FROM items WHERE run_id = ?", (run_id,))
+            self._execute("DELETE FROM runs WHERE id = ?", (run_id,))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class JournalRun:
+    """The journal of one run, passed to the scheduler that carries it out."""
+
+    def __init__(self, journal: Journal, run_id: int):
+        self.journal = journal
+        self.id = run_id
+
+    def plan(self, task: DownloadTask):
+        # A resumed run plans the same items again, they keep their state
+        self.journal._execute(
+            "INSERT OR IGNORE INTO items VALUES"
+            " (?, ?, ?, ?, ?, ?, ?, ?, ?, 0, NULL, NULL, ?)",
+            (
+                self.id,
+                task.media_id,
+                task.name,
+                task.filename,
+                task.pack_name or "",
+                os.path.abspath(task.out),
+                task.is_technique,
+                task.direct_url,
+                PLANNED,
+                time.time(),
+            ),
+        )
+
+    def _set(self, task: DownloadTask, state: str, **columns):
+        columns["state"] = state
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        self.journal._execute(
+            f"UPDATE items SET {assignments}, updated_at = ? WHERE run_id = ?"
+            " AND media_id = ? AND out = ? AND pack_name = ? AND filename = ?",
+            (*columns.values(), time.time(), self.id, *_key(task)),
+        )
+
+    def signed(self, task: DownloadTask):
+        self._set(task, SIGNED)
+
+    def downloading(self, task: DownloadTask, path: str, downloaded: int):
+        self._set(task, DOWNLOADING, path=path, downloaded=downloaded)
+
+    def done(self, task: DownloadTask):
+        self._set(task, DONE, error=None)
+
+    def failed(self, task: DownloadTask, error: BaseException):
+        self._set(task, FAILED, error=str(error) or type(error).__name__)
+
+    def planned(self):
+        """Every lookup finished, the items are the complete plan of the run."""
+        self.journal._set_run(self.id, planned=1)
+
+    def abandon(self):
+        """
+        Forget the run if it stopped before planning anything, e.g. on bad
+        arguments. Resuming it could only fail the same way.
+        """
+        self.journal._execute(
+            "DELETE FROM runs WHERE id = ?"
+            " AND NOT EXISTS (SELECT 1 FROM items WHERE run_id = ?)",
+            (self.id, self.id),
+        )
+
+    def finish(self, failed: bool):
+        self.journal._set_run(self.id, state=FAILED if failed else DONE)
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+MANIFEST_NAME = ".headspace-manifest.jsonl"
+
+
+class ManifestEntry(NamedTuple):
+    # Path relative to the output directory, without the file extension
+    target: str
+    media_id: str
+    path: str
+    size: int
+    content_type: str
+    sha256: str
+
+
+class Manifest:
+    """
+    Record of the files that were completely downloaded into a directory.
+
+    Entries are appended as JSON lines, a later line for the same target
+    replaces an earlier one.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST_NAME)
+        self._entries: Optional[Dict[str, ManifestEntry]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, ManifestEntry]:
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.path, "r") as file:
+                    for line in file:
+                        try:
+                            entry = ManifestEntry(**json.loads(line))
+                        except (TypeError, ValueError):
+                            # Ignore a line cut short by a crash
+                            continue
+                        self._entries[entry.target] = entry
+            except FileNotFoundError:
+                pass
+        return self._entries
+
+    def get(self, target: str) -> Optional[ManifestEntry]:
+        with self._lock:
+            return self._load().get(target)
+
+    def completed(self, target: str, media_id: str) -> Optional[ManifestEntry]:
+        entry = self.get(target)
+        if entry is None or entry.media_id != media_id:
+            return None
+        try:
+            size = os.path.getsize(os.path.join(self.directory, entry.path))
+        except OSError:
+            return None
+        return entry if size == entry.size else None
+
+    def add(self, entry: ManifestEntry):
+        with self._lock:
+            self._load()[entry.target] = entry
+            with open(self.path, "a") as file:
+                file.write(json.dumps(entry._asdict()) + "\n")
+
+    def entries(self) -> List[ManifestEntry]:
+        with self._lock:
+            return list(self._load().values())
+
+    def remove(self, targets: Iterable[str]):
+        """Forget `targets`, the manifest is rewritten without them."""
+        with self._lock:
+            entries = self._load()
+            for target in targets:
+                entries.pop(target, None)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                for entry in entries.values():
+                    file.write(json.dumps(entry._asdict()) + "\n")
+            os.replace(tmp_path, self.path)
+
+
+def file_sha256(path: str, *, hexdigest: bool = True, length: Optional[int] = None):
+    """Checksum of the file at `path`, or of its first `length` bytes."""
+    sha256 = hashlib.sha256()
+    hash_file(path, [sha256], length=length)
+    return sha256.hexdigest() if hexdigest else sha256
+
+
+def hash_file(path: str, hashes: Iterable, *, length: Optional[int] = None):
+    """Feed the file at `path`, or its first `length` bytes, to every hash."""
+    hashes = list(hashes)
+    remaining = float("inf") if length is None else length
+    with open(path, "rb") as file:
+        while remaining > 0:
+            block = file.read(int(min(1024 * 1024, remaining)))
+            if not block:
+                break
+            for hash_ in hashes:
+                hash_.update(block)
+            remaining -= len(block)
+
+
+_manifests: Dict[str, Manifest] = {}
+_manifests_lock = threading.Lock()
+
+
+def open_manifest(directory: str) -> Manifest:
+    directory = os.path.abspath(directory)
+    with _manifests_lock:
+        if directory not in _manifests:
+            _manifests[directory] = Manifest(directory)
+        return _manifests[directory]
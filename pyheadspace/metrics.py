@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# Upper bounds of the latency buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the `q` quantile."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the hot paths.
+
+    Nothing is recorded unless `enabled` is set by `--profile`, so the
+    instrumentation costs a single attribute lookup otherwise.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def summary(self) -> List[Tuple[str, ...]]:
+        """
+        Rows of metric, labels, count, mean, p95 and max for the report,
+        latencies are in milliseconds.
+        """
+        rows = []
+        with self._lock:
+            for (name, labels), h in self.histograms.items():
+                rows.append(
+                    (
+                        name,
+                        _format_labels(labels),
+                        str(h.count),
+                        f"{h.sum / h.count * 1000:.1f}",
+                        f"{h.quantile(0.95) * 1000:.0f}",
+                        f"{h.max * 1000:.0f}",
+                    )
+                )
+            for (name, labels), count in self.counters.items():
+                rows.append((name, _format_labels(labels), f"{count:,.0f}", "", "", ""))
+            transfer = sum(
+                h.sum
+                for (name, _), h in self.histograms.items()
+                if name == "download_seconds"
+            )
+            written = sum(
+                count
+                for (name, _), count in self.counters.items()
+                if name == "bytes_written_total"
+            )
+        if transfer:
+            throughput = f"{written / transfer / 1024**2:.2f} MB/s"
+            rows.append(("download_throughput", "", "", throughput, "", ""))
+        return sorted(rows)
+
+    def json_lines(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), count in sorted(self.counters.items()):
+                lines.append({"metric": name, "labels": dict(labels), "value": count})
+            for (name, labels), h in sorted(self.histograms.items()):
+                lines.append(
+                    {
+                        "metric": name,
+                        "labels": dict(labels),
+                        "count": h.count,
+                        "sum": h.sum,
+                        "max": h.max,
+                        "buckets": dict(zip(map(str, BUCKETS + ("+Inf",)), h.counts)),
+                    }
+                )
+        return "".join(json.dumps(line) + "\n" for line in lines)
+
+    def prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for (name, labels), count in sorted(self.counters.items()):
+                _prom_type(lines, name, "counter")
+                lines.append(f"pyheadspace_{name}{_prom_labels(labels)} {count}")
+            for (name, labels), h in sorted(self.histograms.items()):
+                _prom_type(lines, name, "histogram")
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), h.counts):
+                    cumulative += count
+                    bucket_labels = labels + (("le", str(bound)),)
+                    lines.append(
+                        f"pyheadspace_{name}_bucket{_prom_labels(bucket_labels)} "
+                        f"{cumulative}"
+                    )
+                lines.append(f"pyheadspace_{name}_sum{_prom_labels(labels)} {h.sum}")
+                lines.append(
+                    f"pyheadspace_{name}_count{_prom_labels(labels)} {h.count}"
+                )
+        return "".join(line + "\n" for line in lines)
+
+
+def _format_labels(labels: Labels) -> str:
+    return ",".join(f"{key}={value}" for key, value in labels)
+
+
+def _prom_type(lines: List[str], name: str, kind: str):
+    line = f"# TYPE pyheadspace_{name} {kind}"
+    if line not in lines:
+        lines.append(line)
+
+
+def _prom_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
@@ -0,0 +1,81 @@
+import sys
+from typing import NamedTuple, Optional, Tuple, Union
+
+
+class MediaItem(NamedTuple):
+    id: str
+    duration_ms: Optional[int]
+    mime_type: Optional[str]
+
+
+class Entity(NamedTuple):
+    """An activity, technique or everyday session with its media items."""
+
+    kind: str
+    id: str
+    name: str
+    media_items: Tuple[MediaItem, ...]
+    author_id: int = 0
+    # Authors whose narration of it can be asked for with `authorId`
+    authors: Tuple[int, ...] = ()
+
+
+class PackItem(NamedTuple):
+    type: str
+    entity_id: Optional[str]
+
+
+class Pack(NamedTuple):
+    id: int
+    name: str
+    description: str
+    items: Tuple[PackItem, ...]
+
+
+def parse_pack(pack_id: Union[str, int], response: dict) -> Pack:
+    attributes = response["data"]["attributes"]
+    items = []
+    # Keep every included entry so `startIndex` of player URLs still lines up
+    for item in response["included"]:
+        entity_id = None
+        if item["type"] == "orderedActivities":
+            entity_id = str(item["relationships"]["activity"]["data"]["id"])
+        elif item["type"] == "orderedTechniques":
+            entity_id = str(item["relationships"]["technique"]["data"]["id"])
+        # The same few type names repeat in every pack, share one copy
+        items.append(PackItem(sys.intern(item["type"]), entity_id))
+    return Pack(
+        int(pack_id),
+        attributes["name"],
+        attributes.get("description", ""),
+        tuple(items),
+    )
+
+
+def parse_entity(
+    kind: str, entity_id: Union[str, int], response: dict, author_id: int = 0
+) -> Entity:
+    attributes = response["data"]["attributes"]
+    try:
+        name = attributes["name"]
+    except KeyError:
+        name = attributes["titleText"]
+    media_items = []
+    authors = []
+    for item in response.get("included", []):
+        if item["type"] == "authors":
+            authors.append(int(item["id"]))
+        if item["type"] != "mediaItems":
+            continue
+        duration = item["attributes"].get("durationInMs")
+        mime_type = item["attributes"].get("mimeType")
+        media_items.append(
+            MediaItem(
+                str(item["id"]),
+                int(duration) if duration is not None else None,
+                sys.intern(mime_type) if mime_type is not None else None,
+            )
+        )
+    return Entity(
+        kind, str(entity_id), name, tuple(media_items), author_id, tuple(authors)
+    )
@@ -0,0 +1,112 @@
+import glob
+import json
+import os
+from typing import Optional, Tuple
+
+
+class PartialFile:
+    """
+    Download target that is written to `<path>.part` and only renamed to
+    `path` once it is complete.
+
+    A small journal next to the partial file records which response the
+    bytes belong to, so a later run can continue with a Range request
+    instead of starting over. A preallocated partial file already has its
+    final size, for those the journal also records how many bytes were
+    written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.part_path = path + ".part"
+        self.journal_path = path + ".part.json"
+        # Whether the partial file found by `resume_offset` was preallocated
+        self.preallocated = False
+        self._journal = {}
+
+    def resume_offset(self, total_length: int, validator: Optional[str]) -> int:
+        try:
+            with open(self.journal_path, "r") as file:
+                journal = json.load(file)
+            size = os.path.getsize(self.part_path)
+        except (OSError, ValueError):
+            return 0
+        if journal.get("total_length") != total_length:
+            return 0
+        if journal.get("validator") != validator:
+            return 0
+        if size > total_length:
+            return 0
+        if journal.get("preallocated"):
+            self.preallocated = True
+            return min(size, journal.get("offset", 0))
+        return size
+
+    def recorded(self) -> Tuple[int, Optional[str]]:
+        """
+        Offset to resume from and the validator of the response it belongs
+        to, as far as the journal knows them without asking the server.
+        """
+        try:
+            with open(self.journal_path, "r") as file:
+                journal = json.load(file)
+        except (OSError, ValueError):
+            return 0, None
+        total_length = journal.get("total_length")
+        if not isinstance(total_length, int):
+            return 0, None
+        validator = journal.get("validator")
+        return self.resume_offset(total_length, validator), validator
+
+    def begin(
+        self,
+        total_length: int,
+        validator: Optional[str],
+        *,
+        preallocated: bool = False,
+        offset: int = 0,
+    ):
+        self._journal = {"total_length": total_length, "validator": validator}
+        if preallocated:
+            self._journal.update(preallocated=True, offset=offset)
+        self._write_journal()
+
+    def checkpoint(self, offset: int):
+        """Record that the first `offset` bytes of a preallocated file are written."""
+        if self._journal.get("preallocated"):
+            self._journal["offset"] = offset
+            self._write_journal()
+
+    def _write_journal(self):
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self._journal, file)
+        os.replace(tmp_path, self.journal_path)
+
+    def commit(self):
+        os.replace(self.part_path, self.path)
+        self.discard_journal()
+
+    def discard(self):
+        """Throw away the partial file so the next run starts over."""
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+        self.discard_journal()
+
+    def discard_journal(self):
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+
+def find_partial(target: str) -> Optional[PartialFile]:
+    """
+    Partial download of `target` left by an earlier run. Its extension comes
+    from the content type of that response, so any extension matches.
+    """
+    for journal_path in sorted(glob.glob(glob.escape(target) + ".*.part.json")):
+        return PartialFile(journal_path[: -len(".part.json")])
+    return None
@@ -0,0 +1,90 @@
+import re
+import threading
+import time
+from datetime import datetime
+from datetime import time as daytime
+from typing import Iterator, List, NamedTuple, Optional
+
+UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+# Largest amount of bandwidth one transfer reserves at a time
+SLICE = 64 * 1024
+
+
+def parse_rate(value: str) -> int:
+    """Parse a rate like `500K` or `5M` into bytes per second, `0` is unlimited."""
+    match = re.fullmatch(
+        r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)(?:i?B)?(?:/s)?\s*", value, re.I
+    )
+    if not match:
+        raise ValueError(f"Invalid rate '{value}', use e.g. 500K or 5M.")
+    return int(float(match.group(1)) * UNITS[match.group(2).upper()])
+
+
+class RateWindow(NamedTuple):
+    start: daytime
+    end: daytime
+    rate: int
+
+    def contains(self, moment: daytime) -> bool:
+        if self.start <= self.end:
+            return self.start <= moment < self.end
+        # Window that wraps around midnight, like 22:00-07:00
+        return moment >= self.start or moment < self.end
+
+
+def parse_window(value: str) -> RateWindow:
+    """Parse a window like `08:00-20:00=2M`."""
+    match = re.fullmatch(r"\s*(\d\d?:\d\d)-(\d\d?:\d\d)=(.+)", value)
+    if not match:
+        raise ValueError(f"Invalid window '{value}', use e.g. 08:00-20:00=2M.")
+    start, end = (datetime.strptime(t, "%H:%M").time() for t in match.group(1, 2))
+    return RateWindow(start, end, parse_rate(match.group(3)))
+
+
+class BandwidthLimiter:
+    """
+    Token bucket shared by all concurrent transfers.
+
+    Each transfer reserves the next free slice of bandwidth in the order it
+    asks for it and sleeps until that slice has passed. A transfer only holds
+    one reservation at a time, so every active file gets an equal share no
+    matter how large it is.
+    """
+
+    def __init__(self, rate: int = 0, windows: Optional[List[RateWindow]] = None):
+        self.rate = rate
+        self.windows = windows or []
+        self._next_free = 0.0
+        self._lock = threading.Lock()
+
+    def current_rate(self) -> int:
+        now = datetime.now().time()
+        for window in self.windows:
+            if window.contains(now):
+                return window.rate
+        return self.rate
+
+    def consume(self, amount: int):
+        for delay in self._reserve(amount):
+            time.sleep(delay)
+
+    async def consume_async(self, amount: int):
+        import asyncio
+
+        for delay in self._reserve(amount):
+            await asyncio.sleep(delay)
+
+    def _reserve(self, amount: int) -> Iterator[float]:
+        # Yields how long to wait for each slice, the next one is only
+        # reserved once that time has passed
+        while amount > 0:
+            rate = self.current_rate()
+            if not rate:
+                return
+            size = min(amount, SLICE)
+            with self._lock:
+                now = time.monotonic()
+                self._next_free = max(now, self._next_free) + size / rate
+                delay = self._next_free - now
+            yield delay
+            amount -= size
@@ -0,0 +1,406 @@
+import functools
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+)
+from urllib.parse import urlparse
+
+import click
+
+if TYPE_CHECKING:
+    import asyncio
+
+    from rich.console import Console
+
+    from pyheadspace.aio import AsyncBackend
+
+    from pyheadspace.journal import JournalRun
+    from pyheadspace.transcode import Transcoder
+
+DEFAULT_JOBS = 1
+DEFAULT_PER_HOST = 4
+DEFAULT_API_JOBS = 8
+
+logger = logging.getLogger("pyHeadspace")
+
+
+class DownloadTask(NamedTuple):
+    media_id: str
+    name: str
+    filename: str
+    pack_name: Optional[str]
+    out: str
+    is_technique: bool = False
+    # Signed URL, the media item is signed right before the transfer if missing
+    direct_url: Optional[str] = None
+
+
+class Scheduler:
+    """
+    Runs download tasks on a bounded thread pool.
+
+    Work happens in two stages. Metadata lookups passed to `resolve` run on
+    their own pool of `api_jobs` threads and turn activities and techniques
+    into download tasks. Those are recorded in `plan` and handed to `submit`
+    right away, so API latency overlaps with the transfers already running.
+
+    Every transfer gets its own progress bar and a combined "Total" bar sums
+    up the bytes of all of them. Transfers to the same host are additionally limited by
+    `per_host` so the CDN does not start throttling us. With `quiet` no bars
+    are drawn, which lets several schedulers run side by side.
+
+    With a `backend` the tasks run as coroutines on its event loop instead
+    and `handler` is a coroutine function. Lookups keep their pool, the
+    backend limits both stages together, in any mix.
+
+    When the run is stopped, e.g. with Ctrl+C, queued tasks are dropped and
+    `cancelled` is set. Handlers check it to stop a running transfer early.
+
+    A `journal` is told about every planned task and how it ended, and
+    that the plan is complete once the last lookup has finished. Finished
+    tasks are handed to `transcoder`, which converts them while the next
+    ones download.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[DownloadTask, "Scheduler"], Any],
+        *,
+        jobs: int = DEFAULT_JOBS,
+        per_host: int = DEFAULT_PER_HOST,
+        api_jobs: int = DEFAULT_API_JOBS,
+        console: Optional["Console"] = None,
+        backend: Optional["AsyncBackend"] = None,
+        quiet: bool = False,
+        journal: Optional["JournalRun"] = None,
+        transcoder: Optional["Transcoder"] = None,
+    ):
+        # rich.progress is slow to import, only load it once there is work
+        from rich.progress import (
+            BarColumn,
+            DownloadColumn,
+            Progress,
+            TextColumn,
+            TransferSpeedColumn,
+        )
+
+        if jobs < 1:
+            raise click.BadParameter("--jobs must be at least 1.")
+        if per_host < 1:
+            raise click.BadParameter("--per-host must be at least 1.")
+        if api_jobs < 1:
+            raise click.BadParameter("--api-jobs must be at least 1.")
+        self.handler = handler
+        self.jobs = jobs
+        self.per_host = per_host
+        self.api_jobs = api_jobs
+        self.backend = backend
+        self.journal = journal
+        self.transcoder = transcoder
+        self.plan: List[DownloadTask] = []
+        # Tasks wait here until a worker is about to free up. A queued Future
+        # takes far more memory than the task, which adds up for `--all`
+        self._backlog: Deque[DownloadTask] = deque()
+        self._window = 2 * (backend.concurrency if backend else jobs)
+        self._dispatched = 0
+        # Lookups and tasks that have not finished yet, `wait` waits for 0
+        self._outstanding = 0
+        # The plan is complete once the caller is done and no lookup is left
+        self._resolving = 0
+        self._planning = True
+        self._lookup_failed = False
+        self._plan_reported = False
+        self.cancelled = threading.Event()
+        self.progress = Progress(
+            TextColumn("{task.description}"),
+            BarColumn(),
+            DownloadColumn(),
+            TransferSpeedColumn(),
+            console=console,
+            disable=quiet,
+        )
+        self._overall = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._resolver: Optional[ThreadPoolExecutor] = None
+        self._failures: List[tuple] = []
+        self._transfers = 0
+        self._started = 0
+        self._total_bytes = 0
+        self._host_locks: Dict[str, threading.BoundedSemaphore] = {}
+        # Only used on the event loop of the backend
+        self._async_host_locks: Dict[str, "asyncio.Semaphore"] = {}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def __enter__(self):
+        if self.backend is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.jobs, thread_name_prefix="pyheadspace"
+            )
+        self._resolver = ThreadPoolExecutor(
+            max_workers=self.api_jobs, thread_name_prefix="pyheadspace-api"
+        )
+        self.progress.start()
+        self._overall = self.progress.add_task(
+            "[bold]Total[/bold]", total=0, visible=False
+        )
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        cancel = exc_type is not None
+        try:
+            if not cancel:
+                with self._lock:
+                    self._planning = False
+                self._check_planned()
+                self.wait()
+                if self.transcoder is not None:
+                    self._failures += self.transcoder.close()
+        except BaseException:
+            # Interrupted while waiting for the tasks, e.g. with Ctrl+C
+            cancel = True
+            raise
+        finally:
+            if cancel:
+                self.cancel()
+                if self.journal is not None:
+                    self.journal.abandon()
+                if self.transcoder is not None:
+                    self.transcoder.close(cancel=True)
+            _shutdown(self._resolver, cancel)
+            if self._executor is not None:
+                _shutdown(self._executor, cancel)
+            self.progress.stop()
+        if exc_type is None and self.journal is not None:
+            self.journal.finish(failed=bool(self._failures))
+        if exc_type is None and self._failures:
+            for message, error in self._failures:
+                self.progress.console.print(f"[red]{message}: {error}[/red]")
+            raise click.ClickException(f"{len(self._failures)} task(s) failed.")
+
+    def cancel(self):
+        """Drop the queued tasks and tell the running ones to stop."""
+        with self._lock:
+            self.cancelled.set()
+            self._backlog.clear()
+
+    def resolve(self, name: str, func: Callable, *args, **kwargs) -> Future:
+        with self._lock:
+            self._outstanding += 1
+            self._resolving += 1
+        message = f"Failed to resolve {name}"
+        if self.backend is not None:
+            future = self.backend.run(
+                self._resolve_async(message, func, *args, **kwargs)
+            )
+        else:
+            future = self._resolver.submit(self._call, message, func, *args, **kwargs)
+        future.add_done_callback(self._resolved)
+        return future
+
+    async def _resolve_async(self, message: str, func: Callable, *args, **kwargs):
+        async with self.backend.slot():
+            if self.cancelled.is_set():
+                return False
+            return await self.backend.loop.run_in_executor(
+                self._resolver,
+                functools.partial(self._call, message, func, *args, **kwargs),
+            )
+
+    def _resolved(self, future: Future):
+        with self._lock:
+            self._resolving -= 1
+            # `_call` returns False for a lookup that failed
+            self._lookup_failed |= (
+                future.cancelled()
+                or future.exception() is not None
+                or future.result() is False
+            )
+        self._check_planned()
+        self._finished(future)
+
+    def _check_planned(self):
+        with self._lock:
+            if self._planning or self._resolving or self._plan_reported:
+                return
+            # Only reported once, lookups started later only sign URLs
+            self._plan_reported = True
+            complete = not self._lookup_failed
+        if complete and self.journal is not None:
+            self.journal.planned()
+
+    def submit(self, task: DownloadTask):
+        if self.cancelled.is_set():
+            # A lookup that finished after the run was stopped
+            return
+        if self.journal is not None:
+            self.journal.plan(task)
+        with self._lock:
+            self.plan.append(task)
+            self._backlog.append(task)
+            self._outstanding += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if not self._backlog or self._dispatched >= self._window:
+                    return
+                task = self._backlog.popleft()
+                self._dispatched += 1
+            message = f"Failed to download {task.name}"
+            if self.backend is not None:
+                future = self.backend.run(
+                    self._call_async(message, self._run_task_async, task)
+                )
+            else:
+                future = self._executor.submit(
+                    self._call, message, self._run_task, task
+                )
+            future.add_done_callback(self._task_finished)
+
+    def _task_finished(self, future: Future):
+        with self._lock:
+            self._dispatched -= 1
+        if not self.cancelled.is_set():
+            self._dispatch()
+        self._finished(future)
+
+    def _finished(self, future: Future):
+        with self._lock:
+            self._outstanding -= 1
+            if not self._outstanding:
+                self._idle.notify_all()
+
+    def wait(self):
+        with self._lock:
+            while self._outstanding:
+                self._idle.wait()
+
+    def upcoming(self, count: int) -> List[DownloadTask]:
+        """Tasks that are queued to start next."""
+        with self._lock:
+            return self.plan[self._started : self._started + count]
+
+    def _run_task(self, task: DownloadTask):
+        self._task_started()
+        try:
+            self.handler(task, self)
+        except Exception as e:
+            self._task_failed(task, e)
+            raise
+        self._task_done(task)
+
+    async def _run_task_async(self, task: DownloadTask):
+        self._task_started()
+        try:
+            await self.handler(task, self)
+        except Exception as e:
+            self._task_failed(task, e)
+            raise
+        self._task_done(task)
+
+    def _task_started(self):
+        with self._lock:
+            self._started += 1
+
+    def _task_failed(self, task: DownloadTask, error: Exception):
+        # A task stopped with the run keeps its state, resume continues it
+        if self.journal is not None and not self.cancelled.is_set():
+            self.journal.failed(task, error)
+
+    def _task_done(self, task: DownloadTask):
+        if self.journal is not None:
+            self.journal.done(task)
+        if self.transcoder is not None:
+            self.transcoder.submit(task)
+
+    def _call(self, message: str, func: Callable, *args, **kwargs) -> bool:
+        if self.cancelled.is_set():
+            # Still queued when the run was stopped
+            return False
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            self._failed(message, e)
+            return False
+        return True
+
+    async def _call_async(self, message: str, func: Callable, *args) -> bool:
+        async with self.backend.slot():
+            if self.cancelled.is_set():
+                return False
+            try:
+                await func(*args)
+            except Exception as e:
+                self._failed(message, e)
+                return False
+            return True
+
+    def _failed(self, message: str, error: Exception):
+        logger.error(f"{message}: {error}")
+        with self._lock:
+            self._failures.append((message, error))
+
+    def start_transfer(self, description: str, total: int):
+        with self._lock:
+            self._transfers += 1
+            self._total_bytes += total
+            self.progress.update(
+                self._overall,
+                total=self._total_bytes,
+                visible=self._transfers > 1,
+            )
+        return self.progress.add_task(description, total=total)
+
+    def advance(self, transfer_id, length: int):
+        self.progress.advance(transfer_id, length)
+        self.progress.advance(self._overall, length)
+
+    def finish_transfer(self, transfer_id):
+        self.progress.remove_task(transfer_id)
+
+    @contextmanager
+    def host_slot(self, url: str):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._host_locks.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._host_locks[host] = semaphore
+        with semaphore:
+            yield
+
+    @asynccontextmanager
+    async def host_slot_async(self, url: str):
+        import asyncio
+
+        host = urlparse(url).netloc
+        semaphore = self._async_host_locks.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host)
+            self._async_host_locks[host] = semaphore
+        async with semaphore:
+            yield
+
+
+def _shutdown(executor: ThreadPoolExecutor, cancel: bool):
+    if not cancel:
+        executor.shutdown(wait=True)
+        return
+    try:
+        executor.shutdown(wait=False, cancel_futures=True)
+    except TypeError:
+        # cancel_futures needs Python 3.9, queued tasks return right away
+        executor.shutdown(wait=False)
@@ -0,0 +1,59 @@
+from typing import Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from pyheadspace.transport import (
+    DEFAULT_BACKOFF,
+    DEFAULT_POOL_SIZE,
+    DEFAULT_RETRIES,
+    DEFAULT_TIMEOUT,
+    RETRY_STATUSES,
+)
+
+
+class TransportSession(requests.Session):
+    """
+    Session shared by API calls, media downloads and the login flow.
+
+    Connections are kept alive in a pool per host, requests time out after
+    `timeout` seconds and failed responses with a status in
+    `RETRY_STATUSES` are retried with exponential backoff, honouring the
+    Retry-After header.
+    """
+
+    def __init__(
+        self,
+        *,
+        timeout: Union[float, Tuple[float, float]] = DEFAULT_TIMEOUT,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        retries: int = DEFAULT_RETRIES,
+    ):
+        super().__init__()
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.mount_adapters()
+
+    def mount_adapters(self):
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=DEFAULT_BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        for adapter in self.adapters.values():
+            adapter.close()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from pyheadspace.cache import ResponseCache
+
+# A URL is signed again when it expires in less than this many seconds
+EXPIRY_MARGIN = 120
+# How long to trust a signed URL whose expiry cannot be read from it
+DEFAULT_LIFETIME = 5 * 60
+
+logger = logging.getLogger("pyHeadspace")
+
+
+def url_expiry(url: str) -> Optional[float]:
+    """
+    Read the expiry time of a signed URL from its query parameters.
+
+    Understands CloudFront (`Expires`), S3 (`X-Amz-Date` + `X-Amz-Expires`)
+    and Google Cloud Storage (`X-Goog-Date` + `X-Goog-Expires`) signatures.
+    """
+    query = {k.lower(): v[0] for k, v in parse_qs(urlparse(url).query).items()}
+    try:
+        if "expires" in query:
+            return float(query["expires"])
+        for vendor in ("amz", "goog"):
+            if f"x-{vendor}-expires" in query:
+                signed_at = datetime.strptime(
+                    query[f"x-{vendor}-date"], "%Y%m%dT%H%M%SZ"
+                ).replace(tzinfo=timezone.utc)
+                return signed_at.timestamp() + float(query[f"x-{vendor}-expires"])
+    except (KeyError, ValueError):
+        return None
+    return None
+
+
+class SignedUrlManager:
+    """
+    Hands out signed URLs for media items.
+
+    URLs are kept in memory and in the response cache until shortly before
+    they expire. Concurrent requests for the same media item share one call
+    to `sign`, or to `sign_async` when they come from `get_async`.
+    """
+
+    def __init__(
+        self,
+        sign: Callable[[str], str],
+        cache: Optional[ResponseCache] = None,
+        margin: int = EXPIRY_MARGIN,
+        *,
+        sign_async: Optional[Callable[[str], Awaitable[str]]] = None,
+    ):
+        self.sign = sign
+        self.sign_async = sign_async
+        self.cache = cache
+        self.margin = margin
+        self._urls: Dict[str, Tuple[str, float]] = {}
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _valid(self, media_id: str) -> Optional[str]:
+        url, expires_at = self._urls.get(media_id, (None, 0))
+        if expires_at - self.margin > time.time():
+            return url
+        return None
+
+    def cached(self, media_id: str) -> bool:
+        with self._lock:
+            return self._valid(media_id) is not None or media_id in self._pending
+
+    def get(self, media_id: str) -> str:
+        url, pending, owner = self._claim(media_id)
+        if url is not None:
+            return url
+        if not owner:
+            return pending.result()
+
+        try:
+            url = self._from_cache(media_id) or self._store(
+                media_id, self.sign(media_id)
+            )
+        except BaseException as e:
+            self._settle(media_id, pending, error=e)
+            raise
+        self._settle(media_id, pending, url)
+        return url
+
+    async def get_async(self, media_id: str) -> str:
+        """`get` for the event loop, waits for other callers without blocking."""
+        import asyncio
+
+        url, pending, owner = self._claim(media_id)
+        if url is not None:
+            return url
+        if not owner:
+            return await asyncio.wrap_future(pending)
+
+        try:
+            url = self._from_cache(media_id) or self._store(
+                media_id, await self.sign_async(media_id)
+            )
+        except BaseException as e:
+            self._settle(media_id, pending, error=e)
+            raise
+        self._settle(media_id, pending, url)
+        return url
+
+    def _claim(self, media_id: str) -> Tuple[Optional[str], Future, bool]:
+        # A valid URL, or the future of the call that signs it and whether
+        # that call is ours to make
+        with self._lock:
+            url = self._valid(media_id)
+            if url is not None:
+                return url, None, False
+            pending = self._pending.get(media_id)
+            if pending is not None:
+                return None, pending, False
+            pending = self._pending[media_id] = Future()
+            return None, pending, True
+
+    def _settle(
+        self,
+        media_id: str,
+        pending: Future,
+        url: Optional[str] = None,
+        error: Optional[BaseException] = None,
+    ):
+        if error is not None:
+            pending.set_exception(error)
+        else:
+            pending.set_result(url)
+        with self._lock:
+            del self._pending[media_id]
+
+    def prefetch(self, media_id: str):
+        try:
+            self.get(media_id)
+        except Exception as e:
+            # The transfer signs again and reports the error itself
+            logger.warning(f"Unable to sign {media_id} ahead of time: {e}")
+
+    def invalidate(self, media_id: str):
+        with self._lock:
+            self._urls.pop(media_id, None)
+        if self.cache is not None:
+            self.cache.set(self._cache_key(media_id), "", ttl=-1)
+
+    def _from_cache(self, media_id: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        entry = self.cache.get(self._cache_key(media_id))
+        if entry and entry.body and entry.expires_at - self.margin > time.time():
+            self._remember(media_id, entry.body, entry.expires_at)
+            return entry.body
+        return None
+
+    def _store(self, media_id: str, url: str) -> str:
+        expires_at = url_expiry(url)
+        if expires_at is None:
+            self._remember(media_id, url, time.time() + DEFAULT_LIFETIME)
+        else:
+            self._remember(media_id, url, expires_at)
+            if self.cache is not None:
+                self.cache.set(
+                    self._cache_key(media_id), url, ttl=int(expires_at - time.time())
+                )
+        return url
+
+    def _remember(self, media_id: str, url: str, expires_at: float):
+        with self._lock:
+            self._urls[media_id] = (url, expires_at)
+
+    def _cache_key(self, media_id: str) -> str:
+        return f"signed-url:{media_id}"
@@ -0,0 +1,88 @@
+import os
+import time
+from typing import Callable, Iterator
+
+MIN_BUFFER = 64 * 1024
+MAX_BUFFER = 4 * 1024 * 1024
+# Reads are sized to take about this long, so slow links still show progress
+TARGET_READ_TIME = 0.25
+# Seconds between two redraws of a progress bar
+PROGRESS_INTERVAL = 0.1
+# Seconds between two updates of the resume offset of a preallocated file
+CHECKPOINT_INTERVAL = 1.0
+
+
+class AdaptiveBuffer:
+    """
+    Reusable read buffer for one transfer.
+
+    The memory for the largest read is allocated once. Each read uses a
+    window of it that doubles while the link fills it quickly and halves
+    when a read takes much longer than `TARGET_READ_TIME`.
+    """
+
+    def __init__(self, minimum: int = MIN_BUFFER, maximum: int = MAX_BUFFER):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = minimum
+        self._buffer = memoryview(bytearray(maximum))
+
+    def view(self) -> memoryview:
+        return self._buffer[: self.size]
+
+    def adapt(self, filled: int, elapsed: float):
+        if filled == self.size and elapsed < TARGET_READ_TIME / 2:
+            self.size = min(self.size * 2, self.maximum)
+        elif elapsed > TARGET_READ_TIME * 2:
+            self.size = max(self.size // 2, self.minimum)
+
+
+def iter_into(raw, buffer: AdaptiveBuffer) -> Iterator[memoryview]:
+    """
+    Read a raw response into `buffer` until it is exhausted.
+
+    The yielded views share the buffer's memory and are only valid until
+    the next one is requested.
+    """
+    while True:
+        view = buffer.view()
+        started = time.monotonic()
+        filled = raw.readinto(view)
+        if not filled:
+            return
+        buffer.adapt(filled, time.monotonic() - started)
+        yield view[:filled]
+
+
+class Throttle:
+    """Adds up amounts and passes them to `callback` at most every `interval` seconds."""
+
+    def __init__(self, callback: Callable[[int], None], interval: float):
+        self.callback = callback
+        self.interval = interval
+        self._pending = 0
+        self._last = time.monotonic()
+
+    def add(self, amount: int):
+        self._pending += amount
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, 0
+            self.callback(pending)
+
+
+def preallocate(file, size: int):
+    """Reserve `size` bytes for `file` so the filesystem can lay it out in one piece."""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(file.fileno(), 0, size)
+            return
+        except OSError:
+            # Not supported by this filesystem
+            pass
+    file.truncate(size)
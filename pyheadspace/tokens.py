@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+# Refresh the bearer token this many seconds before it expires
+REFRESH_MARGIN = 5 * 60
+
+logger = logging.getLogger("pyHeadspace")
+
+
+def decode_claims(token: str) -> dict:
+    """Claims of a bearer token, without verifying its signature."""
+    if not token:
+        return {}
+    import jwt
+
+    try:
+        return jwt.decode(token.split(" ")[-1], options={"verify_signature": False})
+    except Exception:
+        return {}
+
+
+class TokenManager:
+    """
+    Keeps the bearer token valid for runs that take hours.
+
+    The token is read from `path` on first use. When its `exp` claim is
+    less than `margin` seconds away, or headspace rejects it with a 401,
+    `login` is asked for a new one, which is written back to `path`.
+
+    Workers that need a new token at the same time share one refresh: the
+    first one logs in, the others wait for it and use its token. A token
+    that `headspace login` wrote to `path` in the meantime is picked up
+    without logging in.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        login: Callable[[], Optional[str]],
+        *,
+        margin: float = REFRESH_MARGIN,
+    ):
+        self.path = path
+        self.login = login
+        self.margin = margin
+        self._token: Optional[str] = None
+        self._claims: dict = {}
+        self._proactive = True
+        self._lock = threading.Lock()
+
+    def _read(self) -> str:
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as file:
+                file.write("")
+        with open(self.path, "r") as file:
+            return file.read().strip()
+
+    def _set(self, token: str):
+        self._token = token
+        self._claims = decode_claims(token)
+
+    def _expiring(self) -> bool:
+        expires_at = self._claims.get("exp")
+        return expires_at is not None and expires_at - self.margin < time.time()
+
+    def token(self) -> str:
+        with self._lock:
+            if self._token is None:
+                self._set(self._read())
+            if self._expiring() and self._proactive:
+                logger.info("Bearer token expires soon, refreshing it")
+                if not self._refresh():
+                    # Keep using it until it is rejected rather than asking again
+                    self._proactive = False
+            return self._token
+
+    def claims(self) -> dict:
+        self.token()
+        return self._claims
+
+    def refresh(self, rejected: str) -> Optional[str]:
+        """
+        New token after `rejected` got a 401, or None if there is no way to
+        log in again.
+        """
+        with self._lock:
+            if self._token != rejected:
+                # Another worker already refreshed it
+                return self._token
+            return self._token if self._refresh(rejected) else None
+
+    def _refresh(self, rejected: Optional[str] = None) -> bool:
+        stored = self._read()
+        if stored != self._token and stored != rejected:
+            self._set(stored)
+            if not self._expiring():
+                return True
+        token = self.login()
+        if not token:
+            return False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(token)
+        os.replace(tmp_path, self.path)
+        self._set(token)
+        self._proactive = True
+        return True
@@ -0,0 +1,162 @@
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from typing import Callable, List, NamedTuple, Optional, Tuple
+
+from pyheadspace.manifest import Manifest, ManifestEntry, file_sha256
+from pyheadspace.scheduler import DownloadTask
+
+logger = logging.getLogger("pyHeadspace")
+
+
+class Format(NamedTuple):
+    content_type: str
+    # Sources whose audio can be copied into this format without re-encoding
+    copy_from: Tuple[str, ...]
+    encode: Tuple[str, ...]
+    muxer: str
+
+
+FORMATS = {
+    "m4a": Format(
+        "audio/mp4",
+        ("video/mp4", "audio/mp4", "audio/x-m4a", "audio/aac"),
+        ("-c:a", "aac", "-b:a", "128k"),
+        "ipod",
+    ),
+    "opus": Format("audio/ogg", (), ("-c:a", "libopus", "-b:a", "64k"), "opus"),
+}
+# Container of the audio that `--audio-only` takes out of technique videos
+AUDIO_ONLY_FORMAT = "m4a"
+
+
+def find_ffmpeg() -> Optional[str]:
+    return shutil.which(os.getenv("HEADSPACE_FFMPEG", "ffmpeg"))
+
+
+def target_format(
+    entry: ManifestEntry, format_: Optional[str], audio_only: bool
+) -> Optional[str]:
+    """Format that the download of `entry` is converted to, None to keep it."""
+    if format_ is None:
+        if not (audio_only and entry.content_type.startswith("video/")):
+            return None
+        format_ = AUDIO_ONLY_FORMAT
+    if entry.path.endswith(f".{format_}"):
+        return None
+    return format_
+
+
+class Transcoder:
+    """
+    Converts finished downloads with ffmpeg while later files still
+    download.
+
+    Files are queued with `submit` and picked up by `workers` threads that
+    each drive one ffmpeg process at a time, so up to `workers` files are
+    converted in parallel next to the transfers. A converted file replaces
+    the download in its directory and in the manifest. Its blob is kept, so
+    other packs and later runs can still link the original.
+    """
+
+    def __init__(
+        self,
+        locate: Callable[[DownloadTask], Tuple[Manifest, str]],
+        *,
+        format_: Optional[str] = None,
+        audio_only: bool = False,
+        workers: int = os.cpu_count() or 1,
+        ffmpeg: str = "ffmpeg",
+    ):
+        self.locate = locate
+        self.format = format_
+        self.audio_only = audio_only
+        self.ffmpeg = ffmpeg
+        self._queue: "queue.Queue[Optional[DownloadTask]]" = queue.Queue()
+        self._failures: List[tuple] = []
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, name="pyheadspace-ffmpeg", daemon=True)
+            for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, task: DownloadTask):
+        self._queue.put(task)
+
+    def close(self, cancel: bool = False) -> List[tuple]:
+        """
+        Wait for the queued files, or with `cancel` only for the ones being
+        converted, and return the failures as (message, error) pairs.
+        """
+        if cancel:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        return self._failures
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            try:
+                self.convert(task)
+            except Exception as e:
+                logger.error(f"Failed to convert {task.name}: {e}")
+                with self._lock:
+                    self._failures.append((f"Failed to convert {task.name}", e))
+
+    def convert(self, task: DownloadTask) -> Optional[ManifestEntry]:
+        manifest, target = self.locate(task)
+        entry = manifest.completed(target, task.media_id)
+        if entry is None:
+            return None
+        format_ = target_format(entry, self.format, self.audio_only)
+        if format_ is None:
+            return None
+        spec = FORMATS[format_]
+        source = os.path.join(manifest.directory, entry.path)
+        path = f"{entry.target}.{format_}"
+        destination = os.path.join(manifest.directory, path)
+        temporary = destination + ".part"
+
+        attempts = [spec.encode]
+        if entry.content_type in spec.copy_from:
+            # Remuxing is much faster, fall back to encoding if it fails
+            attempts.insert(0, ("-c:a", "copy"))
+        for codec in attempts:
+            command = [self.ffmpeg, "-nostdin", "-v", "error", "-y", "-i", source]
+            command += ["-vn", *codec, "-f", spec.muxer, temporary]
+            process = subprocess.run(command, capture_output=True, text=True)
+            if process.returncode == 0:
+                break
+        else:
+            try:
+                os.remove(temporary)
+            except FileNotFoundError:
+                pass
+            raise RuntimeError(
+                process.stderr.strip() or f"ffmpeg exited with {process.returncode}"
+            )
+        os.replace(temporary, destination)
+        converted = entry._replace(
+            path=path,
+            size=os.path.getsize(destination),
+            content_type=spec.content_type,
+            sha256=file_sha256(destination),
+        )
+        manifest.add(converted)
+        os.remove(source)
+        logger.info(f"Converted {source} to {destination}")
+        return converted
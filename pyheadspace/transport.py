@@ -0,0 +1,62 @@
+import threading
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    from pyheadspace.session import TransportSession
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+# Seconds to wait for a connection and between two bytes of a response
+DEFAULT_TIMEOUT = 30
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Importing requests is slow, the session is only created on first use
+_session: Optional["TransportSession"] = None
+_settings: Dict[str, Any] = {
+    "pool_size": DEFAULT_POOL_SIZE,
+    "retries": DEFAULT_RETRIES,
+    "timeout": DEFAULT_TIMEOUT,
+}
+_lock = threading.Lock()
+
+
+def get_session() -> "TransportSession":
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                from pyheadspace.session import TransportSession
+
+                _session = TransportSession(**_settings)
+    return _session
+
+
+def __getattr__(name: str):
+    # Keeps `transport.session` working without creating it at import
+    if name == "session":
+        return get_session()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def configure(
+    *,
+    pool_size: Optional[int] = None,
+    retries: Optional[int] = None,
+    timeout: Optional[float] = None,
+):
+    with _lock:
+        previous = dict(_settings)
+        if pool_size is not None:
+            _settings["pool_size"] = max(pool_size, DEFAULT_POOL_SIZE)
+        if retries is not None:
+            _settings["retries"] = retries
+        if timeout is not None:
+            _settings["timeout"] = timeout
+        if _session is not None:
+            for key, value in _settings.items():
+                setattr(_session, key, value)
+            # Remounting drops the pooled connections, keep them when the
+            # adapters would not change, e.g. between jobs of `headspace serve`
+            if any(_settings[key] != previous[key] for key in ("pool_size", "retries")):
+                _session.mount_adapters()
@@ -0,0 +1,116 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pyheadspace.aio import AsyncBackend, retry_after
+from pyheadspace.scheduler import DownloadTask, Scheduler
+
+httpx = pytest.importorskip("httpx")
+
+
+@pytest.fixture
+def backend():
+    backend = AsyncBackend(concurrency=3)
+    backend.start()
+    yield backend
+    backend.stop()
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Answers the first `server.failures` requests with 503."""
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.requests <= self.server.failures:
+            self.send_response(503)
+            self.send_header("retry-after", "0")
+            self.send_header("content-length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("content-length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def flaky_server():
+    server = HTTPServer(("127.0.0.1", 0), FlakyHandler)
+    server.failures = 2
+    server.requests = 0
+    server.url = f"http://127.0.0.1:{server.server_port}/"
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_retries_unavailable_responses(backend, flaky_server):
+    response = backend.call(backend.get(flaky_server.url))
+
+    assert response.status_code == 200
+    assert response.content == b"ok"
+    assert flaky_server.requests == 3
+
+
+def test_get_gives_up_after_its_retries(backend, flaky_server):
+    backend.retries = 1
+
+    response = backend.call(backend.get(flaky_server.url))
+
+    assert response.status_code == 503
+    assert flaky_server.requests == 2
+
+
+def test_call_refuses_to_block_the_event_loop(backend):
+    async def nested():
+        backend.call(backend.get("http://127.0.0.1:1/"))
+
+    with pytest.raises(RuntimeError):
+        backend.call(nested())
+
+
+def test_retry_after():
+    assert retry_after("3") == 3
+    assert retry_after(None) is None
+    assert retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+
+
+def test_backend_limits_lookups_and_downloads_together(backend):
+    import asyncio
+
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def enter():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+
+    def leave():
+        with lock:
+            running[0] -= 1
+
+    async def handler(task, scheduler):
+        enter()
+        await asyncio.sleep(0.02)
+        leave()
+
+    def resolve(name, scheduler):
+        enter()
+        time.sleep(0.02)
+        leave()
+        scheduler.submit(DownloadTask(name, name, name, None, ""))
+
+    with Scheduler(handler, api_jobs=8, backend=backend, quiet=True) as scheduler:
+        for i in range(12):
+            scheduler.resolve(str(i), resolve, str(i), scheduler)
+
+    assert peak[0] == 3
+    assert len(scheduler.plan) == 12
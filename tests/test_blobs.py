@@ -0,0 +1,33 @@
+import os
+
+from pyheadspace.blobs import BlobStore, link_file
+from pyheadspace.manifest import ManifestEntry
+
+
+def test_blob_is_linked_into_every_target(tmp_path):
+    (tmp_path / "Pack A").mkdir()
+    (tmp_path / "Pack B").mkdir()
+    first = tmp_path / "Pack A" / "Session 1.mpeg"
+    first.write_bytes(b"1234")
+    store = BlobStore(str(tmp_path))
+    assert store.get("42") is None
+
+    entry = ManifestEntry(
+        "Pack A/Session 1", "42", "Pack A/Session 1.mpeg", 4, "audio/mpeg", "00"
+    )
+    added = store.add(str(first), entry)
+    blob, blob_entry = store.get("42")
+    assert added == (blob, blob_entry)
+    assert blob_entry.target == "42" and blob_entry.sha256 == "00"
+    assert os.path.samefile(blob, first)
+
+    second = tmp_path / "Pack B" / "Session 1.mpeg"
+    link_file(blob, str(second))
+    assert os.path.samefile(second, first)
+    # Linking onto the same file again leaves it alone
+    link_file(blob, str(second))
+    assert second.read_bytes() == b"1234"
+
+    # A blob that no longer matches its recorded size is not reused
+    first.write_bytes(b"12")
+    assert BlobStore(str(tmp_path)).get("42") is None
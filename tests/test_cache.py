@@ -0,0 +1,40 @@
+import time
+
+from pyheadspace.cache import ResponseCache, cache_key
+
+
+def test_cache_key_depends_on_params_and_language():
+    url = "https://api.prod.headspace.com/content/activities/1"
+    assert cache_key(url, {"a": 1, "b": 2}, "en-US") == cache_key(
+        url, {"b": 2, "a": 1}, "en-US"
+    )
+    assert cache_key(url, {}, "en-US") != cache_key(url, {}, "fr-FR")
+    assert cache_key(url, {"authorId": 2}, "en-US") != cache_key(url, {}, "en-US")
+
+
+def test_response_cache_ttl_and_revalidation(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    assert cache.get("key") is None
+
+    cache.set("key", '{"a": 1}', ttl=-1, etag='"v1"')
+    entry = cache.get("key")
+    assert entry.body == '{"a": 1}'
+    assert entry.etag == '"v1"'
+    assert not entry.fresh
+
+    cache.refresh("key", ttl=60)
+    assert cache.get("key").fresh
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), max_size=10)
+    cache.set("old", "12345", ttl=60)
+    time.sleep(0.01)
+    cache.set("new", "12345", ttl=60)
+    time.sleep(0.01)
+    cache.get("old")
+    cache.set("newest", "12345", ttl=60)
+
+    assert cache.get("old") is not None
+    assert cache.get("new") is None
+    assert cache.get("newest") is not None
@@ -0,0 +1,51 @@
+from pyheadspace.index import CatalogueIndex, response_digest
+from pyheadspace.models import parse_entity, parse_pack
+
+PACK_RESPONSE = {
+    "data": {"attributes": {"name": "Basics", "description": "Learn to meditate"}},
+    "included": [
+        {
+            "type": "orderedActivities",
+            "relationships": {"activity": {"data": {"id": 10}}},
+        },
+        {"type": "activityGroups", "relationships": {}},
+        {
+            "type": "orderedTechniques",
+            "relationships": {"technique": {"data": {"id": 20}}},
+        },
+    ],
+}
+
+ACTIVITY_RESPONSE = {
+    "data": {"attributes": {"name": "Session 1 of Level 1"}},
+    "included": [
+        {"type": "mediaItems", "id": 1, "attributes": {"durationInMs": 180000}},
+        {"type": "mediaItems", "id": 2, "attributes": {"durationInMs": 600000}},
+        {"type": "authors", "id": 3, "attributes": {}},
+    ],
+}
+
+
+def test_parse_pack_keeps_included_positions():
+    pack = parse_pack("5", PACK_RESPONSE)
+    assert pack.id == 5
+    assert [item.entity_id for item in pack.items] == ["10", None, "20"]
+
+
+def test_index_round_trip(tmp_path):
+    index = CatalogueIndex(str(tmp_path / "index.sqlite3"))
+    pack = parse_pack(5, PACK_RESPONSE)
+    activity = parse_entity("activity", 10, ACTIVITY_RESPONSE)
+
+    index.put_pack(pack, response_digest(PACK_RESPONSE))
+    index.put_entity(activity, response_digest(ACTIVITY_RESPONSE))
+
+    assert index.pack_ids() == [5]
+    assert index.get_pack(5) == pack
+    assert index.pack_digest(5) == response_digest(PACK_RESPONSE)
+    assert activity.authors == (3,)
+    assert index.get_entity("activity", "10") == activity
+    assert index.get_entity("activity", "10", author_id=4) is None
+
+    index.remove_packs([5])
+    assert index.get_pack(5) is None
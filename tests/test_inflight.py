@@ -0,0 +1,27 @@
+import threading
+
+import pytest
+
+from pyheadspace.inflight import InFlight
+
+
+def test_concurrent_claims_share_one_transfer():
+    transfers = InFlight()
+    owner, future = transfers.claim("media")
+    assert owner
+    waiting, shared = transfers.claim("media")
+    assert not waiting and shared is future
+
+    threading.Timer(0.05, transfers.done, ("media", "/out/file.mp3")).start()
+    assert shared.result(timeout=5) == "/out/file.mp3"
+    # Finished transfers are forgotten, the next claim starts a new one
+    assert transfers.claim("media")[0]
+
+
+def test_failed_transfer_is_raised_to_waiters():
+    transfers = InFlight()
+    transfers.claim("media")
+    _, shared = transfers.claim("media")
+    transfers.done("media", error=ValueError("lost"))
+    with pytest.raises(ValueError):
+        shared.result()
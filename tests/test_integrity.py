@@ -0,0 +1,49 @@
+import base64
+import hashlib
+import os
+
+from pyheadspace.integrity import (
+    CORRUPT,
+    MISSING,
+    OK,
+    expected_md5,
+    mmap_sha256,
+    verify,
+)
+from pyheadspace.manifest import Manifest, ManifestEntry, file_sha256
+
+MD5 = hashlib.md5(b"body").hexdigest()
+
+
+def test_expected_md5_from_cdn_headers():
+    b64 = base64.b64encode(bytes.fromhex(MD5)).decode()
+    assert expected_md5({"content-md5": b64}) == MD5
+    assert expected_md5({"x-goog-hash": f"crc32c=AAAAAA==,md5={b64}"}) == MD5
+    assert expected_md5({"etag": f'"{MD5.upper()}"'}) == MD5
+    # The body is kept encoded, so its hash still applies
+    assert expected_md5({"content-md5": b64, "content-encoding": "gzip"}) == MD5
+    # Multipart uploads and weak validators do not count
+    assert expected_md5({"etag": f'"{MD5}-3"'}) is None
+    assert expected_md5({"etag": f'W/"{MD5}"'}) is None
+    assert expected_md5({"content-md5": "not base64!"}) is None
+
+
+def test_verify_finds_corrupt_and_missing_files(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    for name, body in (("good", b"1234"), ("bad", b"abcd"), ("gone", b"xyz")):
+        path = tmp_path / f"{name}.mpeg"
+        path.write_bytes(body)
+        manifest.add(
+            ManifestEntry(
+                name, name, path.name, len(body), "audio/mpeg", file_sha256(str(path))
+            )
+        )
+    os.link(tmp_path / "good.mpeg", tmp_path / "link.mpeg")
+    good = manifest.get("good")
+    manifest.add(good._replace(target="link", path="link.mpeg"))
+    (tmp_path / "bad.mpeg").write_bytes(b"abce")
+    os.remove(tmp_path / "gone.mpeg")
+
+    results = {result.entry.target: result.status for result in verify([manifest], 2)}
+    assert results == {"good": OK, "link": OK, "bad": CORRUPT, "gone": MISSING}
+    assert mmap_sha256(str(tmp_path / "good.mpeg")) == good.sha256
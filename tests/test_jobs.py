@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from pyheadspace.daemon import JobServer, create_token, read_token
+from pyheadspace.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue
+
+
+def test_job_queue_survives_restart(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(path)
+    first, created = queue.submit(["pack", "--id", "1"])
+    assert created
+    # The same command line is not queued twice while it is pending
+    assert queue.submit(["pack", "--id", "1"]) == (first, False)
+    queue.submit(["pack", "--id", "2"])
+    assert queue.next(timeout=0).id == first.id
+    queue.close()
+
+    # Stopped while the first job was running
+    queue = JobQueue(path)
+    assert queue.recover() == 1
+    assert [job.state for job in queue.list()] == [QUEUED, QUEUED]
+    job = queue.next(timeout=0)
+    assert job.id == first.id and job.state == RUNNING
+    queue.finish(job)
+    failed = queue.finish(queue.next(timeout=0), "boom")
+    assert queue.get(first.id).state == DONE
+    assert queue.get(failed.id).error == "boom"
+    assert queue.next(timeout=0) is None
+
+
+def test_job_server_runs_submitted_jobs(tmp_path):
+    ran = []
+
+    def run_job(args):
+        if args[0] == "fail":
+            raise RuntimeError("failed on purpose")
+        ran.append(args)
+
+    server = JobServer(
+        JobQueue(str(tmp_path / "jobs.sqlite3")),
+        run_job,
+        validate=lambda args: None if args[0] != "bad" else "bad job",
+        port=0,
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.start_workers()
+
+    def post(args):
+        request = Request(
+            f"{server.url}/jobs", data=json.dumps({"args": args}).encode()
+        )
+        try:
+            with urlopen(request) as response:
+                return response.status, json.load(response)
+        except Exception as e:
+            return e.code, json.load(e)
+
+    try:
+        assert post(["bad"]) == (400, {"error": "bad job"})
+        status, ok = post(["pack", "--id", "1"])
+        assert status == 201
+        _, failing = post(["fail"])
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            with urlopen(f"{server.url}/jobs") as response:
+                states = {job["id"]: job for job in json.load(response)}
+            if all(job["state"] in (DONE, FAILED) for job in states.values()):
+                break
+            time.sleep(0.05)
+        assert states[ok["id"]]["state"] == DONE
+        assert states[failing["id"]]["state"] == FAILED
+        assert states[failing["id"]]["error"] == "failed on purpose"
+        assert ran == [["pack", "--id", "1"]]
+    finally:
+        server.shutdown()
+        server.stop()
+
+
+def test_job_server_needs_its_token(tmp_path):
+    path = str(tmp_path / "job_token.txt")
+    token = create_token(path)
+    assert create_token(path) == read_token(path) == token
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+    server = JobServer(
+        JobQueue(str(tmp_path / "jobs.sqlite3")), lambda args: None, port=0, token=token
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def status(authorization=None):
+        request = Request(f"{server.url}/jobs", data=b'{"args": ["pack"]}')
+        if authorization:
+            request.add_header("authorization", authorization)
+        try:
+            with urlopen(request) as response:
+                return response.status
+        except HTTPError as e:
+            e.close()
+            return e.code
+
+    try:
+        assert status() == 401
+        assert status("Bearer wrong") == 401
+        assert status(f"Bearer {token}") == 201
+        with pytest.raises(HTTPError):
+            urlopen(f"{server.url}/jobs")
+    finally:
+        server.shutdown()
+        server.stop()
+
+
+def test_job_server_without_token_only_listens_on_loopback(tmp_path):
+    with pytest.raises(ValueError):
+        JobServer(
+            JobQueue(str(tmp_path / "jobs.sqlite3")),
+            lambda args: None,
+            host="0.0.0.0",
+            port=0,
+        )
+
+
+def test_job_args_make_paths_absolute(tmp_path, monkeypatch):
+    from pyheadspace.__main__ import job_args
+
+    monkeypatch.chdir(tmp_path)
+    assert job_args(["pack", "--all", "--exclude", "links.txt"]) == [
+        "pack",
+        "--all",
+        "--exclude",
+        str(tmp_path / "links.txt"),
+        "--out",
+        str(tmp_path),
+    ]
+    assert job_args(["everyday", "--out=music"]) == [
+        "everyday",
+        f"--out={tmp_path / 'music'}",
+    ]
+    assert job_args(["batch", "-j", "4", "links.txt", "--audio-only"]) == [
+        "batch",
+        "-j",
+        "4",
+        str(tmp_path / "links.txt"),
+        "--audio-only",
+        "--out",
+        str(tmp_path),
+    ]
+    # URLs are arguments too, but not paths
+    assert job_args(["pack", "--id", "5", "https://my.headspace.com/x/1"])[:4] == [
+        "pack",
+        "--id",
+        "5",
+        "https://my.headspace.com/x/1",
+    ]
+
+
+def test_jobs_cannot_read_standard_input(tmp_path):
+    from pyheadspace.__main__ import cli, validate_job
+
+    links = tmp_path / "links.txt"
+    links.write_text("151\n")
+    root = cli.make_context("headspace", ["serve"])
+    assert validate_job(root, ["batch", str(links)]) is None
+    assert validate_job(root, ["batch"]) == (
+        "A job cannot read standard input, pass a file."
+    )
@@ -0,0 +1,162 @@
+import click
+import pytest
+
+from pyheadspace.journal import DONE, DOWNLOADING, FAILED, PLANNED, RUNNING, Journal
+from pyheadspace.manifest import ManifestEntry, open_manifest
+from pyheadspace.scheduler import DownloadTask, Scheduler
+
+
+def task(name: str) -> DownloadTask:
+    return DownloadTask(name, name, name, "Pack", "out")
+
+
+def test_journal_keeps_item_states_across_a_resume(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    out = tmp_path / "out"
+    path = str(tmp_path / "journal.sqlite3")
+    run = Journal(path).start("pack", {"all_": True, "out": "/music"})
+    for name in ("a", "b", "c"):
+        run.plan(task(name))
+    run.downloading(task("a"), str(out / "Pack" / "a.mpeg"), 1024)
+    run.done(task("b"))
+    run.failed(task("c"), click.ClickException("HTTP error: status-code = 500"))
+
+    # A new process reads what the crashed one wrote
+    journal = Journal(path)
+    stopped = journal.last_unfinished()
+    assert stopped.params == {"all_": True, "out": "/music"}
+    assert (stopped.state, stopped.planned) == (RUNNING, False)
+    failed = journal.items(stopped.id, [FAILED])
+    assert [item.error for item in failed] == ["HTTP error: status-code = 500"]
+    first = journal.items(stopped.id)[0]
+    assert (first.path, first.downloaded) == (str(out / "Pack" / "a.mpeg"), 1024)
+
+    resumed = journal.resume(stopped)
+    # Planning the same items again does not reset them
+    for name in ("a", "b", "c"):
+        resumed.plan(task(name))
+    assert journal.counts(stopped.id) == {DOWNLOADING: 1, DONE: 1, FAILED: 1}
+    # Paths are kept absolute, resume may run in another directory
+    done = journal.items(stopped.id, [DONE])
+    assert [item.task() for item in done] == [task("b")._replace(out=str(out))]
+
+    resumed.planned()
+    resumed.finish(failed=False)
+    assert journal.get(stopped.id).planned
+    assert journal.last_unfinished() is None
+
+
+def test_journal_forgets_old_runs(tmp_path):
+    journal = Journal(str(tmp_path / "journal.sqlite3"))
+    journal.start("everyday", {}).plan(task("a"))
+    unfinished = journal.start("everyday", {})
+    unfinished.plan(task("a"))
+    for _ in range(2):
+        run = journal.start("pack", {})
+        run.plan(task("a"))
+        run.finish(failed=False)
+    journal.prune(keep=3)
+    assert len(journal.runs()) == 3
+    assert journal.last_unfinished().id == unfinished.id
+
+
+def test_journal_forgets_runs_that_planned_nothing(tmp_path):
+    journal = Journal(str(tmp_path / "journal.sqlite3"))
+    planned = journal.start("pack", {})
+    planned.plan(task("a"))
+    with pytest.raises(click.BadParameter):
+        with Scheduler(lambda *_: None, journal=journal.start("pack", {}), quiet=True):
+            raise click.BadParameter("Please provide ID, URL or --include.")
+    # Stopped after planning, there is something left to resume
+    planned.abandon()
+    assert [run.id for run in journal.runs()] == [planned.id]
+
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def plan(self, task):
+        self.calls.append((PLANNED, task.name))
+
+    def done(self, task):
+        self.calls.append((DONE, task.name))
+
+    def failed(self, task, error):
+        self.calls.append((FAILED, task.name))
+
+    def planned(self):
+        self.calls.append(("planned",))
+
+    def finish(self, failed):
+        self.calls.append(("finish", failed))
+
+
+def test_scheduler_reports_the_plan_once_lookups_finish():
+    def handler(task, scheduler):
+        if task.name == "bad":
+            raise click.ClickException("gone")
+
+    def lookup(scheduler, name):
+        scheduler.submit(task(name))
+
+    journal = Recorder()
+    with pytest.raises(click.ClickException):
+        with Scheduler(handler, jobs=1, journal=journal, quiet=True) as scheduler:
+            scheduler.resolve("a", lookup, scheduler, "a")
+            scheduler.resolve("bad", lookup, scheduler, "bad")
+
+    calls = journal.calls
+    # Each task is written down before it runs
+    assert calls.index((PLANNED, "a")) < calls.index((DONE, "a"))
+    assert calls.index((PLANNED, "bad")) < calls.index((FAILED, "bad"))
+    assert ("planned",) in calls
+    assert calls[-1] == ("finish", True)
+
+
+def test_scheduler_plan_is_incomplete_when_a_lookup_fails():
+    def lookup():
+        raise click.ClickException("HTTP error: status-code = 503")
+
+    journal = Recorder()
+    with pytest.raises(click.ClickException):
+        with Scheduler(lambda *_: None, journal=journal, quiet=True) as scheduler:
+            scheduler.resolve("pack 1", lookup)
+    assert journal.calls == [("finish", True)]
+
+
+def test_report_finds_skipped_files_in_the_manifest(tmp_path):
+    from pyheadspace.__main__ import item_location
+
+    journal = Journal(str(tmp_path / "journal.sqlite3"))
+    run = journal.start("pack", {})
+    skipped = DownloadTask("m", "s", "Session 2 of Level 1", "Pack", str(tmp_path))
+    failed = skipped._replace(media_id="n", filename="Technique 1", is_technique=True)
+    run.plan(skipped)
+    run.plan(failed)
+    target = "Pack/Level 1/Session 2 of Level 1"
+    open_manifest(str(tmp_path)).add(
+        ManifestEntry(target, "m", f"{target}.mpeg", 0, "audio/mpeg", "")
+    )
+    items = journal.items(run.id)
+    assert [item_location(item) for item in items] == [
+        str(tmp_path / f"{target}.mpeg"),
+        str(tmp_path / "Pack" / "Techniques" / "Technique 1"),
+    ]
+    # Nothing is created for files that were never downloaded
+    assert not (tmp_path / "Pack" / "Techniques").exists()
+
+
+def test_resume_does_not_read_standard_input_again(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+
+    from pyheadspace import __main__
+
+    journal = Journal(str(tmp_path / "journal.sqlite3"))
+    run = journal.start("batch", {"file": "-", "out": str(tmp_path)})
+    run.plan(task("a"))
+    monkeypatch.setattr(__main__, "journal", journal)
+    result = CliRunner().invoke(__main__.cli, ["resume"], input="151\n")
+    assert result.exit_code == 1
+    assert "Pipe the same links into `headspace batch` again" in result.output
+    assert journal.get(run.id).state == RUNNING
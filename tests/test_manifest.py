@@ -0,0 +1,46 @@
+from pyheadspace.manifest import Manifest, ManifestEntry, file_sha256, open_manifest
+
+
+def test_manifest_requires_matching_file(tmp_path):
+    (tmp_path / "Basics").mkdir()
+    (tmp_path / "Basics" / "Session 1.mpeg").write_bytes(b"1234")
+    manifest = Manifest(str(tmp_path))
+    entry = ManifestEntry(
+        "Basics/Session 1",
+        "42",
+        "Basics/Session 1.mpeg",
+        4,
+        "audio/mpeg",
+        file_sha256(str(tmp_path / "Basics" / "Session 1.mpeg")),
+    )
+    manifest.add(entry)
+
+    reloaded = Manifest(str(tmp_path))
+    assert reloaded.completed("Basics/Session 1", "42") == entry
+    assert reloaded.completed("Basics/Session 1", "43") is None
+
+    (tmp_path / "Basics" / "Session 1.mpeg").write_bytes(b"12")
+    assert reloaded.completed("Basics/Session 1", "42") is None
+
+
+def test_manifest_ignores_truncated_lines(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.add(ManifestEntry("a", "1", "a.mpeg", 1, "audio/mpeg", "00"))
+    with open(manifest.path, "a") as file:
+        file.write('{"target": "b", "media')
+
+    assert Manifest(str(tmp_path)).get("a").media_id == "1"
+    assert Manifest(str(tmp_path)).get("b") is None
+
+
+def test_open_manifest_is_shared_per_directory(tmp_path):
+    assert open_manifest(str(tmp_path)) is open_manifest(str(tmp_path / "."))
+
+
+def test_manifest_remove_forgets_entries(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    manifest.add(ManifestEntry("a", "1", "a.mpeg", 1, "audio/mpeg", "00"))
+    manifest.add(ManifestEntry("b", "2", "b.mpeg", 1, "audio/mpeg", "00"))
+    manifest.remove(["a"])
+
+    assert [entry.target for entry in Manifest(str(tmp_path)).entries()] == ["b"]
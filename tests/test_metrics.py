@@ -0,0 +1,49 @@
+import json
+
+from pyheadspace.metrics import Metrics
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+    metrics.inc("http_requests_total", endpoint="pack")
+    with metrics.timer("api_request_seconds", endpoint="pack"):
+        pass
+    assert metrics.counters == {}
+    assert metrics.histograms == {}
+
+
+def test_histogram_summary_and_exports():
+    metrics = Metrics()
+    metrics.enabled = True
+    for latency in (0.02, 0.04, 0.3):
+        metrics.observe("api_request_seconds", latency, endpoint="pack")
+    metrics.inc("http_retries_total", 2, endpoint="pack")
+    metrics.observe("download_seconds", 2.0)
+    metrics.inc("bytes_written_total", 4 * 1024 * 1024)
+
+    rows = {row[0]: row for row in metrics.summary()}
+    assert rows["api_request_seconds"][1:] == (
+        "endpoint=pack",
+        "3",
+        "120.0",
+        "300",
+        "300",
+    )
+    assert rows["http_retries_total"][2] == "2"
+    assert rows["download_throughput"][3] == "2.00 MB/s"
+
+    lines = [json.loads(line) for line in metrics.json_lines().splitlines()]
+    assert {
+        "metric": "http_retries_total",
+        "labels": {"endpoint": "pack"},
+        "value": 2,
+    } in lines
+
+    prometheus = metrics.prometheus()
+    assert "# TYPE pyheadspace_api_request_seconds histogram" in prometheus
+    assert (
+        'pyheadspace_api_request_seconds_bucket{endpoint="pack",le="0.05"} 2'
+        in prometheus
+    )
+    assert 'pyheadspace_api_request_seconds_count{endpoint="pack"} 3' in prometheus
+    assert 'pyheadspace_http_retries_total{endpoint="pack"} 2' in prometheus
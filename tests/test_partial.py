@@ -0,0 +1,51 @@
+from pyheadspace.partial import PartialFile, find_partial
+
+
+def test_partial_file_resumes_only_matching_download(tmp_path):
+    partial = PartialFile(str(tmp_path / "Session 1.mpeg"))
+    assert partial.resume_offset(10, '"v1"') == 0
+
+    partial.begin(10, '"v1"')
+    with open(partial.part_path, "wb") as file:
+        file.write(b"1234")
+
+    assert partial.resume_offset(10, '"v1"') == 4
+    assert partial.resume_offset(10, '"v2"') == 0
+    assert partial.resume_offset(12, '"v1"') == 0
+
+
+def test_partial_file_commit_renames_atomically(tmp_path):
+    partial = PartialFile(str(tmp_path / "Session 1.mpeg"))
+    partial.begin(4, None)
+    with open(partial.part_path, "wb") as file:
+        file.write(b"1234")
+
+    partial.commit()
+
+    assert (tmp_path / "Session 1.mpeg").read_bytes() == b"1234"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["Session 1.mpeg"]
+
+
+def test_preallocated_partial_file_resumes_from_checkpoint(tmp_path):
+    partial = PartialFile(str(tmp_path / "Session 1.mpeg"))
+    partial.begin(10, '"v1"', preallocated=True)
+    with open(partial.part_path, "wb") as file:
+        file.write(b"123456\0\0\0\0")
+    partial.checkpoint(6)
+
+    resumed = PartialFile(str(tmp_path / "Session 1.mpeg"))
+    assert resumed.resume_offset(10, '"v1"') == 6
+    assert resumed.preallocated
+
+
+def test_partial_download_is_found_before_the_content_type_is_known(tmp_path):
+    assert find_partial(str(tmp_path / "Session 1")) is None
+    partial = PartialFile(str(tmp_path / "Session 1.mpeg"))
+    partial.begin(10, '"v1"')
+    with open(partial.part_path, "wb") as file:
+        file.write(b"1234")
+
+    found = find_partial(str(tmp_path / "Session 1"))
+    assert found.path == partial.path
+    assert found.recorded() == (4, '"v1"')
+    assert find_partial(str(tmp_path / "Session 2")) is None
@@ -3,7 +3,42 @@ Right now this only contains basic tests. Because the library depends heavily on
 headspace, it makes it difficult to write automated tests.
 """
 
-from pyheadspace.__main__ import round_off
+import base64
+import gzip
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import click
+import pytest
+
+from pyheadspace import __main__
+from pyheadspace.__main__ import (
+    ALL,
+    BatchEntry,
+    SharedPacks,
+    get_legacy_ids,
+    parse_batch_line,
+    queue_everyday,
+    queue_pack_session,
+    round_off,
+)
+from pyheadspace.aio import AsyncBackend
+from pyheadspace.cache import ResponseCache, cache_key
+from pyheadspace.index import CatalogueIndex
+from pyheadspace.inflight import InFlight
+from pyheadspace.manifest import MANIFEST_NAME, ManifestEntry, open_manifest
+from pyheadspace.models import Entity, MediaItem
+from pyheadspace.partial import PartialFile
+from pyheadspace.scheduler import DownloadTask, Scheduler
+from pyheadspace.stream import AdaptiveBuffer, iter_into
+from pyheadspace.tokens import TokenManager
 
 
 def test_round_off_duration():
@@ -24,3 +59,632 @@ def test_round_off_duration():
     assert round_off(7 * 60_000) == 5
     assert round_off(10.2 * 60_000) == 10
     assert round_off(16 * 60_000) == 15
+
+
+def test_scheduler_runs_tasks_and_collects_failures():
+    done = []
+
+    def handler(task, scheduler):
+        with scheduler.host_slot(task.direct_url):
+            if task.name == "bad":
+                raise click.UsageError("HTTP error: status-code = 500")
+            done.append(task.name)
+
+    with pytest.raises(click.ClickException, match="1 task"):
+        with Scheduler(handler, jobs=3, per_host=1) as scheduler:
+            for name in ("a", "b", "bad", "c"):
+                scheduler.submit(
+                    DownloadTask(
+                        name,
+                        name,
+                        name,
+                        None,
+                        "",
+                        direct_url=f"https://cdn.example/{name}",
+                    )
+                )
+    assert sorted(done) == ["a", "b", "c"]
+
+
+def test_scheduler_keeps_only_a_window_of_tasks_in_flight():
+    release = threading.Event()
+    done = []
+
+    def handler(task, scheduler):
+        release.wait()
+        done.append(task.name)
+
+    with Scheduler(handler, jobs=2, quiet=True) as scheduler:
+        for i in range(100):
+            scheduler.submit(DownloadTask(str(i), str(i), str(i), None, ""))
+        assert scheduler._dispatched == 4
+        assert len(scheduler._backlog) == 96
+        release.set()
+    assert len(done) == 100
+    assert len(scheduler.plan) == 100
+
+
+def test_interrupted_scheduler_stops_without_waiting_for_tasks(monkeypatch):
+    started = threading.Event()
+    stopped = []
+
+    def handler(task, scheduler):
+        started.set()
+        # A transfer checks this between two chunks
+        scheduler.cancelled.wait(5)
+        stopped.append(task.name)
+
+    def interrupted():
+        started.wait(5)
+        raise KeyboardInterrupt
+
+    scheduler = Scheduler(handler, jobs=2, quiet=True)
+    monkeypatch.setattr(scheduler, "wait", interrupted)
+    began = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        with scheduler:
+            for i in range(10):
+                scheduler.submit(DownloadTask(str(i), str(i), str(i), None, ""))
+
+    assert time.monotonic() - began < 2
+    assert scheduler.cancelled.is_set()
+    assert not scheduler._backlog
+    # Only the tasks that were already running got to start
+    assert len(stopped) <= 2
+
+
+class RecordingScheduler:
+    """Stands in for Scheduler, runs lookups right away and keeps the tasks."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def resolve(self, name, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+    def submit(self, task):
+        self.tasks.append(task)
+
+
+@pytest.fixture
+def recorder():
+    return RecordingScheduler()
+
+
+def test_queue_everyday_skips_repeated_and_downloaded_sessions(tmp_path, recorder):
+    def session(day, media_id):
+        return Entity(
+            "everyday",
+            day,
+            f"Everyday {media_id}",
+            (MediaItem(media_id, 600_000, None),),
+        )
+
+    (tmp_path / "Everyday old").write_bytes(b"1")
+    open_manifest(str(tmp_path)).add(
+        ManifestEntry("Everyday old", "old", "Everyday old", 1, "audio/mpeg", "00")
+    )
+    stats = Counter()
+    options = dict(
+        duration=[10],
+        out=str(tmp_path),
+        scheduler=recorder,
+        stats=stats,
+        seen=set(),
+        lock=threading.Lock(),
+    )
+    for day, media_id in (
+        ("2021-01-01", "a"),
+        ("2021-01-02", "a"),
+        ("2021-01-03", "old"),
+    ):
+        queue_everyday(session(day, media_id), **options)
+
+    assert [task.media_id for task in recorder.tasks] == ["a"]
+    assert stats == {"duplicate": 1, "downloaded": 1}
+
+
+def test_queue_pack_session_looks_up_every_author(monkeypatch, recorder):
+    def get_entity(kind, entity_id, author=None):
+        # Author 9 does not narrate it, headspace falls back to the default
+        media_id = f"{author}" if author in (1, 2) else "default"
+        return Entity(
+            kind,
+            entity_id,
+            "Session 1",
+            (
+                MediaItem(media_id + "-10", 600_000, None),
+                MediaItem(media_id + "-20", 1_200_000, None),
+            ),
+            author or 0,
+            (1, 2),
+        )
+
+    monkeypatch.setattr(__main__, "get_entity", get_entity)
+    queue_pack_session("10", ALL, "Pack", out="", authors=ALL, scheduler=recorder)
+    assert sorted(task.filename for task in recorder.tasks) == [
+        "Session 1(10 minutes) (author 1)",
+        "Session 1(10 minutes) (author 2)",
+        "Session 1(20 minutes) (author 1)",
+        "Session 1(20 minutes) (author 2)",
+    ]
+
+    recorder.tasks.clear()
+    queue_pack_session("10", [10], "Pack", out="", authors=[0, 9], scheduler=recorder)
+    assert [task.media_id for task in recorder.tasks] == ["default-10"]
+
+
+def test_legacy_ids_are_requested_once(monkeypatch, tmp_path):
+    requested = []
+
+    threads = set()
+
+    def fetch_legacy_id(new_id):
+        requested.append(new_id)
+        threads.add(threading.current_thread().name)
+        return new_id + 1000
+
+    monkeypatch.setattr(__main__, "fetch_legacy_id", fetch_legacy_id)
+    monkeypatch.setattr(__main__, "legacy_ids", {})
+    monkeypatch.setattr(
+        __main__, "catalogue_index", CatalogueIndex(str(tmp_path / "index.sqlite3"))
+    )
+    # Looked up on the scheduler's pool, within its limit
+    with Scheduler(lambda task, scheduler: None, api_jobs=2, quiet=True) as scheduler:
+        resolved = get_legacy_ids(["150", 151, 150], scheduler)
+    assert resolved == {150: 1150, 151: 1151}
+    assert sorted(requested) == [150, 151]
+    assert threads and all(name.startswith("pyheadspace-api") for name in threads)
+
+    # A later run finds them in the index
+    monkeypatch.setattr(__main__, "legacy_ids", {})
+    assert get_legacy_ids([151, 152]) == {151: 1151, 152: 1152}
+    assert sorted(requested) == [150, 151, 152]
+
+
+def test_parse_batch_line():
+    player = "https://my.headspace.com/player/204?authorId=1&startIndex=3"
+    assert parse_batch_line(player) == BatchEntry("player", 204, 3)
+    assert parse_batch_line("my.headspace.com/player/204") == ("player", 204, 0)
+    assert parse_batch_line(
+        "https://my.headspace.com/modes/focus/content/151\n"
+    ) == BatchEntry("pack", 151)
+    assert parse_batch_line(" 151 ") == BatchEntry("pack", 151)
+    assert parse_batch_line("# packs for the weekend") is None
+    assert parse_batch_line("\n") is None
+    with pytest.raises(click.UsageError):
+        parse_batch_line("https://my.headspace.com/player/204?startIndex=x")
+
+
+def test_shared_packs_fetches_each_pack_once(monkeypatch):
+    fetched = Counter()
+    release = threading.Event()
+
+    def get_pack(pack_id):
+        fetched[pack_id] += 1
+        release.wait(5)
+        return pack_id
+
+    monkeypatch.setattr(__main__, "get_pack", get_pack)
+    packs = SharedPacks()
+    threads = [threading.Thread(target=packs.get, args=(1,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert packs.get(1) == 1
+    assert packs.get(2) == 2
+    assert fetched == {1: 1, 2: 1}
+
+
+def test_sign_ahead_does_not_create_directories_of_upcoming_tasks(tmp_path):
+    not_a_directory = tmp_path / "file"
+    not_a_directory.write_text("")
+    upcoming = [
+        DownloadTask("broken", "Broken", "Broken", None, str(not_a_directory)),
+        DownloadTask("session", "Session", "Session", "Pack", str(tmp_path)),
+    ]
+    signed = []
+
+    class UpcomingScheduler:
+        jobs = 2
+
+        def upcoming(self, count):
+            return upcoming[:count]
+
+        def resolve(self, name, func, media_id):
+            signed.append(media_id)
+
+    __main__.sign_ahead(UpcomingScheduler())
+
+    # A task that cannot be checked is left to report the error itself
+    assert signed == ["session"]
+    assert not (tmp_path / "Pack").exists()
+
+
+def test_waiting_tasks_are_given_the_blob_of_a_download(monkeypatch, tmp_path):
+    def fake_download(direct_url, name, *, target, manifest, **kwargs):
+        filepath = os.path.join(manifest.directory, target + ".mpeg")
+        with open(filepath, "wb") as file:
+            file.write(b"1234")
+        entry = ManifestEntry(target, "42", target + ".mpeg", 4, "audio/mpeg", "00")
+        manifest.add(entry)
+        return filepath, entry
+
+    shared = []
+
+    class RecordingInFlight(InFlight):
+        def done(self, media_id, path=None, error=None):
+            shared.append(path)
+            super().done(media_id, path, error)
+
+    monkeypatch.setattr(__main__, "_download", fake_download)
+    monkeypatch.setattr(__main__, "media_transfers", RecordingInFlight())
+    task = DownloadTask("42", "Session", "Session", "A", str(tmp_path), False, "url")
+    with Scheduler(lambda task, scheduler: None, quiet=True) as scheduler:
+        __main__.download_task(task, scheduler)
+
+    # The transcoder replaces the file in the pack, the blob stays put
+    os.remove(tmp_path / "A" / "Session.mpeg")
+    manifest = open_manifest(str(tmp_path))
+    (tmp_path / "B").mkdir()
+    __main__._link_download(*shared[0], target="B/Session", manifest=manifest)
+    assert (tmp_path / "B" / "Session.mpeg").read_bytes() == b"1234"
+
+
+def test_startup_does_not_import_heavy_modules():
+    code = "import sys, pyheadspace.__main__; print(*sys.modules)"
+    modules = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.split()
+    for name in ("jwt", "requests", "rich", "asyncio", "httpx"):
+        assert name not in modules
+
+
+def test_bearer_file_is_created_in_a_fresh_data_dir(tmp_path):
+    env = dict(os.environ, XDG_DATA_HOME=str(tmp_path))
+    bearer = tmp_path / "pyheadspace" / "bearer_id.txt"
+    subprocess.run([sys.executable, "-m", "pyheadspace", "file"], env=env, check=True)
+    assert bearer.read_text() == ""
+
+    bearer.unlink()
+    bearer.parent.rmdir()
+    code = "from pyheadspace.__main__ import write_bearer; write_bearer('bearer abc')"
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+    assert bearer.read_text() == "bearer abc"
+
+
+class EncodedMediaHandler(BaseHTTPRequestHandler):
+    body = gzip.compress(b"session" * 100)
+    accept_encodings = []
+
+    def do_GET(self):
+        self.accept_encodings.append(self.headers.get("accept-encoding"))
+        self.send_response(200)
+        self.send_header("content-type", "audio/mpeg")
+        self.send_header("content-encoding", "gzip")
+        self.send_header("content-length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_media_is_read_as_it_is_sent():
+    server = HTTPServer(("127.0.0.1", 0), EncodedMediaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/media"
+        media, _ = __main__._request_media(url, None)
+        body = b"".join(
+            bytes(chunk) for chunk in iter_into(media.raw, AdaptiveBuffer())
+        )
+        media.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    # Content-Length and Range offsets count the bytes that were sent
+    assert body == EncodedMediaHandler.body
+    assert EncodedMediaHandler.accept_encodings == ["identity"]
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Serves `server.body` and records the headers of every request."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(
+            {name: self.headers.get(name) for name in ("range", "if-range")}
+        )
+        body = server.body
+        status = 200
+        start = 0
+        range_ = self.headers.get("range")
+        if_range = self.headers.get("if-range")
+        if server.ranges and range_ and if_range in (None, server.etag):
+            start = int(range_.split("=")[1].rstrip("-"))
+            status = 206
+        self.send_response(status)
+        self.send_header("content-type", server.content_type)
+        self.send_header("content-length", str(len(body) - start))
+        self.send_header("etag", server.etag)
+        if server.content_md5 and status == 200:
+            self.send_header("content-md5", server.content_md5)
+        if status == 206:
+            self.send_header(
+                "content-range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        self.end_headers()
+        sent = body[start:]
+        if server.cut_at is not None:
+            # Drop the connection once, as if it was lost
+            sent, server.cut_at = sent[: server.cut_at], None
+        self.wfile.write(sent)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def media_server():
+    server = HTTPServer(("127.0.0.1", 0), MediaHandler)
+    server.body = bytes(range(256)) * 64
+    server.etag = '"v1"'
+    server.content_type = "audio/mpeg"
+    server.ranges = True
+    server.cut_at = None
+    server.content_md5 = None
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}/media"
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def async_backend(monkeypatch):
+    pytest.importorskip("httpx")
+    backend = AsyncBackend(concurrency=4)
+    backend.start()
+    monkeypatch.setattr(__main__, "async_backend", backend)
+    yield backend
+    backend.stop()
+
+
+def download_media(server, directory, target="Session", cancel=False, backend=None):
+    manifest = open_manifest(str(directory))
+    with Scheduler(lambda task, scheduler: None, quiet=True) as scheduler:
+        if cancel:
+            scheduler.cancelled.set()
+        options = dict(
+            media_id="media", target=target, manifest=manifest, scheduler=scheduler
+        )
+        if backend is None:
+            __main__._download(server.url, target, **options)
+        else:
+            backend.call(__main__._download_async(server.url, target, **options))
+    return manifest
+
+
+def leave_partial(directory, name, body, validator):
+    partial = PartialFile(str(directory / name))
+    partial.begin(len(body), validator)
+    with open(partial.part_path, "wb") as file:
+        file.write(body[:1000])
+
+
+def test_download_resumes_with_range_and_if_range(media_server, tmp_path):
+    leave_partial(tmp_path, "Session.mpeg", media_server.body, media_server.etag)
+
+    manifest = download_media(media_server, tmp_path)
+
+    assert (tmp_path / "Session.mpeg").read_bytes() == media_server.body
+    assert media_server.requests == [{"range": "bytes=1000-", "if-range": '"v1"'}]
+    assert manifest.get("Session").size == len(media_server.body)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        MANIFEST_NAME,
+        "Session.mpeg",
+    ]
+
+
+def test_download_starts_over_when_range_is_ignored(media_server, tmp_path):
+    media_server.ranges = False
+    leave_partial(tmp_path, "Session.mpeg", media_server.body, media_server.etag)
+
+    download_media(media_server, tmp_path)
+
+    assert (tmp_path / "Session.mpeg").read_bytes() == media_server.body
+    assert media_server.requests == [{"range": "bytes=1000-", "if-range": '"v1"'}]
+
+
+def test_download_starts_over_when_the_file_changed(media_server, tmp_path):
+    leave_partial(tmp_path, "Session.mpeg", b"x" * len(media_server.body), '"v0"')
+
+    download_media(media_server, tmp_path)
+
+    # The stale If-Range gets the whole new file in the same response
+    assert (tmp_path / "Session.mpeg").read_bytes() == media_server.body
+    assert media_server.requests == [{"range": "bytes=1000-", "if-range": '"v0"'}]
+
+
+def test_download_drops_partial_of_another_content_type(media_server, tmp_path):
+    leave_partial(tmp_path, "Session.mpeg", media_server.body, media_server.etag)
+    media_server.content_type = "audio/mp4"
+
+    download_media(media_server, tmp_path)
+
+    assert (tmp_path / "Session.mp4").read_bytes() == media_server.body
+    assert media_server.requests == [
+        {"range": "bytes=1000-", "if-range": '"v1"'},
+        {"range": None, "if-range": None},
+    ]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        MANIFEST_NAME,
+        "Session.mp4",
+    ]
+
+
+def test_download_reconnects_after_a_short_read(media_server, tmp_path):
+    media_server.cut_at = 5000
+
+    download_media(media_server, tmp_path)
+
+    assert (tmp_path / "Session.mpeg").read_bytes() == media_server.body
+    assert media_server.requests == [
+        {"range": None, "if-range": None},
+        {"range": "bytes=5000-", "if-range": '"v1"'},
+    ]
+
+
+def test_async_download_resumes_and_reconnects(async_backend, media_server, tmp_path):
+    leave_partial(tmp_path, "Session.mpeg", media_server.body, media_server.etag)
+    media_server.cut_at = 5000
+
+    manifest = download_media(media_server, tmp_path, backend=async_backend)
+
+    assert (tmp_path / "Session.mpeg").read_bytes() == media_server.body
+    assert media_server.requests == [
+        {"range": "bytes=1000-", "if-range": '"v1"'},
+        {"range": "bytes=6000-", "if-range": '"v1"'},
+    ]
+    expected = hashlib.sha256(media_server.body).hexdigest()
+    assert manifest.get("Session").sha256 == expected
+
+
+def test_cancelled_download_keeps_its_partial_file(media_server, tmp_path):
+    media_server.body = bytes(range(256)) * 4096
+
+    # Stops after the first chunk
+    with pytest.raises(click.ClickException, match="will be resumed"):
+        download_media(media_server, tmp_path, cancel=True)
+    kept = os.path.getsize(tmp_path / "Session.mpeg.part")
+    assert 0 < kept < len(media_server.body)
+
+    download_media(media_server, tmp_path)
+    assert (tmp_path / "Session.mpeg").read_bytes() == media_server.body
+    assert media_server.requests[-1] == {"range": f"bytes={kept}-", "if-range": '"v1"'}
+
+
+def test_download_with_wrong_md5_leaves_nothing_behind(media_server, tmp_path):
+    wrong = hashlib.md5(b"another body").digest()
+    media_server.content_md5 = base64.b64encode(wrong).decode()
+
+    with pytest.raises(click.ClickException, match="arrived corrupted"):
+        download_media(media_server, tmp_path)
+
+    assert list(tmp_path.iterdir()) == []
+    assert open_manifest(str(tmp_path)).get("Session") is None
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """Answers with `server.body` and rejects the tokens in `server.rejected`."""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(
+            {
+                name: self.headers.get(name)
+                for name in ("authorization", "if-none-match")
+            }
+        )
+        if self.headers.get("authorization") in server.rejected:
+            self.reply(401, {"errors": [{"detail": "Unauthorized"}]})
+        elif self.headers.get("if-none-match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.reply(200, server.body)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.send_header("etag", self.server.etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server():
+    server = HTTPServer(("127.0.0.1", 0), ApiHandler)
+    server.body = {"data": {"id": "1"}}
+    server.etag = '"v1"'
+    server.rejected = set()
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_port}/content/activities/1"
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def use_tokens(monkeypatch, tmp_path, login):
+    path = tmp_path / "bearer_id.txt"
+    path.write_text("bearer old")
+    monkeypatch.setattr(__main__, "tokens", TokenManager(str(path), login))
+
+
+def test_rejected_token_is_refreshed_and_the_request_sent_again(
+    api_server, monkeypatch, tmp_path
+):
+    logins = []
+    use_tokens(monkeypatch, tmp_path, lambda: logins.append(1) or "bearer new")
+    api_server.rejected = {"bearer old"}
+
+    assert __main__.request_url(api_server.url) == api_server.body
+    assert len(logins) == 1
+    assert [r["authorization"] for r in api_server.requests] == [
+        "bearer old",
+        "bearer new",
+    ]
+
+
+def test_second_401_is_not_refreshed_again(api_server, monkeypatch, tmp_path):
+    logins = []
+    use_tokens(monkeypatch, tmp_path, lambda: logins.append(1) or "bearer new")
+    api_server.rejected = {"bearer old", "bearer new"}
+
+    with pytest.raises(click.UsageError, match="status-code = 401"):
+        __main__.request_url(api_server.url)
+    assert len(logins) == 1
+    assert len(api_server.requests) == 2
+
+
+def test_async_request_refreshes_a_rejected_token(
+    async_backend, api_server, monkeypatch, tmp_path
+):
+    logins = []
+    use_tokens(monkeypatch, tmp_path, lambda: logins.append(1) or "bearer new")
+    api_server.rejected = {"bearer old"}
+
+    # Sent from the event loop of the backend
+    assert __main__.request_url(api_server.url) == api_server.body
+    assert len(logins) == 1
+    assert [r["authorization"] for r in api_server.requests] == [
+        "bearer old",
+        "bearer new",
+    ]
+
+
+def test_stale_response_is_revalidated_with_its_etag(api_server, monkeypatch, tmp_path):
+    use_tokens(monkeypatch, tmp_path, lambda: None)
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(__main__, "response_cache", cache)
+    key = cache_key(api_server.url, {}, __main__.DESIRED_LANGUAGE)
+
+    assert __main__.request_url(api_server.url, ttl=60) == api_server.body
+    cache.refresh(key, ttl=-1)
+    body, api_server.body = api_server.body, {"data": {"id": "changed"}}
+
+    # The 304 serves the cached body and renews it
+    assert __main__.request_url(api_server.url, ttl=60) == body
+    assert cache.get(key).fresh
+    assert __main__.request_url(api_server.url, ttl=60) == body
+    assert [r["if-none-match"] for r in api_server.requests] == [None, '"v1"']
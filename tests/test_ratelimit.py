@@ -0,0 +1,77 @@
+import threading
+import time
+from datetime import time as daytime
+
+import pytest
+
+from pyheadspace.ratelimit import (
+    BandwidthLimiter,
+    RateWindow,
+    parse_rate,
+    parse_window,
+)
+
+
+def test_parse_rate():
+    assert parse_rate("0") == 0
+    assert parse_rate("500") == 500
+    assert parse_rate("500K") == 500 * 1024
+    assert parse_rate("1.5m") == int(1.5 * 1024 * 1024)
+    assert parse_rate("5MB/s") == 5 * 1024 * 1024
+    with pytest.raises(ValueError):
+        parse_rate("fast")
+
+
+def test_windows_wrap_around_midnight():
+    window = parse_window("22:00-07:00=1M")
+    assert window == RateWindow(daytime(22), daytime(7), 1024 * 1024)
+    assert window.contains(daytime(23, 30))
+    assert window.contains(daytime(6, 59))
+    assert not window.contains(daytime(12))
+    with pytest.raises(ValueError):
+        parse_window("22:00=1M")
+
+
+def test_limiter_caps_total_rate_and_shares_it_fairly():
+    limiter = BandwidthLimiter(rate=400 * 1024)
+    done = {}
+    start = time.monotonic()
+
+    def transfer(name, size):
+        for _ in range(size // (16 * 1024)):
+            limiter.consume(16 * 1024)
+        done[name] = time.monotonic() - start
+
+    threads = [
+        threading.Thread(target=transfer, args=("large", 10 * 64 * 1024)),
+        threading.Thread(target=transfer, args=("small", 64 * 1024)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 704K at 400K/s, the small file must not wait for the large one
+    assert done["large"] >= 1.5
+    assert done["small"] < 0.6
+
+
+def test_unlimited_limiter_does_not_wait():
+    limiter = BandwidthLimiter()
+    start = time.monotonic()
+    limiter.consume(100 * 1024 * 1024)
+    assert time.monotonic() - start < 0.1
+
+
+def test_async_transfers_share_the_limit_with_blocking_ones():
+    import asyncio
+
+    limiter = BandwidthLimiter(rate=400 * 1024)
+    start = time.monotonic()
+    thread = threading.Thread(target=limiter.consume, args=(200 * 1024,))
+    thread.start()
+    asyncio.run(limiter.consume_async(200 * 1024))
+    thread.join()
+
+    # 400K at 400K/s in total
+    assert time.monotonic() - start >= 0.8
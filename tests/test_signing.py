@@ -0,0 +1,100 @@
+import threading
+import time
+
+from pyheadspace.cache import ResponseCache
+from pyheadspace.signing import SignedUrlManager, url_expiry
+
+
+def test_url_expiry_from_query_parameters():
+    assert url_expiry("https://cdn.example/a.mp3?Expires=1700000000&Signature=x") == (
+        1700000000
+    )
+    assert (
+        url_expiry(
+            "https://s3.example/a.mp3?X-Amz-Date=20231114T221320Z&X-Amz-Expires=60"
+        )
+        == 1700000000 + 60
+    )
+    assert url_expiry("https://cdn.example/a.mp3") is None
+    assert url_expiry("https://cdn.example/a.mp3?Expires=soon") is None
+
+
+def test_signed_urls_are_cached_until_shortly_before_expiry(tmp_path):
+    calls = []
+
+    def sign(media_id):
+        calls.append(media_id)
+        return f"https://cdn.example/{media_id}?Expires={int(time.time()) + 3600}"
+
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"))
+    manager = SignedUrlManager(sign, cache)
+    url = manager.get("1")
+    assert manager.get("1") == url
+    # A new process finds it in the persistent cache
+    assert SignedUrlManager(sign, cache).get("1") == url
+    assert calls == ["1"]
+
+    manager.invalidate("1")
+    manager.get("1")
+    assert calls == ["1", "1"]
+
+    # Expires within the margin, so it is signed again
+    SignedUrlManager(sign, cache, margin=7200).get("1")
+    assert calls == ["1", "1", "1"]
+
+
+def test_concurrent_requests_share_one_signing_call():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def sign(media_id):
+        calls.append(media_id)
+        started.set()
+        release.wait()
+        return "https://cdn.example/1"
+
+    manager = SignedUrlManager(sign)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(manager.get("1")))
+        for _ in range(4)
+    ]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["1"]
+    assert results == ["https://cdn.example/1"] * 4
+
+
+def test_async_and_blocking_requests_share_one_signing_call():
+    import asyncio
+
+    started = threading.Event()
+    calls = []
+
+    async def sign_async(media_id):
+        calls.append(media_id)
+        started.set()
+        await asyncio.sleep(0.1)
+        return "https://cdn.example/1"
+
+    manager = SignedUrlManager(calls.append, sign_async=sign_async)
+    results = []
+
+    def blocking():
+        started.wait()
+        results.append(manager.get("1"))
+
+    thread = threading.Thread(target=blocking)
+    thread.start()
+    assert asyncio.run(manager.get_async("1")) == "https://cdn.example/1"
+    thread.join()
+
+    assert calls == ["1"]
+    assert results == ["https://cdn.example/1"]
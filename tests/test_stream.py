@@ -0,0 +1,38 @@
+import io
+
+from pyheadspace.stream import AdaptiveBuffer, Throttle, iter_into, preallocate
+
+
+def test_iter_into_grows_buffer_on_fast_reads():
+    data = bytes(range(256)) * 4096
+    buffer = AdaptiveBuffer(minimum=1024, maximum=64 * 1024)
+
+    chunks = [bytes(chunk) for chunk in iter_into(io.BytesIO(data), buffer)]
+
+    assert b"".join(chunks) == data
+    assert len(chunks[0]) == 1024
+    assert buffer.size == 64 * 1024
+
+
+def test_adaptive_buffer_shrinks_on_slow_reads():
+    buffer = AdaptiveBuffer(minimum=1024, maximum=8192)
+    buffer.size = 8192
+    buffer.adapt(8192, 5.0)
+    assert buffer.size == 4096
+
+
+def test_throttle_batches_updates():
+    updates = []
+    throttle = Throttle(updates.append, interval=60)
+    for _ in range(100):
+        throttle.add(10)
+    assert updates == []
+    throttle.flush()
+    assert updates == [1000]
+
+
+def test_preallocate_reserves_file_size(tmp_path):
+    with open(tmp_path / "media.mp4", "wb") as file:
+        preallocate(file, 4096)
+        file.write(b"data")
+    assert (tmp_path / "media.mp4").stat().st_size == 4096
@@ -0,0 +1,78 @@
+import threading
+import time
+
+import jwt
+
+from pyheadspace.tokens import TokenManager
+
+KEY = "k" * 32
+
+
+def bearer(expires_in: float, user: str = "user") -> str:
+    claims = {"exp": int(time.time() + expires_in), "sub": user}
+    return "bearer " + jwt.encode(claims, KEY, algorithm="HS256")
+
+
+def test_token_is_refreshed_before_it_expires(tmp_path):
+    path = tmp_path / "bearer_id.txt"
+    path.write_text(bearer(60))
+    fresh = bearer(3600)
+    manager = TokenManager(str(path), lambda: fresh)
+
+    assert manager.token() == fresh
+    assert path.read_text() == fresh
+    assert manager.claims()["sub"] == "user"
+
+
+def test_concurrent_workers_share_one_refresh(tmp_path):
+    path = tmp_path / "bearer_id.txt"
+    rejected = bearer(3600)
+    path.write_text(rejected)
+    logins = []
+
+    def login():
+        time.sleep(0.05)
+        logins.append(bearer(7200, user=f"login {len(logins)}"))
+        return logins[-1]
+
+    manager = TokenManager(str(path), login)
+    assert manager.token() == rejected
+    results = []
+    workers = [
+        threading.Thread(target=lambda: results.append(manager.refresh(rejected)))
+        for _ in range(8)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert len(logins) == 1
+    assert results == logins * 8
+
+
+def test_token_from_headspace_login_is_picked_up(tmp_path):
+    path = tmp_path / "bearer_id.txt"
+    rejected = bearer(3600)
+    path.write_text(rejected)
+    manager = TokenManager(str(path), lambda: None)
+    assert manager.token() == rejected
+
+    # No way to log in again
+    assert manager.refresh(rejected) is None
+    # Until `headspace login` writes a new token
+    stored = bearer(3600, user="other")
+    path.write_text(stored)
+    assert manager.refresh(rejected) == stored
+
+
+def test_failed_proactive_refresh_keeps_the_old_token(tmp_path):
+    path = tmp_path / "bearer_id.txt"
+    expiring = bearer(60)
+    path.write_text(expiring)
+    calls = []
+    manager = TokenManager(str(path), lambda: calls.append(1))
+
+    assert manager.token() == expiring
+    assert manager.token() == expiring
+    assert len(calls) == 1
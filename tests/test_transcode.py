@@ -0,0 +1,133 @@
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from pyheadspace.manifest import ManifestEntry, file_sha256, open_manifest
+from pyheadspace.scheduler import DownloadTask
+from pyheadspace.transcode import Transcoder
+
+# Stands in for ffmpeg: writes the codec arguments and the input to the output,
+# fails to copy streams out of files named "*encoded*" and fails on "*broken*"
+FAKE_FFMPEG = """\
+import sys
+
+args = sys.argv[1:]
+source = args[args.index("-i") + 1]
+codec = args[args.index("-c:a") + 1]
+if "broken" in source or ("encoded" in source and codec == "copy"):
+    sys.exit("Invalid data found when processing input")
+with open(source, "rb") as file, open(args[-1], "wb") as out:
+    out.write(codec.encode() + b":" + file.read())
+"""
+
+
+@pytest.fixture
+def ffmpeg(tmp_path):
+    path = tmp_path / "ffmpeg"
+    path.write_text(f"#!{sys.executable}\n{FAKE_FFMPEG}")
+    path.chmod(0o755)
+    return str(path)
+
+
+def download(directory, name: str, content_type: str, body: bytes) -> DownloadTask:
+    extension = content_type.split("/")[-1]
+    (directory / f"{name}.{extension}").write_bytes(body)
+    open_manifest(str(directory)).add(
+        ManifestEntry(
+            name,
+            name,
+            f"{name}.{extension}",
+            len(body),
+            content_type,
+            file_sha256(str(directory / f"{name}.{extension}")),
+        )
+    )
+    return DownloadTask(name, name, name, None, str(directory))
+
+
+def locate(task: DownloadTask):
+    return open_manifest(task.out), task.filename
+
+
+def test_audio_only_takes_the_audio_out_of_videos(tmp_path, ffmpeg):
+    video = download(tmp_path, "technique", "video/mp4", b"video")
+    session = download(tmp_path, "session", "audio/mpeg", b"audio")
+    transcoder = Transcoder(locate, audio_only=True, workers=2, ffmpeg=ffmpeg)
+    transcoder.submit(video)
+    transcoder.submit(session)
+    assert transcoder.close() == []
+
+    assert sorted(os.listdir(tmp_path)) == [
+        ".headspace-manifest.jsonl",
+        "ffmpeg",
+        "session.mpeg",
+        "technique.m4a",
+    ]
+    assert (tmp_path / "technique.m4a").read_bytes() == b"copy:video"
+    entry = open_manifest(str(tmp_path)).get("technique")
+    assert entry.content_type == "audio/mp4"
+    assert entry.sha256 == file_sha256(str(tmp_path / "technique.m4a"))
+    # Converted files are not converted again
+    assert transcoder.convert(video) is None
+
+
+def test_format_encodes_what_cannot_be_copied(tmp_path, ffmpeg):
+    tasks = [
+        download(tmp_path, "encoded", "video/mp4", b"video"),
+        download(tmp_path, "session", "audio/mpeg", b"audio"),
+        download(tmp_path, "broken", "audio/mpeg", b"audio"),
+    ]
+    transcoder = Transcoder(locate, format_="m4a", workers=1, ffmpeg=ffmpeg)
+    for task in tasks:
+        transcoder.submit(task)
+    failures = transcoder.close()
+
+    assert (tmp_path / "encoded.m4a").read_bytes() == b"aac:video"
+    assert (tmp_path / "session.m4a").read_bytes() == b"aac:audio"
+    assert [message for message, _ in failures] == ["Failed to convert broken"]
+    # A failed conversion keeps the download
+    assert (tmp_path / "broken.mpeg").exists()
+    assert not (tmp_path / "broken.m4a.part").exists()
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+@pytest.mark.parametrize("format_", ["m4a", "opus"])
+def test_ffmpeg_converts_a_small_video(tmp_path, format_):
+    # One second of tone under a small test picture
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=duration=1",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc=duration=1:size=64x64",
+            "-c:a",
+            "aac",
+            "-shortest",
+            str(tmp_path / "fixture.mp4"),
+        ],
+        check=True,
+    )
+    task = download(
+        tmp_path, "technique", "video/mp4", (tmp_path / "fixture.mp4").read_bytes()
+    )
+    transcoder = Transcoder(locate, format_=format_, workers=1)
+    transcoder.submit(task)
+    assert transcoder.close() == []
+
+    probe = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", str(tmp_path / f"technique.{format_}")]
+        + ["-f", "null", "-"],
+        capture_output=True,
+    )
+    assert probe.returncode == 0
+    assert not (tmp_path / "technique.mp4").exists()
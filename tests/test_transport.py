@@ -0,0 +1,49 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from pyheadspace import transport
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    statuses = []
+
+    def do_GET(self):
+        status = self.statuses.pop(0) if self.statuses else 200
+        self.send_response(status)
+        if status == 429:
+            self.send_header("retry-after", "0")
+        self.send_header("content-length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(("127.0.0.1", 0), FlakyHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/"
+    server.shutdown()
+    server.server_close()
+
+
+def test_session_retries_throttled_and_failed_requests(server):
+    FlakyHandler.statuses = [429, 503]
+    response = transport.session.get(server)
+    assert response.status_code == 200
+    assert FlakyHandler.statuses == []
+
+
+def test_session_gives_up_after_configured_retries(server):
+    transport.configure(retries=1)
+    try:
+        FlakyHandler.statuses = [502, 502, 502]
+        response = transport.session.get(server)
+        assert response.status_code == 502
+    finally:
+        transport.configure(retries=transport.DEFAULT_RETRIES)